@@ -1,29 +1,87 @@
+from contextlib import asynccontextmanager
+import threading
+
 from fastapi import FastAPI
-from app.config.elasticsearch_config import create_index_if_not_exists
-from app.models.sentence_transformer import get_sentence_transformer
 from app.config.settings import settings
-from app.services.reranking import RerankingService
 
 
-embedding_model = get_sentence_transformer()
-es_client = create_index_if_not_exists(settings.elasticsearch.index_name)
-reranker_service = RerankingService()
+SERVICES = ("embedding_model", "es_client", "local_index", "async_es_client", "embedding_store", "reranker_service")
+
+_services = None
+_services_lock = threading.Lock()
+
+
+def _create_services() -> dict:
+    from app.config.elasticsearch_config import create_index_if_not_exists, get_async_es_client, get_es_client
+    from app.db.local_index import LocalVectorIndex
+    from app.models.sentence_transformer import get_sentence_transformer
+    from app.services.embedding_store import EmbeddingStore
+    from app.services.micro_batching import MicroBatchingEncoder
+    from app.services.reranking import get_reranking_service
+
+    embedding_model = get_sentence_transformer()
+    if settings.model.micro_batching:
+        embedding_model = MicroBatchingEncoder(
+            embedding_model, max_batch_size=settings.model.micro_batch_max_size, max_wait_ms=settings.model.micro_batch_wait_ms
+        )
+    if settings.retrieval_backend == "local":
+        es_client = get_es_client()
+        local_index = LocalVectorIndex(settings.local_index.path, dtype=settings.local_index.dtype)
+    else:
+        es_client = create_index_if_not_exists(settings.elasticsearch.index_name)
+        local_index = None
+    embedding_store = None
+    if settings.model.embedding_store:
+        embedding_store = EmbeddingStore(settings.model.embedding_store_path, settings.model.embedding_store_max_mb * 1024 * 1024)
+    return {
+        "embedding_model": embedding_model,
+        "es_client": es_client,
+        "local_index": local_index,
+        "async_es_client": get_async_es_client(),
+        "embedding_store": embedding_store,
+        "reranker_service": get_reranking_service(),
+    }
+
+
+def __getattr__(name: str):
+    # Models and clients are created on first use (`from app import embedding_model`), so processes that only
+    # need the pure modules of the package, such as the FHIR processing workers, do not load them
+    global _services
+    if name not in SERVICES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _services_lock:
+        if _services is None:
+            _services = _create_services()
+    return _services[name]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from app.services.ingestion_jobs import job_manager
+
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    await __getattr__("async_es_client").close()
+    embedding_store = __getattr__("embedding_store")
+    if embedding_store is not None:
+        # Writes the last_used updates of the recent hits
+        embedding_store.close()
 
 
 def create_app():
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
 
     from app.routes.database_endpoints import router as database_router
     from app.routes.llm_endpoints import router as llm_router
     from app.routes.openai_endpoints import router as openai_router
     from app.routes.evaluation_endpoints import router as evaluation_router
+    from app.routes.jobs_endpoints import router as jobs_router
 
     app.include_router(database_router, prefix="/database")
     app.include_router(llm_router, prefix="/generation")
     app.include_router(openai_router, prefix="/openai")
     app.include_router(evaluation_router, prefix="/evaluation")
+    app.include_router(jobs_router, prefix="/jobs")
 
     return app
-
-
-app = create_app()
@@ -1,4 +1,5 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+import numpy as np
 
 from app.config.settings import settings, logger
 
@@ -11,21 +12,81 @@ def get_es_client():
     )
 
 
-def get_mapping():
+def get_async_es_client():
+    """Asynchronous client for the FastAPI routes, keeping a pool of connections per node open."""
+    return AsyncElasticsearch(
+        hosts=[settings.elasticsearch.host],
+        basic_auth=(settings.elasticsearch.user, settings.elasticsearch.password),
+        max_retries=10,
+        connections_per_node=settings.elasticsearch.connections_per_node,
+    )
+
+
+def get_mapping(knn: bool = False, quantization: str = None):
+    """
+    Index mapping. With knn=True the embedding field is indexed in an HNSW graph so it can be
+    queried with the ES knn clause; vectors must be unit length when using dot_product similarity.
+
+    quantization="int8_hnsw" keeps float vectors but builds the HNSW graph on int8 quantized copies,
+    and quantization="byte" stores the vectors themselves as int8 (see to_index_vector), using cosine
+    similarity so scores keep the same range as float vectors. Defaults to ES_VECTOR_QUANTIZATION.
+    """
+    quantization = quantization or settings.elasticsearch.vector_quantization
+    if quantization not in ("none", "int8_hnsw", "byte"):
+        raise ValueError(f"Unsupported vector quantization: {quantization}")
+    embedding = {"type": "dense_vector", "dims": settings.elasticsearch.embedding_dims}
+    if quantization == "byte":
+        embedding["element_type"] = "byte"
+    if knn:
+        similarity = "cosine" if quantization == "byte" else settings.elasticsearch.knn_similarity
+        embedding.update({"index": True, "similarity": similarity})
+        if quantization == "int8_hnsw":
+            embedding["index_options"] = {"type": "int8_hnsw"}
+
     return {
         "mappings": {
             "properties": {
                 "content": {"type": "text"},
-                "embedding": {"type": "dense_vector", "dims": 384},
-                "metadata": {"type": "object"},
+                "embedding": embedding,
+                "metadata": {
+                    "type": "object",
+                    "properties": {
+                        "resource_id": {"type": "keyword"},
+                        "resource_type": {"type": "keyword"},
+                        "chunk_index": {"type": "integer"},
+                        "content_hash": {"type": "keyword"},
+                    },
+                },
             }
         }
     }
 
 
-def create_index_if_not_exists(index_name):
+def get_index_quantization(es_client, index_name: str) -> str:
+    """Vector quantization of an existing index, read from the mapping of its embedding field (see get_mapping)."""
+    mapping = es_client.indices.get_mapping(index=index_name)
+    embedding = next(iter(mapping.body.values()))["mappings"]["properties"]["embedding"]
+    if embedding.get("element_type") == "byte":
+        return "byte"
+    if embedding.get("index_options", {}).get("type") == "int8_hnsw":
+        return "int8_hnsw"
+    return "none"
+
+
+def to_index_vector(embedding, quantization: str = None):
+    """
+    Converts a normalized embedding to the format stored in the index: unchanged for float
+    vectors, scaled to [-127, 127] integers for byte vectors. Defaults to ES_VECTOR_QUANTIZATION.
+    """
+    quantization = quantization or settings.elasticsearch.vector_quantization
+    if quantization != "byte":
+        return embedding
+    return np.clip(np.rint(np.asarray(embedding, dtype=np.float32) * 127), -127, 127).astype(np.int8).tolist()
+
+
+def create_index_if_not_exists(index_name, knn: bool = settings.elasticsearch.retrieval_mode == "knn"):
     es_client = get_es_client()
     if not es_client.indices.exists(index=index_name):
-        es_client.indices.create(index=index_name, body=get_mapping())
+        es_client.indices.create(index=index_name, body=get_mapping(knn=knn))
         logger.info(f"Index '{index_name}' created.")
     return es_client
@@ -8,6 +8,37 @@ class ElasticsearchSettings:
         self.user = os.getenv("ES_USER", "elastic")
         self.password = os.getenv("ES_PASSWORD", "changeme")
         self.index_name = os.getenv("ES_INDEX_NAME", "fasten-index")
+        self.connections_per_node = int(os.getenv("ES_CONNECTIONS_PER_NODE", "25"))
+        self.search_cache_size = int(os.getenv("SEARCH_CACHE_SIZE", "256"))
+        # Bulk indexing: parallel streaming_bulk workers, request size limits and retries of 429 rejections
+        self.bulk_thread_count = int(os.getenv("ES_BULK_THREADS", "4"))
+        self.bulk_chunk_size = int(os.getenv("ES_BULK_CHUNK_SIZE", "500"))
+        self.bulk_max_chunk_bytes = int(os.getenv("ES_BULK_MAX_CHUNK_BYTES", str(10 * 1024 * 1024)))
+        self.bulk_max_retries = int(os.getenv("ES_BULK_MAX_RETRIES", "5"))
+        self.bulk_initial_backoff = float(os.getenv("ES_BULK_INITIAL_BACKOFF", "2"))
+        self.bulk_max_backoff = float(os.getenv("ES_BULK_MAX_BACKOFF", "60"))
+        # Bulk ingest mode: refreshes and replicas disabled during loads, optional force merge to this many segments after
+        self.bulk_ingest_mode = os.getenv("ES_BULK_INGEST_MODE", "false").lower() == "true"
+        self.force_merge_segments = int(os.getenv("ES_FORCE_MERGE_SEGMENTS", "1"))
+        # Vector search: "script_score" (exact, brute force) or "knn" (approximate, HNSW)
+        self.retrieval_mode = os.getenv("ES_RETRIEVAL_MODE", "script_score")
+        self.knn_num_candidates = int(os.getenv("ES_KNN_NUM_CANDIDATES", "100"))
+        self.knn_similarity = os.getenv("ES_KNN_SIMILARITY", "dot_product")
+        self.embedding_dims = int(os.getenv("ES_EMBEDDING_DIMS", "384"))
+        # Vector storage: "none" (float32), "int8_hnsw" (float vectors, int8 quantized HNSW graph) or "byte" (int8 vectors)
+        self.vector_quantization = os.getenv("ES_VECTOR_QUANTIZATION", "none")
+        # Hybrid score fusion: "sum" (boosted score sum) or "rrf" (reciprocal rank fusion)
+        self.fusion = os.getenv("ES_FUSION", "sum")
+        self.rrf_rank_constant = int(os.getenv("ES_RRF_RANK_CONSTANT", "60"))
+        self.rrf_window_size = int(os.getenv("ES_RRF_WINDOW_SIZE", "50"))
+
+
+class LocalIndexSettings:
+    def __init__(self):
+        app_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+        self.path = os.getenv("LOCAL_INDEX_PATH", os.path.join(app_dir, "data", "local_index"))
+        # float32 or float16
+        self.dtype = os.getenv("LOCAL_INDEX_DTYPE", "float32")
 
 
 class ModelsSettings:
@@ -16,6 +47,39 @@ class ModelsSettings:
         base_dir = os.path.dirname(os.path.abspath(__file__))
         # Embedding model
         self.embedding_model_name = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+        self.query_embedding_cache_size = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+        # Documents embedded per encode call during ingestion
+        self.embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+        # Persistent embedding cache (SQLite, float16 vectors keyed by model and text hash)
+        self.embedding_store = os.getenv("EMBEDDING_STORE", "true").lower() == "true"
+        self.embedding_store_path = os.getenv(
+            "EMBEDDING_STORE_PATH", os.path.abspath(os.path.join(base_dir, "..", "data", "embedding_store.sqlite"))
+        )
+        self.embedding_store_max_mb = int(os.getenv("EMBEDDING_STORE_MAX_MB", "1024"))
+        # Embedding backend: "torch" (fp32 or bf16) or "onnx" (fp32 or int8)
+        self.embedding_backend = os.getenv("EMBEDDING_BACKEND", "torch")
+        self.embedding_precision = os.getenv("EMBEDDING_PRECISION", "fp32")
+        # Reranker (cross-encoder)
+        self.reranker_model_name = os.getenv("RERANKER_MODEL_NAME", "BAAI/bge-reranker-v2-m3")
+        self.rerank_batch_size = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+        self.rerank_cache_size = int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+        # Rerank strategy: "full" scores every candidate with the reranker, "cascade" skips reranking when the
+        # hybrid margin is decisive and otherwise only rescores the survivors of a light cross-encoder
+        self.rerank_strategy = os.getenv("RERANK_STRATEGY", "full")
+        self.light_reranker_model_name = os.getenv("LIGHT_RERANKER_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+        self.rerank_skip_margin = float(os.getenv("RERANK_SKIP_MARGIN", "0.25"))
+        self.rerank_cascade_survivors = int(os.getenv("RERANK_CASCADE_SURVIVORS", "10"))
+        # Reranker backend: "torch" (FlagEmbedding) or "onnx" (onnxruntime, optionally int8 quantized)
+        self.reranker_backend = os.getenv("RERANKER_BACKEND", "torch")
+        self.reranker_onnx_quantize = os.getenv("RERANKER_ONNX_QUANTIZE", "true").lower() == "true"
+        # ONNX models are exported on first use into this folder
+        self.onnx_dir = os.getenv("ONNX_MODELS_DIR", os.path.abspath(os.path.join(base_dir, "..", "..", "models", "onnx")))
+        self.onnx_num_threads = int(os.getenv("ONNX_NUM_THREADS", "0"))
+        # Micro-batching of concurrent embedding and rerank calls: requests arriving within the wait window
+        # (or until the max size is reached) share one forward pass
+        self.micro_batching = os.getenv("MICRO_BATCHING", "true").lower() == "true"
+        self.micro_batch_wait_ms = float(os.getenv("MICRO_BATCH_WAIT_MS", "3"))
+        self.micro_batch_max_size = int(os.getenv("MICRO_BATCH_MAX_SIZE", "64"))
         # LLM host
         self.llm_host = os.getenv("LLM_HOST", "http://localhost:9090")
         # Conversation prompts
@@ -37,10 +101,31 @@ class ModelsSettings:
             return file.read().strip().replace("\n", " ")
 
 
+class ProcessingSettings:
+    def __init__(self):
+        # FHIR preprocessing worker processes (0 or 1: serial, in the calling thread) and resources sent per task
+        self.fhir_workers = int(os.getenv("FHIR_PROCESS_WORKERS", "0"))
+        self.fhir_chunk_size = int(os.getenv("FHIR_PROCESS_CHUNK_SIZE", "32"))
+
+
+class IngestionJobsSettings:
+    def __init__(self):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        # Background ingestion jobs: state (SQLite) and uploaded files are kept in this folder
+        self.dir = os.getenv("INGESTION_JOBS_DIR", os.path.abspath(os.path.join(base_dir, "..", "data", "ingestion_jobs")))
+        # Jobs processed concurrently
+        self.workers = int(os.getenv("INGESTION_JOB_WORKERS", "1"))
+
+
 class Settings:
     def __init__(self):
+        # Retrieval backend: "elasticsearch" or "local" (in-process exact vector index)
+        self.retrieval_backend = os.getenv("RETRIEVAL_BACKEND", "elasticsearch")
         self.elasticsearch = ElasticsearchSettings()
+        self.local_index = LocalIndexSettings()
         self.model = ModelsSettings()
+        self.processing = ProcessingSettings()
+        self.jobs = IngestionJobsSettings()
 
 
 settings = Settings()
@@ -0,0 +1,234 @@
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import asdict, dataclass, field
+import threading
+import time
+
+from elasticsearch import helpers
+
+from app.config.settings import logger, settings
+
+
+@dataclass
+class IndexingSummary:
+    indexed: int = 0
+    failed: list[dict] = field(default_factory=list)
+    elapsed_seconds: float = 0.0
+    # Filled in by idempotent ingestion: unchanged documents not reindexed, obsolete documents removed
+    skipped: int = 0
+    deleted: int = 0
+
+    @property
+    def docs_per_second(self) -> float:
+        return round(self.indexed / self.elapsed_seconds, 1) if self.elapsed_seconds > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "failed_count": len(self.failed), "docs_per_second": self.docs_per_second}
+
+
+class _SharedIterator:
+    """Thread-safe iterator, so several streaming_bulk workers can pull chunks from one action generator."""
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            return next(self._iterator)
+
+
+def _failure(item: dict) -> dict:
+    op_type, result = next(iter(item.items()))
+    error = result.get("error", {})
+    reason = f"{error.get('type')}: {error.get('reason')}" if isinstance(error, dict) else str(error)
+    return {"_id": result.get("_id"), "status": result.get("status"), "reason": reason}
+
+
+def index_actions(
+    es_client,
+    actions,
+    thread_count: int = settings.elasticsearch.bulk_thread_count,
+    chunk_size: int = settings.elasticsearch.bulk_chunk_size,
+    max_chunk_bytes: int = settings.elasticsearch.bulk_max_chunk_bytes,
+    max_retries: int = settings.elasticsearch.bulk_max_retries,
+    initial_backoff: float = settings.elasticsearch.bulk_initial_backoff,
+    max_backoff: float = settings.elasticsearch.bulk_max_backoff,
+) -> IndexingSummary:
+    """
+    Indexes ES bulk actions with thread_count streaming_bulk workers sharing the action stream.
+    Requests hold up to chunk_size documents and max_chunk_bytes bytes; documents rejected with
+    429 are retried up to max_retries times with exponential backoff (initial_backoff * 2**attempt,
+    capped at max_backoff). Other failures don't stop the load and are reported in the summary.
+    """
+    shared_actions = _SharedIterator(actions)
+    summaries = [IndexingSummary() for _ in range(max(thread_count, 1))]
+    errors = []
+
+    def worker(summary: IndexingSummary):
+        try:
+            for ok, item in helpers.streaming_bulk(
+                es_client,
+                shared_actions,
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_chunk_bytes,
+                max_retries=max_retries,
+                initial_backoff=initial_backoff,
+                max_backoff=max_backoff,
+                raise_on_error=False,
+                raise_on_exception=False,
+            ):
+                if ok:
+                    summary.indexed += 1
+                else:
+                    summary.failed.append(_failure(item))
+        except Exception as e:
+            # Errors raised while producing the actions (e.g. a malformed upload) abort the load
+            errors.append(e)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(summary,)) for summary in summaries]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    total = IndexingSummary(elapsed_seconds=time.perf_counter() - start)
+    for summary in summaries:
+        total.indexed += summary.indexed
+        total.failed.extend(summary.failed)
+    if errors:
+        raise errors[0]
+    logger.info(
+        f"Bulk indexing: {total.indexed} indexed, {len(total.failed)} failed, {total.docs_per_second} docs/sec "
+        f"({thread_count} threads, chunks of {chunk_size} docs / {max_chunk_bytes} bytes)"
+    )
+    return total
+
+
+# Seconds a cancelled task waits for its indexing thread to return (at most one bulk request per worker thread)
+INDEXING_STOP_TIMEOUT = 60.0
+
+
+class IndexingCancelled(Exception):
+    pass
+
+
+async def index_in_thread(index, actions, stop_timeout: float = INDEXING_STOP_TIMEOUT):
+    """
+    Runs index(actions) (e.g. index_actions or LocalVectorIndex.bulk) in a worker thread and returns its result.
+    When the calling task is cancelled, the actions stop at the next one consumed and the thread is waited for,
+    up to stop_timeout seconds, before the cancellation propagates: nothing keeps writing to the index once
+    the caller has moved on (restored the index settings, closed the clients or handed a job to another worker).
+    """
+    stop = threading.Event()
+
+    def stoppable(actions):
+        for action in actions:
+            if stop.is_set():
+                raise IndexingCancelled("Indexing cancelled")
+            yield action
+
+    thread_task = asyncio.ensure_future(asyncio.to_thread(index, stoppable(actions)))
+    try:
+        return await asyncio.shield(thread_task)
+    except asyncio.CancelledError:
+        stop.set()
+        deadline = time.monotonic() + stop_timeout
+        while not thread_task.done() and time.monotonic() < deadline:
+            try:
+                await asyncio.wait({thread_task}, timeout=deadline - time.monotonic())
+            except asyncio.CancelledError:
+                continue
+        if not thread_task.done():
+            logger.warning(f"Indexing thread still running {stop_timeout}s after the cancellation")
+        elif not thread_task.cancelled() and thread_task.exception() is not None:
+            # Retrieved so it is not reported as never retrieved, the cancellation is what propagates
+            logger.debug(f"Cancelled indexing stopped with: {thread_task.exception()!r}")
+        raise
+
+
+BULK_INGEST_SETTINGS = {"index.refresh_interval": "-1", "index.number_of_replicas": "0"}
+
+# Indices in bulk ingest mode: number of loads in progress and the settings to restore after the last one
+_ingest_sessions = {}
+_ingest_lock = threading.Lock()
+
+
+def in_bulk_ingest_mode(index_name: str) -> bool:
+    return index_name in _ingest_sessions
+
+
+def _enter_bulk_ingest(es_client, index_name: str):
+    with _ingest_lock:
+        session = _ingest_sessions.get(index_name)
+        if session is not None:
+            session["loads"] += 1
+            return
+        current = es_client.indices.get_settings(index=index_name, name=list(BULK_INGEST_SETTINGS), flat_settings=True)
+        current = next(iter(current.body.values()))["settings"]
+        # Unset settings are restored as None, which resets them to the index default
+        original = {name: current.get(name) for name in BULK_INGEST_SETTINGS}
+        if original == BULK_INGEST_SETTINGS:
+            # Left over by a load that did not exit (e.g. a crash): restoring them would keep refreshes disabled
+            logger.warning(f"Index {index_name} is already in bulk ingest mode, its settings will be reset to the defaults")
+            original = {name: None for name in BULK_INGEST_SETTINGS}
+        elif original["index.refresh_interval"] == "-1":
+            logger.warning(f"Index {index_name} already has refreshes disabled, they will stay disabled after the load")
+        es_client.indices.put_settings(index=index_name, settings=BULK_INGEST_SETTINGS)
+        _ingest_sessions[index_name] = {"loads": 1, "original": original}
+        logger.info(f"Bulk ingest mode enabled on {index_name} (previous settings: {original})")
+
+
+def _exit_bulk_ingest(es_client, index_name: str, max_num_segments: int, completed: bool):
+    with _ingest_lock:
+        session = _ingest_sessions[index_name]
+        session["loads"] -= 1
+        if session["loads"] > 0:
+            return
+        del _ingest_sessions[index_name]
+        try:
+            es_client.indices.put_settings(index=index_name, settings=session["original"])
+        except Exception:
+            logger.error(f"Failed to restore the settings of {index_name}, set them back manually: {session['original']}")
+            raise
+        finally:
+            es_client.indices.refresh(index=index_name)
+        logger.info(f"Bulk ingest mode disabled on {index_name}")
+    # Merging a partial load would be wasted work, it is merged by the next complete one
+    if completed and max_num_segments:
+        start = time.perf_counter()
+        es_client.indices.forcemerge(index=index_name, max_num_segments=max_num_segments)
+        logger.info(f"Force merged {index_name} to {max_num_segments} segments in {time.perf_counter() - start:.1f}s")
+
+
+@contextmanager
+def bulk_ingest_mode(es_client, index_name: str, max_num_segments: int = None):
+    """
+    Disables refreshes and replicas of index_name for the duration of a bulk load. The previous settings
+    are restored and the index refreshed on exit, also when the load fails; after a complete load the
+    index is force merged to max_num_segments segments if given. Concurrent or nested loads into the
+    same index share the mode, which is only left when the last one exits.
+    """
+    _enter_bulk_ingest(es_client, index_name)
+    completed = False
+    try:
+        yield
+        completed = True
+    finally:
+        _exit_bulk_ingest(es_client, index_name, max_num_segments, completed)
+
+
+@asynccontextmanager
+async def async_bulk_ingest_mode(es_client, index_name: str, max_num_segments: int = None):
+    """bulk_ingest_mode for async code: the settings requests run in a worker thread with the sync client."""
+    await asyncio.to_thread(_enter_bulk_ingest, es_client, index_name)
+    completed = False
+    try:
+        yield
+        completed = True
+    finally:
+        await asyncio.to_thread(_exit_bulk_ingest, es_client, index_name, max_num_segments, completed)
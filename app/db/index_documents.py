@@ -1,22 +1,319 @@
-def bulk_load_fhir_data(data: list[dict], text_key: str, embedding_model, index_name):
+import asyncio
+from collections import Counter
+from contextlib import nullcontext
+from functools import partial
+import hashlib
+from itertools import islice
+import time
+
+from app import embedding_store, es_client, local_index
+from app.db.bulk_indexer import IndexingSummary, async_bulk_ingest_mode, in_bulk_ingest_mode, index_actions, index_in_thread
+from app.config.elasticsearch_config import to_index_vector
+from app.config.settings import logger, settings
+from app.models.sentence_transformer import embedding_model_key
+from app.services.search_documents import invalidate_search_cache
+
+
+def batched(iterable, batch_size: int):
+    """Yields lists of up to batch_size consecutive items of iterable."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def embed_documents(contents: list[str], embedding_model, batch_size: int, use_embedding_store: bool = True) -> list:
+    """
+    Normalized embeddings of contents, in input order. Contents found in the embedding store are not
+    encoded again (unless use_embedding_store=False); the others are encoded longest first in one encode
+    call, so each forward pass holds documents of similar length and little padding.
+    """
+
+    def encode(texts: list[str]) -> list:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i] or ""), reverse=True)
+        encoded = embedding_model.encode(
+            [texts[i] for i in order], batch_size=batch_size, show_progress_bar=False, normalize_embeddings=True
+        )
+        embeddings = [None] * len(texts)
+        for position, i in enumerate(order):
+            embeddings[i] = encoded[position]
+        return embeddings
+
+    if embedding_store is None or not use_embedding_store:
+        return encode(contents)
+    return embedding_store.encode(contents, embedding_model_key(), encode)
+
+
+def content_hash(content) -> str:
+    return hashlib.sha256(str(content).encode("utf-8")).hexdigest()
+
+
+def document_id(resource_id, chunk_index: int, content_digest: str) -> str:
+    """
+    Deterministic _id: re-ingesting the same chunk overwrites it instead of adding a duplicate. Documents
+    without a resource_id have no chunk position that survives edits of the upload, so their _id is the
+    hash of their content alone.
+    """
+    if resource_id is None:
+        return f"content:{content_digest[:32]}"
+    return f"{resource_id}:{chunk_index}:{content_digest[:16]}"
+
+
+def find_existing_ids(ids: list[str], index_name) -> set[str]:
+    """Ids of the retrieval backend that already hold one of ids, looked up without fetching the documents."""
+    if not ids:
+        return set()
+    if local_index is not None:
+        return local_index.existing_ids(ids)
+    response = es_client.mget(index=index_name, ids=ids, source=False)
+    return {doc["_id"] for doc in response["docs"] if doc.get("found")}
+
+
+def bulk_load_fhir_data(
+    data: list[dict],
+    text_key: str,
+    embedding_model,
+    index_name,
+    batch_size: int = settings.model.embedding_batch_size,
+    skip_existing: bool = False,
+    seen_ids: dict = None,
+    use_embedding_store: bool = True,
+):
     """
-    Function to load in bulk mode a FHIR data
+    Function to load in bulk mode a FHIR data.
+    Documents are embedded batch_size at a time and actions are yielded in the order of data.
+
+    Each document gets a deterministic _id from its resource_id, its chunk index within the resource
+    and the hash of its content; documents without a resource_id get an _id from their content only
+    (see document_id), and repeated contents among them are indexed once. With skip_existing=True,
+    documents whose _id is already indexed (same chunk, unchanged content) are neither embedded nor
+    yielded. The _ids of every document of data, skipped or not, are collected by resource_id into
+    seen_ids if given. use_embedding_store=False encodes every document, even those in the embedding store.
     """
-    for value in data:
-        resource_id = value.get("resource_id")
-        resource_type = value.get("resource_type")
-        resource = value.get(text_key)
-        embedding = embedding_model.encode(resource)
+    chunk_counts = Counter()
+    content_ids = set()
+    for batch in batched(data, batch_size):
+        documents = []
+        for value in batch:
+            resource_id = value.get("resource_id")
+            digest = content_hash(value.get(text_key))
+            if resource_id is None:
+                chunk_index = 0
+                doc_id = document_id(None, chunk_index, digest)
+                if doc_id in content_ids:
+                    continue
+                content_ids.add(doc_id)
+            else:
+                chunk_index = chunk_counts[resource_id]
+                chunk_counts[resource_id] += 1
+                doc_id = document_id(resource_id, chunk_index, digest)
+            documents.append((doc_id, chunk_index, digest, value))
+            if seen_ids is not None:
+                seen_ids.setdefault(resource_id, set()).add(doc_id)
+
+        if skip_existing:
+            existing = find_existing_ids([doc_id for doc_id, _, _, _ in documents], index_name)
+            documents = [document for document in documents if document[0] not in existing]
+        if not documents:
+            continue
+        contents = [value.get(text_key) for _, _, _, value in documents]
+        embeddings = embed_documents(contents, embedding_model, batch_size, use_embedding_store)
+        for (doc_id, chunk_index, digest, value), embedding in zip(documents, embeddings):
+            resource_id = value.get("resource_id")
+            resource_type = value.get("resource_type")
+            resource = value.get(text_key)
+            if local_index is None:
+                embedding = to_index_vector(embedding)
+
+            metadata = {
+                "resource_id": resource_id,
+                "resource_type": resource_type,
+                "chunk_index": chunk_index,
+                "content_hash": digest,
+            }
+
+            if "tokens_evaluated" in value:
+                metadata["tokens_evaluated"] = value["tokens_evaluated"]
+            if "tokens_predicted" in value:
+                metadata["tokens_predicted"] = value["tokens_predicted"]
+            if "prompt_ms" in value:
+                metadata["prompt_ms"] = value["prompt_ms"]
+            if "predicted_ms" in value:
+                metadata["predicted_ms"] = value["predicted_ms"]
+
+            yield {
+                "_index": index_name,
+                "_id": doc_id,
+                "_source": {"content": resource, "embedding": embedding, "metadata": metadata},
+            }
 
-        metadata = {"resource_id": resource_id, "resource_type": resource_type}
 
-        if "tokens_evaluated" in value:
-            metadata["tokens_evaluated"] = value["tokens_evaluated"]
-        if "tokens_predicted" in value:
-            metadata["tokens_predicted"] = value["tokens_predicted"]
-        if "prompt_ms" in value:
-            metadata["prompt_ms"] = value["prompt_ms"]
-        if "predicted_ms" in value:
-            metadata["predicted_ms"] = value["predicted_ms"]
+def stale_documents_queries(seen_ids: dict, indexed_resource_ids=(), terms_per_query: int = 1000) -> list[dict]:
+    """
+    Queries matching the documents made obsolete by an ingestion: older chunks of the ingested resources
+    (changed content, fewer chunks, or ids from before deterministic ids) and every document of the
+    indexed_resource_ids that are not part of the ingested data. None stands for the documents without a
+    resource id, which are missing unless ingested (seen_ids[None]). Terms queries hold at most
+    terms_per_query resource ids, below the index max_terms_count.
+    """
+    resource_ids = [resource_id for resource_id in seen_ids if resource_id is not None]
+    queries = []
+    for chunk in batched(resource_ids, terms_per_query):
+        current_ids = sorted(doc_id for resource_id in chunk for doc_id in seen_ids[resource_id])
+        queries.append(
+            {
+                "bool": {
+                    "filter": [{"terms": {"metadata.resource_id": chunk}}],
+                    "must_not": [{"ids": {"values": current_ids}}],
+                }
+            }
+        )
+    missing_ids = [resource_id for resource_id in indexed_resource_ids if resource_id is not None and resource_id not in seen_ids]
+    if None in indexed_resource_ids:
+        must_not = [{"exists": {"field": "metadata.resource_id"}}]
+        if seen_ids.get(None):
+            must_not.append({"ids": {"values": sorted(seen_ids[None])}})
+        queries.append({"bool": {"must_not": must_not}})
+    for chunk in batched(missing_ids, terms_per_query):
+        queries.append({"bool": {"filter": [{"terms": {"metadata.resource_id": chunk}}]}})
+    return queries
+
+
+async def check_resource_id_mapping(index_name, async_es_client):
+    """
+    Raises ValueError unless metadata.resource_id is a keyword field, which the stale documents queries need.
+    Indices created before it was mapped have a dynamic text field, on which their terms queries match nothing.
+    """
+    response = await async_es_client.indices.get_field_mapping(index=index_name, fields="metadata.resource_id")
+    mappings = next(iter(response.body.values()), {}).get("mappings", {})
+    field_type = mappings.get("metadata.resource_id", {}).get("mapping", {}).get("resource_id", {}).get("type")
+    if field_type != "keyword":
+        raise ValueError(
+            f"metadata.resource_id of {index_name} must be a keyword field to delete stale documents safely (found: "
+            f"{field_type or 'no mapping'}). Reindex the documents into an index created with the current mapping."
+        )
+
+
+async def iter_indexed_resource_ids(index_name, async_es_client, page_size: int = 1000):
+    """Distinct metadata.resource_id values of the index, None for documents without one, paged with a composite aggregation."""
+    after_key = None
+    while True:
+        composite = {
+            "size": page_size,
+            "sources": [{"resource_id": {"terms": {"field": "metadata.resource_id", "missing_bucket": True}}}],
+        }
+        if after_key is not None:
+            composite["after"] = after_key
+        response = await async_es_client.search(index=index_name, size=0, aggs={"resource_ids": {"composite": composite}})
+        aggregation = response["aggregations"]["resource_ids"]
+        for bucket in aggregation["buckets"]:
+            yield bucket["key"]["resource_id"]
+        after_key = aggregation.get("after_key")
+        if not aggregation["buckets"] or after_key is None:
+            return
+
+
+async def async_delete_stale_documents(seen_ids: dict, index_name, async_es_client, delete_missing: bool = False) -> int:
+    """Deletes the documents matched by stale_documents_queries. Returns the number of documents deleted."""
+    if local_index is not None:
+        resource_ids = {resource_id for resource_id in seen_ids if resource_id is not None}
+
+        def is_stale(document: dict) -> bool:
+            resource_id = document["metadata"].get("resource_id")
+            if resource_id in resource_ids:
+                return document["id"] not in seen_ids[resource_id]
+            # Missing documents, including those without a resource id that are not part of the ingested data
+            return delete_missing and bool(resource_ids) and document["id"] not in seen_ids.get(resource_id, ())
+
+        return await asyncio.to_thread(local_index.delete_documents, is_stale)
+
+    await check_resource_id_mapping(index_name, async_es_client)
+    indexed_resource_ids = []
+    if delete_missing and any(resource_id is not None for resource_id in seen_ids):
+        # Listed before anything is deleted, so the queries are built from one consistent view of the index
+        indexed_resource_ids = [resource_id async for resource_id in iter_indexed_resource_ids(index_name, async_es_client)]
+    deleted = 0
+    for query in stale_documents_queries(seen_ids, indexed_resource_ids):
+        response = await async_es_client.delete_by_query(index=index_name, query=query, conflicts="proceed")
+        deleted += response["deleted"]
+    return deleted
+
+
+def ingest_mode(index_name, bulk_ingest: bool, force_merge: bool = False):
+    """Async context of a load into index_name: bulk ingest mode if requested on Elasticsearch, otherwise a no-op."""
+    if not bulk_ingest or local_index is not None:
+        return nullcontext()
+    max_num_segments = settings.elasticsearch.force_merge_segments if force_merge else None
+    return async_bulk_ingest_mode(es_client, index_name, max_num_segments=max_num_segments)
+
+
+async def async_index_fhir_data(
+    data: list[dict],
+    text_key: str,
+    embedding_model,
+    index_name,
+    async_es_client,
+    skip_existing: bool = True,
+    delete_missing: bool = False,
+    bulk_ingest: bool = False,
+    force_merge: bool = False,
+    **bulk_options,
+) -> IndexingSummary:
+    """
+    Embeds and indexes the data into the configured retrieval backend (Elasticsearch or the local index).
+    On Elasticsearch, embedding and indexing run in worker threads through index_actions, which accepts
+    bulk_options (thread_count, chunk_size, max_chunk_bytes, ...). Returns the indexing summary. If the
+    task is cancelled, the indexing threads are stopped and waited for before the cancellation propagates.
+
+    Ingestion is idempotent: unchanged documents are skipped (skip_existing), outdated chunks of the
+    ingested resources are deleted, and with delete_missing=True so are the resources absent from data.
+
+    With bulk_ingest=True the Elasticsearch index is in bulk ingest mode (no refreshes, no replicas) for
+    the duration of the load, and force merged afterwards if force_merge=True.
+
+    Stale documents are only deleted from Elasticsearch indices whose metadata.resource_id is a keyword
+    field; on older indices a load with delete_missing=True raises ValueError before indexing anything.
+    """
+    delete_stale = True
+    if local_index is None:
+        try:
+            await check_resource_id_mapping(index_name, async_es_client)
+        except ValueError as e:
+            if delete_missing:
+                raise
+            logger.warning(f"{e} Outdated chunks of the ingested resources are kept.")
+            delete_stale = False
+    seen_ids = {}
+    actions = bulk_load_fhir_data(
+        data, text_key, embedding_model=embedding_model, index_name=index_name, skip_existing=skip_existing, seen_ids=seen_ids
+    )
+    try:
+        async with ingest_mode(index_name, bulk_ingest, force_merge):
+            if local_index is not None:
+                start = time.perf_counter()
+                indexed = await index_in_thread(local_index.bulk, actions)
+                summary = IndexingSummary(indexed=indexed, elapsed_seconds=time.perf_counter() - start)
+            else:
+                summary = await index_in_thread(partial(index_actions, es_client, **bulk_options), actions)
+            summary.skipped = sum(len(ids) for ids in seen_ids.values()) - summary.indexed - len(summary.failed)
+            # Failed documents keep their previous version, so only clean up after a complete load
+            if not summary.failed and delete_stale:
+                if local_index is None and in_bulk_ingest_mode(index_name):
+                    # delete_by_query only sees refreshed documents, stale ones may come from earlier loads of the session
+                    await async_es_client.indices.refresh(index=index_name)
+                summary.deleted = await async_delete_stale_documents(seen_ids, index_name, async_es_client, delete_missing)
+        # Make the new documents searchable before cached results are invalidated (done when leaving bulk ingest mode)
+        if local_index is None and not in_bulk_ingest_mode(index_name) and not bulk_ingest:
+            await async_es_client.indices.refresh(index=index_name)
+        return summary
+    finally:
+        invalidate_search_cache()
+
 
-        yield {"_index": index_name, "_source": {"content": resource, "embedding": embedding, "metadata": metadata}}
+async def async_delete_all_documents(async_es_client, index_name):
+    try:
+        if local_index is not None:
+            await asyncio.to_thread(local_index.delete_all)
+        else:
+            await async_es_client.delete_by_query(index=index_name, body={"query": {"match_all": {}}}, refresh=True)
+    finally:
+        invalidate_search_cache()
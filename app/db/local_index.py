@@ -0,0 +1,256 @@
+from collections import Counter, defaultdict
+import json
+import math
+import os
+import re
+import threading
+import uuid
+
+import numpy as np
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class InvertedIndex:
+    """In-memory BM25 index over the document contents, the lexical leg of the local backend."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.doc_lengths = []
+
+    def build(self, contents: list[str]):
+        self.postings = defaultdict(dict)
+        self.doc_lengths = []
+        for doc_idx, content in enumerate(contents):
+            tokens = tokenize(content)
+            self.doc_lengths.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                self.postings[token][doc_idx] = tf
+
+    def scores(self, query_text: str) -> np.ndarray:
+        n_docs = len(self.doc_lengths)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        if n_docs == 0:
+            return scores
+        avg_length = sum(self.doc_lengths) / n_docs
+        for token in set(tokenize(query_text)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_idx, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_idx] / avg_length)
+                scores[doc_idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+class IndexSnapshot:
+    """
+    Contents of a LocalVectorIndex at one point in time. Snapshots are never modified: writes build a new
+    one and swap it in, so a search reads consistent documents, embedding rows and BM25 statistics.
+    """
+
+    def __init__(self, embeddings: np.ndarray = None, documents: list[dict] = None):
+        self.embeddings = embeddings
+        self.documents = documents or []
+        self.row_by_id = {document["id"]: row for row, document in enumerate(self.documents)}
+        self.inverted_index = InvertedIndex()
+        self.inverted_index.build([document["content"] for document in self.documents])
+
+
+class LocalVectorIndex:
+    """
+    Exact in-process retrieval backend for small (single patient) indices.
+
+    Embeddings live in a contiguous matrix persisted as a memory-mapped embeddings.npy, with a
+    documents.jsonl side table holding the id, content and metadata of each row. Vector search is a
+    single matrix-vector product plus argpartition; lexical search uses an in-memory BM25 index.
+    Results are returned as ES-shaped hits so they go through the same post-processing as Elasticsearch.
+
+    Writes are serialized and prepare their changes on copies, which replace the current snapshot only
+    once saved: a write that fails midway (e.g. a malformed upload or a cancelled job) leaves the index unchanged.
+    """
+
+    def __init__(self, path: str, dtype: str = "float32"):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.embeddings_file = os.path.join(path, "embeddings.npy")
+        self.documents_file = os.path.join(path, "documents.jsonl")
+        # _write_lock serializes writes for their whole duration, _lock only guards the snapshot swap
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._snapshot = self._load()
+
+    def snapshot(self) -> IndexSnapshot:
+        with self._lock:
+            return self._snapshot
+
+    def _swap(self, snapshot: IndexSnapshot):
+        with self._lock:
+            self._snapshot = snapshot
+
+    def _load(self) -> IndexSnapshot:
+        if os.path.exists(self.embeddings_file) and os.path.exists(self.documents_file):
+            with open(self.documents_file, "r") as f:
+                documents = [json.loads(line) for line in f]
+            return IndexSnapshot(np.load(self.embeddings_file, mmap_mode="r"), documents)
+        return IndexSnapshot()
+
+    def _save(self, embeddings: np.ndarray, documents: list[dict]) -> IndexSnapshot:
+        # Write to temporary files and swap them in, so readers never see a half written index
+        embeddings_tmp = os.path.join(self.path, "embeddings.tmp.npy")
+        documents_tmp = os.path.join(self.path, "documents.tmp.jsonl")
+        np.save(embeddings_tmp, embeddings)
+        with open(documents_tmp, "w") as f:
+            for document in documents:
+                f.write(json.dumps(document) + "\n")
+        os.replace(embeddings_tmp, self.embeddings_file)
+        os.replace(documents_tmp, self.documents_file)
+        return self._load()
+
+    def __len__(self):
+        return len(self.snapshot().documents)
+
+    def bulk(self, actions) -> int:
+        """
+        Indexes ES bulk actions ({"_id"?, "_source": {"content", "embedding", "metadata"}}), e.g. from
+        bulk_load_fhir_data. Actions with the _id of an existing document replace it. Returns the number of actions.
+        If consuming the actions raises, nothing is indexed.
+        """
+        with self._write_lock:
+            current = self.snapshot()
+            documents = list(current.documents)
+            row_by_id = dict(current.row_by_id)
+            embeddings = [] if current.embeddings is None else list(np.asarray(current.embeddings))
+            indexed = 0
+            for action in actions:
+                source = action["_source"]
+                doc_id = action.get("_id") or uuid.uuid4().hex
+                document = {"id": doc_id, "content": str(source.get("content", "")), "metadata": source.get("metadata", {})}
+                embedding = np.asarray(source["embedding"], dtype=self.dtype)
+                row = row_by_id.get(doc_id)
+                if row is None:
+                    row_by_id[doc_id] = len(documents)
+                    documents.append(document)
+                    embeddings.append(embedding)
+                else:
+                    documents[row] = document
+                    embeddings[row] = embedding
+                indexed += 1
+            if indexed:
+                self._swap(self._save(np.vstack(embeddings).astype(self.dtype), documents))
+            return indexed
+
+    def _clear(self):
+        for file in (self.embeddings_file, self.documents_file):
+            if os.path.exists(file):
+                os.remove(file)
+        self._swap(IndexSnapshot())
+
+    def delete_all(self):
+        with self._write_lock:
+            self._clear()
+
+    def existing_ids(self, ids: list[str]) -> set[str]:
+        row_by_id = self.snapshot().row_by_id
+        return {doc_id for doc_id in ids if doc_id in row_by_id}
+
+    def delete_documents(self, predicate) -> int:
+        """Deletes the documents for which predicate(document) is true. Returns the number of documents deleted."""
+        with self._write_lock:
+            current = self.snapshot()
+            keep = [row for row, document in enumerate(current.documents) if not predicate(document)]
+            deleted = len(current.documents) - len(keep)
+            if not keep:
+                self._clear()
+            elif deleted:
+                embeddings = np.asarray(current.embeddings)[keep]
+                self._swap(self._save(embeddings, [current.documents[row] for row in keep]))
+            return deleted
+
+    def iter_documents(self):
+        yield from self.snapshot().documents
+
+    @staticmethod
+    def _mask(snapshot: IndexSnapshot, resource_types: list[str] = None, resource_ids: list[str] = None) -> np.ndarray:
+        mask = np.ones(len(snapshot.documents), dtype=bool)
+        if resource_types:
+            types = set(resource_types)
+            mask &= np.array([document["metadata"].get("resource_type") in types for document in snapshot.documents])
+        if resource_ids:
+            ids = set(resource_ids)
+            mask &= np.array([document["metadata"].get("resource_id") in ids for document in snapshot.documents])
+        return mask
+
+    def _top_k(self, scores: np.ndarray, size: int) -> list[int]:
+        candidates = np.flatnonzero(scores > -np.inf)
+        if len(candidates) > size:
+            candidates = candidates[np.argpartition(-scores[candidates], size - 1)[:size]]
+        return candidates[np.argsort(-scores[candidates], kind="stable")].tolist()
+
+    @staticmethod
+    def _hit(snapshot: IndexSnapshot, row: int, score: float) -> dict:
+        document = snapshot.documents[row]
+        return {
+            "_id": document["id"],
+            "_score": float(score),
+            "_source": {"content": document["content"], "metadata": document["metadata"]},
+        }
+
+    def search(
+        self,
+        query_text: str,
+        query_embedding: list,
+        size: int,
+        text_boost: float = 0.25,
+        embedding_boost: float = 4.0,
+        resource_types: list[str] = None,
+        resource_ids: list[str] = None,
+    ) -> list[dict]:
+        """
+        Hybrid search with the same semantics as the Elasticsearch fusion="sum" query:
+        text_boost * BM25 + embedding_boost * max(cosine, 0).
+        """
+        snapshot = self.snapshot()
+        if not snapshot.documents:
+            return []
+        lexical_scores, vector_scores = self._leg_scores(snapshot, query_text, query_embedding)
+        scores = text_boost * lexical_scores + embedding_boost * np.maximum(vector_scores, 0)
+        scores[~self._mask(snapshot, resource_types, resource_ids)] = -np.inf
+        return [self._hit(snapshot, row, scores[row]) for row in self._top_k(scores, size)]
+
+    def search_legs(
+        self,
+        query_text: str,
+        query_embedding: list,
+        size: int,
+        resource_types: list[str] = None,
+        resource_ids: list[str] = None,
+    ) -> list[list[dict]]:
+        """Lexical and vector rankings computed separately, to be merged with reciprocal rank fusion."""
+        snapshot = self.snapshot()
+        if not snapshot.documents:
+            return [[], []]
+        lexical_scores, vector_scores = self._leg_scores(snapshot, query_text, query_embedding)
+        mask = self._mask(snapshot, resource_types, resource_ids)
+        # Documents without any query term are not part of the lexical ranking, as in ES
+        lexical_scores[~mask | (lexical_scores <= 0)] = -np.inf
+        vector_scores[~mask] = -np.inf
+        return [
+            [self._hit(snapshot, row, lexical_scores[row]) for row in self._top_k(lexical_scores, size)],
+            [self._hit(snapshot, row, vector_scores[row]) for row in self._top_k(vector_scores, size)],
+        ]
+
+    @staticmethod
+    def _leg_scores(snapshot: IndexSnapshot, query_text: str, query_embedding: list) -> tuple[np.ndarray, np.ndarray]:
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        vector_scores = np.asarray(snapshot.embeddings, dtype=np.float32) @ query_vector
+        return snapshot.inverted_index.scores(query_text), vector_scores
@@ -0,0 +1,95 @@
+"""
+Reindex an existing index into the current mapping: keyword metadata fields and, by default,
+the knn mapping (indexed dense_vector with HNSW).
+
+Embeddings are re-normalized on the way so they are valid for dot_product similarity.
+
+Usage:
+    python -m app.db.migrate_index --source fasten-index --dest fasten-index-knn
+"""
+
+import argparse
+
+import numpy as np
+from elasticsearch import helpers
+
+from app.config.elasticsearch_config import get_es_client, get_mapping, to_index_vector
+from app.db.bulk_indexer import bulk_ingest_mode, index_actions
+from app.config.settings import logger, settings
+
+
+def normalize_embedding(embedding: list) -> list:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return vector.tolist()
+    return (vector / norm).tolist()
+
+
+def reindex_actions(es_client, source_index: str, dest_index: str, scroll_size: int, quantization: str):
+    for hit in helpers.scan(es_client, index=source_index, query={"query": {"match_all": {}}}, size=scroll_size):
+        source = hit["_source"]
+        if "embedding" in source:
+            source["embedding"] = to_index_vector(normalize_embedding(source["embedding"]), quantization=quantization)
+        yield {"_index": dest_index, "_id": hit["_id"], "_source": source}
+
+
+def migrate_to_knn_index(
+    es_client,
+    source_index: str,
+    dest_index: str,
+    scroll_size: int = 500,
+    knn: bool = True,
+    quantization: str = settings.elasticsearch.vector_quantization,
+    max_num_segments: int = None,
+) -> int:
+    """
+    Create dest_index with the current mapping (knn or not, with the given vector quantization)
+    and copy every document of source_index into it, in bulk ingest mode (then force merged to
+    max_num_segments segments if given). The source must hold float vectors.
+    Returns the number of documents indexed.
+    """
+    if es_client.indices.exists(index=dest_index):
+        raise ValueError(f"Destination index '{dest_index}' already exists.")
+
+    es_client.indices.create(index=dest_index, body=get_mapping(knn=knn, quantization=quantization))
+    logger.info(f"Index '{dest_index}' created with {'knn' if knn else 'script_score'} mapping, quantization '{quantization}'.")
+
+    with bulk_ingest_mode(es_client, dest_index, max_num_segments=max_num_segments):
+        summary = index_actions(es_client, reindex_actions(es_client, source_index, dest_index, scroll_size, quantization))
+    if summary.failed:
+        raise RuntimeError(f"{len(summary.failed)} documents could not be reindexed, first failure: {summary.failed[0]}")
+    logger.info(f"Reindexed {summary.indexed} documents from '{source_index}' into '{dest_index}'.")
+    return summary.indexed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reindex an existing index into the knn (HNSW) mapping.")
+    parser.add_argument("--source", required=True, help="Index to read documents from.")
+    parser.add_argument("--dest", required=True, help="New index to create with the knn mapping.")
+    parser.add_argument("--scroll-size", type=int, default=500, help="Documents fetched per scroll page.")
+    parser.add_argument("--no-knn", action="store_true", help="Keep the embedding field unindexed (script_score mode).")
+    parser.add_argument(
+        "--quantization",
+        default=settings.elasticsearch.vector_quantization,
+        choices=["none", "int8_hnsw", "byte"],
+        help="Vector storage of the new index.",
+    )
+    parser.add_argument("--force-merge-segments", type=int, default=None, help="Force merge the new index after the copy.")
+    parser.add_argument("--delete-source", action="store_true", help="Delete the source index after a successful copy.")
+    args = parser.parse_args()
+
+    es_client = get_es_client()
+    migrate_to_knn_index(
+        es_client,
+        args.source,
+        args.dest,
+        scroll_size=args.scroll_size,
+        knn=not args.no_knn,
+        quantization=args.quantization,
+        max_num_segments=args.force_merge_segments,
+    )
+
+    if args.delete_source:
+        es_client.indices.delete(index=args.source)
+        logger.info(f"Index '{args.source}' deleted.")
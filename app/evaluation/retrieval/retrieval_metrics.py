@@ -1,9 +1,8 @@
-import json
-import random
-
 from tqdm import tqdm
 
-from app.services.search_documents import search_query
+from app.config.settings import settings
+from app.evaluation.retrieval.sampling import sample_questions
+from app.services.search_documents import search_queries
 
 
 def evaluate_resources_summaries_retrieval(
@@ -15,6 +14,11 @@ def evaluate_resources_summaries_retrieval(
     search_embedding_boost: int = 1,
     k: int = 5,
     rerank_top_k: int = 0,
+    fusion: str = "sum",
+    search_batch_size: int = 64,
+    index_name: str = settings.elasticsearch.index_name,
+    retrieval_mode: str = settings.elasticsearch.retrieval_mode,
+    quantization: str = None,
 ) -> dict:
     # Initialize counters and sums for metrics
     total_questions = 0
@@ -24,62 +28,55 @@ def evaluate_resources_summaries_retrieval(
     precision_sum = 0
     recall_sum = 0
 
-    # Iterate over the OpenAI responses
-    for response in tqdm(qa_references, total=len(qa_references), desc="Calculating retrieval metrics"):
-        # Get content and id of openai responses
-        reference_resource_id = response["custom_id"]
-        content = response["response"]["body"]["choices"][0]["message"]["content"]
-
-        questions_and_answers = json.loads(content)["questions_and_answers"]
-
-        if len(questions_and_answers) > 0:
-            # Sample one random question per resource_id to evaluate
-            questions_and_answers = [random.choice(questions_and_answers)]
-
-            for qa in questions_and_answers:
-                if isinstance(qa, dict) and "question" in qa:
-                    question = qa["question"]
-                    total_questions += 1
-
-                    # Query question
-                    search_results = search_query(
-                        question,
-                        embedding_model,
-                        es_client,
-                        k=k,
-                        text_boost=search_text_boost,
-                        embedding_boost=search_embedding_boost,
-                        rerank_top_k=rerank_top_k,
-                    )
-                    # Evaluate if any returned chunk belongs to the correct resource_id
-                    found = False
-                    rank = 0
-                    retrieved_relevant_chunks = 0
-
-                    # Get the total number of relevant chunks for this resource_id
-                    relevant_chunks = resource_chunk_counts[reference_resource_id]
-
-                    if search_results != {"detail": "Not Found"}:
-                        for i, result in enumerate(search_results):
-                            if result.metadata["resource_id"] == reference_resource_id:
-                                if not found:
-                                    total_contexts_found += 1
-                                    rank = i + 1
-                                    reciprocal_rank_sum += 1 / rank
-                                    found = True
-                                retrieved_relevant_chunks += 1
-                    elif search_results == {"detail": "Not Found"}:
-                        search_results = []
-
-                    # Calculate precision and recall for this specific question
-                    precision = retrieved_relevant_chunks / len(search_results) if len(search_results) > 0 else 0
-                    recall = retrieved_relevant_chunks / relevant_chunks if relevant_chunks > 0 else 0
-
-                    precision_sum += precision
-                    recall_sum += recall
-
-                    if found:
-                        position_sum += rank
+    # Sample one random question per resource_id to evaluate
+    questions = sample_questions(qa_references)
+
+    # Query questions in batches: one encode call and one _msearch request per batch
+    for i in tqdm(range(0, len(questions), search_batch_size), desc="Calculating retrieval metrics"):
+        batch = questions[i : i + search_batch_size]
+        batch_results = search_queries(
+            [question for _, question in batch],
+            embedding_model,
+            es_client,
+            index_name=index_name,
+            k=k,
+            text_boost=search_text_boost,
+            embedding_boost=search_embedding_boost,
+            rerank_top_k=rerank_top_k,
+            fusion=fusion,
+            retrieval_mode=retrieval_mode,
+            quantization=quantization,
+        )
+
+        for (reference_resource_id, _), search_results in zip(batch, batch_results):
+            total_questions += 1
+
+            # Evaluate if any returned chunk belongs to the correct resource_id
+            found = False
+            rank = 0
+            retrieved_relevant_chunks = 0
+
+            # Get the total number of relevant chunks for this resource_id
+            relevant_chunks = resource_chunk_counts[reference_resource_id]
+
+            for j, result in enumerate(search_results):
+                if result.metadata["resource_id"] == reference_resource_id:
+                    if not found:
+                        total_contexts_found += 1
+                        rank = j + 1
+                        reciprocal_rank_sum += 1 / rank
+                        found = True
+                    retrieved_relevant_chunks += 1
+
+            # Calculate precision and recall for this specific question
+            precision = retrieved_relevant_chunks / len(search_results) if len(search_results) > 0 else 0
+            recall = retrieved_relevant_chunks / relevant_chunks if relevant_chunks > 0 else 0
+
+            precision_sum += precision
+            recall_sum += recall
+
+            if found:
+                position_sum += rank
 
     # Calculate final metrics
     retrieval_accuracy = round(total_contexts_found / total_questions, 3) if total_questions > 0 else 0
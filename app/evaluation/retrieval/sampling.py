@@ -0,0 +1,19 @@
+import json
+import random
+
+
+def sample_questions(qa_references: list[dict]) -> list[tuple[str, str]]:
+    """Samples one random question per resource_id, returned as (resource_id, question) pairs."""
+    questions = []
+    for response in qa_references:
+        # Get content and id of openai responses
+        reference_resource_id = response["custom_id"]
+        content = response["response"]["body"]["choices"][0]["message"]["content"]
+
+        questions_and_answers = json.loads(content)["questions_and_answers"]
+
+        if len(questions_and_answers) > 0:
+            qa = random.choice(questions_and_answers)
+            if isinstance(qa, dict) and "question" in qa:
+                questions.append((reference_resource_id, qa["question"]))
+    return questions
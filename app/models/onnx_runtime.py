@@ -0,0 +1,64 @@
+import inspect
+import os
+import re
+
+from app.config.settings import logger
+
+
+# Bumped when exports made by earlier versions must not be reused: version 1 bound the tokenizer outputs to the
+# wrong parameters of BERT-style models
+EXPORT_VERSION = 2
+
+
+def onnx_model_dir(base_dir: str, model_name: str) -> str:
+    return os.path.join(base_dir, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)}.v{EXPORT_VERSION}")
+
+
+def export_to_onnx(model, dummy_inputs: dict, output_names: list[str], onnx_path: str, dynamic_axes: dict):
+    """
+    Exports a PyTorch transformer to ONNX with dynamic batch and sequence axes. The dummy inputs are passed
+    in the order of the parameters of model.forward, which is not the order of the tokenizer outputs
+    (input_ids, token_type_ids, attention_mask for BERT, whose forward takes attention_mask second).
+    """
+    import torch
+
+    parameters = list(inspect.signature(model.forward).parameters)
+    unknown = set(dummy_inputs) - set(parameters)
+    if unknown:
+        raise ValueError(f"Inputs {sorted(unknown)} are not parameters of {type(model).__name__}.forward")
+    # Parameters without a dummy input before the last one given are passed as None, their default
+    parameters = parameters[: max(parameters.index(name) for name in dummy_inputs) + 1]
+    # Recent torch versions default to the dynamo exporter, which needs onnxscript and takes dynamic_shapes
+    options = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy_inputs.get(name) for name in parameters),
+            onnx_path,
+            input_names=[name for name in parameters if name in dummy_inputs],
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            **options,
+        )
+    logger.info(f"Model exported to {onnx_path}")
+
+
+def quantize_onnx(onnx_path: str, quantized_path: str):
+    """Dynamic int8 quantization of the weights of an ONNX model (activations are quantized at runtime)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8, use_external_data_format=True)
+    logger.info(f"Quantized model saved to {quantized_path}")
+
+
+def create_session(onnx_path: str, num_threads: int = 0):
+    """onnxruntime CPU session; num_threads=0 lets onnxruntime use all physical cores."""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = num_threads
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return onnxruntime.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
@@ -1,7 +1,125 @@
+import json
+import os
+
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
-from app.config.settings import settings
+from app.config.settings import logger, settings
+from app.models.onnx_runtime import create_session, export_to_onnx, onnx_model_dir, quantize_onnx
+
+
+def cpu_supports_bf16() -> bool:
+    """True when the CPU has native bfloat16 instructions (AVX512-BF16 or AMX), where bf16 inference is faster than fp32."""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+class OnnxSentenceEncoder:
+    """
+    ONNX Runtime export of a sentence-transformers model, exposing the encode interface used by the app.
+    The transformer is exported (and optionally int8 quantized) the first time it is loaded; pooling and
+    sequence length are taken from the original model so the vectors match the ones already indexed.
+    """
+
+    def __init__(self, model_name: str, model_dir: str, quantize: bool = False, num_threads: int = 0):
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        onnx_path = os.path.join(model_dir, "model.onnx")
+        quantized_path = os.path.join(model_dir, "model.int8.onnx")
+        config_path = os.path.join(model_dir, "pooling_config.json")
+        if not os.path.exists(onnx_path):
+            self._export(model_name, model_dir, onnx_path, config_path)
+        if quantize and not os.path.exists(quantized_path):
+            quantize_onnx(onnx_path, quantized_path)
+
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        self.pooling_mode = config["pooling_mode"]
+        self.max_seq_length = config["max_seq_length"]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = create_session(quantized_path if quantize else onnx_path, num_threads=num_threads)
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def _export(self, model_name: str, model_dir: str, onnx_path: str, config_path: str):
+        model = SentenceTransformer(model_name, device="cpu")
+        transformer, pooling = model[0], model[1]
+        if pooling.get_pooling_mode_str() not in ("mean", "cls"):
+            raise ValueError(f"Unsupported pooling mode for the onnx export: {pooling.get_pooling_mode_str()}")
+        tokenizer = transformer.tokenizer
+        dummy_inputs = dict(tokenizer(["query"], return_tensors="pt"))
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in dummy_inputs}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        export_to_onnx(transformer.auto_model, dummy_inputs, ["last_hidden_state"], onnx_path, dynamic_axes)
+        tokenizer.save_pretrained(model_dir)
+        with open(config_path, "w") as f:
+            json.dump({"pooling_mode": pooling.get_pooling_mode_str(), "max_seq_length": model.max_seq_length}, f)
+
+    def _pool(self, hidden_states: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.pooling_mode == "cls":
+            return hidden_states[:, 0]
+        mask = attention_mask[..., None].astype(np.float32)
+        return (hidden_states * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(
+        self, sentences, batch_size: int = 32, show_progress_bar: bool = False, normalize_embeddings: bool = False, **kwargs
+    ):
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        embeddings = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start : start + batch_size]
+            inputs = self.tokenizer(batch, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np")
+            feed = {name: inputs[name].astype(np.int64) for name in self.input_names}
+            hidden_states = self.session.run(["last_hidden_state"], feed)[0]
+            embeddings.append(self._pool(hidden_states, inputs["attention_mask"]))
+        embeddings = np.vstack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        if normalize_embeddings:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        embeddings = embeddings.astype(np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def embedding_model_key(
+    backend: str = settings.model.embedding_backend, precision: str = settings.model.embedding_precision
+) -> str:
+    """Identifies the vectors produced by the configured embedding model, e.g. to cache them."""
+    model_name = settings.model.embedding_model_name
+    if backend == "torch" and precision == "fp32":
+        return model_name
+    return f"{model_name}@{backend}-{precision}"
+
 
+def get_sentence_transformer(
+    backend: str = settings.model.embedding_backend,
+    precision: str = settings.model.embedding_precision,
+    num_threads: int = settings.model.onnx_num_threads,
+):
+    """
+    Embedding model for the configured backend: "torch" (sentence-transformers, fp32 or bf16 on CPUs
+    with native bf16 support) or "onnx" (ONNX Runtime, fp32 or int8 dynamically quantized weights).
+    """
+    model_name = settings.model.embedding_model_name
+    if backend == "onnx":
+        if precision not in ("fp32", "int8"):
+            raise ValueError(f"Unsupported precision for the onnx embedding backend: {precision}")
+        return OnnxSentenceEncoder(
+            model_name, onnx_model_dir(settings.model.onnx_dir, model_name), quantize=precision == "int8", num_threads=num_threads
+        )
+    elif backend == "torch":
+        if precision not in ("fp32", "bf16"):
+            raise ValueError(f"Unsupported precision for the torch embedding backend: {precision}")
+        model = SentenceTransformer(model_name)
+        if precision == "bf16":
+            if model.device.type == "cpu" and not cpu_supports_bf16():
+                logger.warning("CPU without native bfloat16 support, keeping the embedding model in fp32")
+            else:
+                import torch
 
-def get_sentence_transformer():
-    return SentenceTransformer(settings.model.embedding_model_name)
+                model = model.to(torch.bfloat16)
+        return model
+    raise ValueError(f"Unsupported embedding backend: {backend}")
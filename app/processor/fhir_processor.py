@@ -1,10 +1,35 @@
 import base64
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from itertools import islice
 import json
+import multiprocessing
 import re
+import threading
 
+import ijson
 import PyPDF2
 
+from app.config.settings import settings
+
+
+URL_PATTERN = re.compile(r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+")
+# URL_PATTERN applied to the JSON text of a resource. Its character class reduces to ! and the ranges $-[, ]-_ and a-z
+# (the backslash, in $-_, is taken out); a backslash of the original string is serialized as \\ and still matched,
+# every other escape (\", \n, \uXXXX) starts with a lone backslash and ends the match, as the escaped character ends it
+# in the original string. The lookahead skips keys (a string followed by ": "), which remove_urls_from_fhir keeps.
+SERIALIZED_URL_PATTERN = re.compile(r'https?://(?:[!$-\[\]-_a-z]|\\\\)+(?!(?:[^"\\]|\\.)*": )')
+# Resources parsed from JSON cannot contain reference cycles
+_encoder = json.JSONEncoder(check_circular=False)
+
+
+def batched(iterable, batch_size: int):
+    """Yields lists of up to batch_size consecutive items of iterable."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
 
 def read_json_FHIR(json_path):
     with open(json_path, "r") as f:
@@ -77,34 +102,109 @@ def extract_text(resource):
 
 
 def remove_urls_from_fhir(data):
-    url_pattern = re.compile(r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+")
-
     if isinstance(data, dict):
         return {key: remove_urls_from_fhir(value) for key, value in data.items()}
     elif isinstance(data, list):
         return [remove_urls_from_fhir(item) for item in data]
     elif isinstance(data, str):
-        return url_pattern.sub("", data)
+        return URL_PATTERN.sub("", data)
     else:
         return data
 
 
-def process_resources(data: dict, remove_urls: bool) -> list[dict]:
-    resources = []
+def iter_bundle_entries(file):
+    """
+    Iterates the entries of a FHIR bundle read incrementally from a binary file object, so only
+    one entry is parsed in memory at a time. Numbers are returned as floats, as with json.load.
+    """
+    return ijson.items(file, "entry.item", use_float=True)
+
 
-    for entry in data.get("entry", []):
-        if "resource" in entry:
-            resource = entry["resource"]
-            resource_type = resource.get("resourceType")
+def iter_bundle_resources(file):
+    """Iterates entry[*].resource of a FHIR bundle read incrementally from a binary file object."""
+    return ijson.items(file, "entry.item.resource", use_float=True)
 
-            resource = extract_text(resource)
 
-            if remove_urls:
-                resource = remove_urls_from_fhir(resource)
+def normalize_resource(resource: dict, remove_urls: bool) -> str:
+    """
+    Indexed text of a resource: attachments decoded, URLs removed from string values and backslashes removed.
+    Byte-identical to json.dumps(remove_urls_from_fhir(extract_text(resource))).replace("\\", ""), but URLs
+    are removed with one scan of the serialized text instead of rebuilding a copy of the whole resource.
+    """
+    text = _encoder.encode(extract_text(resource))
+    if remove_urls:
+        text = SERIALIZED_URL_PATTERN.sub("", text)
+    return text.replace("\\", "")
 
-            resource_id = resource.get("id")
-            text = json.dumps(resource).replace("\\", "")
 
-            resources.append({"resource_id": resource_id, "resource_type": resource_type, "resource": text})
+def count_bundle_items(file, prefix: str = "entry.item") -> int:
+    """Number of objects at prefix (e.g. entry.item.resource) of a bundle read from a binary file object, without building them."""
+    return sum(1 for path, event, _ in ijson.parse(file) if path == prefix and event == "start_map")
 
-    return resources
+
+def process_resource(resource: dict, remove_urls: bool) -> dict:
+    resource_type = resource.get("resourceType")
+    resource_id = resource.get("id")
+    if remove_urls and isinstance(resource_id, str):
+        resource_id = URL_PATTERN.sub("", resource_id)
+    text = normalize_resource(resource, remove_urls)
+
+    return {"resource_id": resource_id, "resource_type": resource_type, "resource": text}
+
+
+# One pool per worker count, shared by all requests and kept for the life of the process: a pool is never
+# shut down while another upload may still be iterating it
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    with _pools_lock:
+        if workers not in _pools:
+            # Workers are started by a forkserver that only imports fhir_worker, rather than forked from the app
+            # process and its uvicorn, Elasticsearch, batcher and torch threads
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["app.processor.fhir_worker"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return _pools[workers]
+
+
+def iter_processed_resources(
+    resources,
+    remove_urls: bool,
+    workers: int = settings.processing.fhir_workers,
+    chunk_size: int = settings.processing.fhir_chunk_size,
+):
+    """
+    Generator version of process_resources over an iterable of FHIR resources, e.g. iter_bundle_resources.
+    With workers > 1, chunks of chunk_size resources are processed in a pool of worker processes; at most
+    2 * workers chunks are in flight, so a streamed input is not read ahead, and results keep the input order.
+    """
+    if workers <= 1:
+        for resource in resources:
+            yield process_resource(resource, remove_urls)
+        return
+
+    from app.processor.fhir_worker import process_chunk
+
+    pool = _get_pool(workers)
+    pending = deque()
+    for chunk in batched(resources, chunk_size):
+        pending.append(pool.submit(process_chunk, chunk, remove_urls))
+        if len(pending) >= 2 * workers:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def process_resources(
+    data: dict,
+    remove_urls: bool,
+    workers: int = settings.processing.fhir_workers,
+    chunk_size: int = settings.processing.fhir_chunk_size,
+) -> list[dict]:
+    resources = (entry["resource"] for entry in data.get("entry", []) if "resource" in entry)
+    return list(iter_processed_resources(resources, remove_urls, workers=workers, chunk_size=chunk_size))
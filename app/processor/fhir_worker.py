@@ -0,0 +1,10 @@
+"""
+Entry point of the FHIR processing worker processes. Their forkserver only preloads this module, so the
+workers import the processing functions without the models, clients and threads of the app process.
+"""
+
+from app.processor.fhir_processor import process_resource
+
+
+def process_chunk(resources: list[dict], remove_urls: bool) -> list[dict]:
+    return [process_resource(resource, remove_urls) for resource in resources]
@@ -2,6 +2,7 @@ import csv
 import json
 import pandas as pd
 import os
+from typing import Iterable
 
 from tqdm import tqdm
 
@@ -12,7 +13,7 @@ from app.services.openai import OpenAIHandler
 
 def calculate_costs(
     system_prompt: str,
-    user_prompts: list[dict],
+    user_prompts: Iterable[dict],
     cost_per_million_input_tokens: float,
     cost_per_million_output_tokens: float,
     tokens_per_response: int,
@@ -22,7 +23,7 @@ def calculate_costs(
     Process a list of user prompts, format the model prompt, calculate total tokens, and API costs.
 
     Args:
-        user_prompts: list of dicts, each dict represents a user prompt.
+        user_prompts: iterable of dicts, each dict represents a user prompt. It is consumed once.
         system_prompt: str, the system prompt.
         cost_per_million_input_tokens: float, cost per million input tokens.
         cost_per_million_output_tokens: float, cost per million output tokens.
@@ -35,12 +36,13 @@ def calculate_costs(
     openai_handler = OpenAIHandler(model=model)
 
     total_input_tokens = 0
-    total_openai_requests = len(user_prompts)
+    total_openai_requests = 0
 
     for user_prompt in user_prompts:
         tokens_for_this_prompt = openai_handler.get_total_tokens_from_prompt(user_prompt["resource"])
 
         total_input_tokens += tokens_for_this_prompt
+        total_openai_requests += 1
 
     total_system_tokens = openai_handler.get_total_tokens_from_prompt(system_prompt) * total_openai_requests
 
@@ -60,7 +62,7 @@ def calculate_costs(
 
 def process_prompts_and_save_responses(
     system_prompt: str,
-    user_prompts: list[dict],
+    user_prompts: Iterable[dict],
     openai_api_key: str,
     task: str,
     model: str = "gpt-4o-mini-2024-07-18",
@@ -72,7 +74,7 @@ def process_prompts_and_save_responses(
 
     Args:
         system_prompt: str, the system prompt.
-        user_prompts: list of dicts, each dict represents a user prompt.
+        user_prompts: iterable of dicts, each dict represents a user prompt.
         openai_api_key: str, the OpenAI API key.
         model: str, the model to use.
         max_tokens: int, maximum number of tokens to generate per completion.
@@ -92,7 +94,8 @@ def process_prompts_and_save_responses(
         writer = csv.DictWriter(file, fieldnames=["resource_id", "resource_type", "original_resource", "openai_summary"])
         writer.writeheader()
 
-        for user_prompt in tqdm(user_prompts, total=len(user_prompts), desc="Generating completions"):
+        total = len(user_prompts) if hasattr(user_prompts, "__len__") else None
+        for user_prompt in tqdm(user_prompts, total=total, desc="Generating completions"):
             user_content = user_prompt["resource"]
 
             # Openai requests
@@ -1,39 +1,64 @@
 import json
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status
-from elasticsearch import helpers
+from fastapi import APIRouter, Body, UploadFile, File, Form, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 
-from app import es_client, embedding_model
+from app import async_es_client, embedding_model, embedding_store, local_index, reranker_service
 from app.config.settings import logger, settings
-from app.db.index_documents import bulk_load_fhir_data
+from app.db.index_documents import async_delete_all_documents, async_index_fhir_data
+from app.processor.fhir_processor import iter_bundle_entries
 from app.processor.files_processor import csv_to_dict
-from app.services.search_documents import search_query, fetch_all_documents
+from app.services.search_documents import (
+    async_fetch_all_documents,
+    async_search_queries,
+    async_search_query,
+    index_generation,
+    query_embedding_cache,
+    search_results_cache,
+)
 
 
 router = APIRouter()
 
 
 @router.post("/bulk_load")
-async def bulk_load(file: UploadFile = File(...), text_key: str = Form(...)):
-    data = await file.read()
-
+async def bulk_load(
+    file: UploadFile = File(...),
+    text_key: str = Form(...),
+    thread_count: int = Form(settings.elasticsearch.bulk_thread_count),
+    chunk_size: int = Form(settings.elasticsearch.bulk_chunk_size),
+    max_chunk_bytes: int = Form(settings.elasticsearch.bulk_max_chunk_bytes),
+    skip_existing: bool = Form(True),
+    delete_missing: bool = Form(False),
+    bulk_ingest: bool = Form(settings.elasticsearch.bulk_ingest_mode),
+    force_merge: bool = Form(False),
+):
     if file.filename.endswith(".json"):
-        json_data = json.loads(data)["entry"]
+        # Entries are parsed one at a time from the spooled upload while they are embedded and indexed
+        json_data = iter_bundle_entries(file.file)
     elif file.filename.endswith(".csv"):
-        json_data = csv_to_dict(data)
+        json_data = csv_to_dict(await file.read())
 
     else:
         raise HTTPException(status_code=400, detail="Unsupported file format. Only JSON and CSV are supported.")
 
     try:
-        helpers.bulk(
-            es_client,
-            bulk_load_fhir_data(
-                json_data, text_key, embedding_model=embedding_model, index_name=settings.elasticsearch.index_name
-            ),
+        summary = await async_index_fhir_data(
+            json_data,
+            text_key,
+            embedding_model=embedding_model,
+            index_name=settings.elasticsearch.index_name,
+            async_es_client=async_es_client,
+            skip_existing=skip_existing,
+            delete_missing=delete_missing,
+            bulk_ingest=bulk_ingest,
+            force_merge=force_merge,
+            thread_count=thread_count,
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
         )
         logger.info(f"Bulk load completed for file: {file.filename}")
-        return {"status": "success", "filename": file.filename}
+        return {"status": "success" if not summary.failed else "partial", "filename": file.filename, **summary.to_dict()}
     except Exception as e:
         logger.error(f"Bulk load failed: {str(e)}")
         return {"status": "error", "message": str(e)}
@@ -42,7 +67,7 @@ async def bulk_load(file: UploadFile = File(...), text_key: str = Form(...)):
 @router.delete("/delete_all_documents")
 async def delete_all_documents(index_name: str):
     try:
-        es_client.delete_by_query(index=index_name, body={"query": {"match_all": {}}})
+        await async_delete_all_documents(async_es_client, index_name)
         logger.info(f"All documents deleted from index '{index_name}'")
         return {"status": "success", "message": f"All documents deleted from index '{index_name}'"}
     except Exception as e:
@@ -51,16 +76,98 @@ async def delete_all_documents(index_name: str):
 
 
 @router.get("/get_all_documents")
-async def get_all_documents(index_name: str = settings.elasticsearch.index_name, size: int = 2000):
+async def get_all_documents(index_name: str = settings.elasticsearch.index_name, page_size: int = 1000):
+    """Streams every document of the index as NDJSON, one document per line."""
     try:
-        documents = fetch_all_documents(index_name=index_name, es_client=es_client, size=size)
-        return documents
+        index_exists = local_index is not None or await async_es_client.indices.exists(index=index_name)
     except Exception as e:
         logger.error(f"Error retrieving documents: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error retrieving documents: {str(e)}")
+    if not index_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Index '{index_name}' not found.")
+
+    async def generate():
+        try:
+            async for document in async_fetch_all_documents(
+                index_name=index_name, async_es_client=async_es_client, page_size=page_size
+            ):
+                yield json.dumps(document) + "\n"
+        except Exception as e:
+            logger.error(f"Error streaming documents: {str(e)}")
+            raise
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 
 @router.get("/search")
-async def search_documents(query: str, k: int = 5, text_boost: float = 0.25, embedding_boost: float = 4.0):
-    results = search_query(query, embedding_model, es_client, k=k, text_boost=text_boost, embedding_boost=embedding_boost)
+async def search_documents(
+    query: str,
+    k: int = 5,
+    text_boost: float = 0.25,
+    embedding_boost: float = 4.0,
+    retrieval_mode: str = settings.elasticsearch.retrieval_mode,
+    num_candidates: int = settings.elasticsearch.knn_num_candidates,
+    fusion: str = settings.elasticsearch.fusion,
+    resource_types: list[str] = Query(None),
+    resource_ids: list[str] = Query(None),
+):
+    try:
+        results = await async_search_query(
+            query,
+            embedding_model,
+            async_es_client,
+            k=k,
+            text_boost=text_boost,
+            embedding_boost=embedding_boost,
+            retrieval_mode=retrieval_mode,
+            num_candidates=num_candidates,
+            fusion=fusion,
+            resource_types=resource_types,
+            resource_ids=resource_ids,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return results
+
+
+@router.post("/search_batch")
+async def search_documents_batch(
+    queries: list[str] = Body(..., embed=True),
+    k: int = 5,
+    text_boost: float = 0.25,
+    embedding_boost: float = 4.0,
+    retrieval_mode: str = settings.elasticsearch.retrieval_mode,
+    num_candidates: int = settings.elasticsearch.knn_num_candidates,
+    fusion: str = settings.elasticsearch.fusion,
+    resource_types: list[str] = Query(None),
+    resource_ids: list[str] = Query(None),
+):
+    try:
+        results = await async_search_queries(
+            queries,
+            embedding_model,
+            async_es_client,
+            k=k,
+            text_boost=text_boost,
+            embedding_boost=embedding_boost,
+            retrieval_mode=retrieval_mode,
+            num_candidates=num_candidates,
+            fusion=fusion,
+            resource_types=resource_types,
+            resource_ids=resource_ids,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     return results
+
+
+@router.get("/cache_stats")
+async def cache_stats():
+    return {
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "search_results_cache": search_results_cache.stats(),
+        "reranker": reranker_service.stats(),
+        "embedding_store": embedding_store.stats() if embedding_store is not None else None,
+        "embedding_batcher": embedding_model.batcher.stats() if hasattr(embedding_model, "batcher") else None,
+        "index_generation": index_generation.value,
+    }
@@ -1,5 +1,6 @@
+import asyncio
+from collections import Counter
 import json
-import numpy as np
 from datetime import datetime
 import os
 import pandas as pd
@@ -7,15 +8,16 @@ import pandas as pd
 from clearml import Task
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status
 
-from app import es_client, embedding_model
+from app import async_es_client, es_client, embedding_model, reranker_service
 from app.config.settings import logger, settings
 from app.evaluation.retrieval.retrieval_metrics import evaluate_resources_summaries_retrieval
 from app.evaluation.generation.correctness import CorrectnessEvaluator
 from app.evaluation.generation.faithfulness import FaithfulnessEvaluator
 from app.processor.files_processor import ensure_data_directory_exists, generate_output_filename
 from app.processor.openai_processor import jsonl_dataset_to_dataframe
-from app.services.search_documents import fetch_all_documents
+from app.services.search_documents import async_fetch_all_documents
 from app.services.conversation import batch_generation_synchronous
+from app.services.reranking import CascadeRerankingService
 
 
 router = APIRouter()
@@ -25,11 +27,13 @@ router = APIRouter()
 async def evaluate_retrieval(
     file: UploadFile = File(...),
     index_name: str = Form(settings.elasticsearch.index_name),
-    size: int = Form(2000),
+    page_size: int = Form(1000),
     search_text_boost: float = Form(1),
     search_embedding_boost: float = Form(1),
     k: int = Form(5),
     rerank_top_k: int = Form(0),
+    fusion: str = Form(settings.elasticsearch.fusion),
+    search_batch_size: int = Form(64),
     urls_in_resources: bool = Form(None),
     questions_with_ids_and_dates: str = Form(None),
     chunk_size: int = Form(None),
@@ -50,9 +54,11 @@ async def evaluate_retrieval(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON format.")
     # Count total chunks by resource in database
     try:
-        documents = fetch_all_documents(index_name=index_name, es_client=es_client, size=size)
-        id, counts = np.unique([resource["metadata"]["resource_id"] for resource in documents], return_counts=True)
-        resources_counts = dict(zip(id, counts))
+        resources_counts = Counter()
+        async for resource in async_fetch_all_documents(
+            index_name=index_name, async_es_client=async_es_client, page_size=page_size
+        ):
+            resources_counts[resource["metadata"]["resource_id"]] += 1
     except Exception as e:
         logger.error(f"Error retrieving documents: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error retrieving documents: {str(e)}")
@@ -64,6 +70,7 @@ async def evaluate_retrieval(
                 "search_embedding_boost": search_embedding_boost,
                 "k": k,
                 "rerank_top_k": rerank_top_k,
+                "fusion": fusion,
                 "urls_in_resources": urls_in_resources,
                 "questions_with_ids_and_dates": questions_with_ids_and_dates,
                 "chunk_size": chunk_size,
@@ -73,7 +80,13 @@ async def evaluate_retrieval(
             task = Task.init(project_name=clearml_project_name, task_name=unique_task_name)
             task.connect(params)
 
-        retrieval_metrics = evaluate_resources_summaries_retrieval(
+        cascade = rerank_top_k > 0 and isinstance(reranker_service, CascadeRerankingService)
+        if cascade:
+            tier_counts_before = Counter(reranker_service.tier_counts)
+
+        # The evaluation loop is synchronous, run it in a worker thread to keep the event loop free
+        retrieval_metrics = await asyncio.to_thread(
+            evaluate_resources_summaries_retrieval,
             es_client=es_client,
             embedding_model=embedding_model,
             resource_chunk_counts=resources_counts,
@@ -82,7 +95,16 @@ async def evaluate_retrieval(
             search_embedding_boost=search_embedding_boost,
             k=k,
             rerank_top_k=rerank_top_k,
+            fusion=fusion,
+            search_batch_size=search_batch_size,
+            index_name=index_name,
         )
+        if cascade:
+            # How often each rerank tier ran during this evaluation
+            tiers = CascadeRerankingService.tier_report(reranker_service.tier_counts - tier_counts_before)
+            retrieval_metrics["Rerank skip rate"] = tiers["skip_rate"]
+            retrieval_metrics["Rerank light pairs per query"] = tiers["light_pairs_per_query"]
+            retrieval_metrics["Rerank heavy pairs per query"] = tiers["heavy_pairs_per_query"]
 
         # Upload metrics and close task
         if task:
@@ -233,7 +255,8 @@ async def dataset_generation(
         model_prompt = settings.model.conversation_model_prompt.get(model_prompt)
 
         # Do queries and generations
-        output_file = batch_generation_synchronous(
+        output_file = await asyncio.to_thread(
+            batch_generation_synchronous,
             model_prompt=model_prompt,
             es_client=es_client,
             embedding_model=embedding_model,
@@ -0,0 +1,83 @@
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+
+from app.config.settings import settings
+from app.services.ingestion_jobs import FINISHED_STATUSES, job_manager
+
+
+router = APIRouter()
+
+
+@router.post("/bulk_load")
+async def submit_bulk_load(
+    file: UploadFile = File(...),
+    text_key: str = Form(...),
+    thread_count: int = Form(settings.elasticsearch.bulk_thread_count),
+    chunk_size: int = Form(settings.elasticsearch.bulk_chunk_size),
+    max_chunk_bytes: int = Form(settings.elasticsearch.bulk_max_chunk_bytes),
+    skip_existing: bool = Form(True),
+    delete_missing: bool = Form(False),
+    bulk_ingest: bool = Form(settings.elasticsearch.bulk_ingest_mode),
+    force_merge: bool = Form(False),
+):
+    """Background version of /database/bulk_load: returns the job id once the upload is saved."""
+    if not file.filename.endswith((".json", ".csv")):
+        raise HTTPException(status_code=400, detail="Unsupported file format. Only JSON and CSV are supported.")
+    params = {
+        "text_key": text_key,
+        "thread_count": thread_count,
+        "chunk_size": chunk_size,
+        "max_chunk_bytes": max_chunk_bytes,
+        "skip_existing": skip_existing,
+        "delete_missing": delete_missing,
+        "bulk_ingest": bulk_ingest,
+        "force_merge": force_merge,
+    }
+    job = await job_manager.submit("bulk_load", file.file, file.filename, params)
+    return {"job_id": job.id, "status": job.status}
+
+
+@router.post("/summarize_and_load")
+async def submit_summarize_and_load(
+    file: UploadFile = File(...),
+    remove_urls: bool = Form(True),
+    batch_size: int = Form(4),
+    limit: int = Form(None),
+    bulk_ingest: bool = Form(settings.elasticsearch.bulk_ingest_mode),
+    force_merge: bool = Form(False),
+):
+    """Background version of /generation/summarize_and_load_parallel: returns the job id once the upload is saved."""
+    if not file.filename.endswith(".json"):
+        raise HTTPException(status_code=400, detail="Unsupported file format. Only JSON FHIR bundles are supported.")
+    params = {
+        "remove_urls": remove_urls,
+        "batch_size": batch_size,
+        "limit": limit,
+        "bulk_ingest": bulk_ingest,
+        "force_merge": force_merge,
+    }
+    job = await job_manager.submit("summarize_and_load", file.file, file.filename, params)
+    return {"job_id": job.id, "status": job.status}
+
+
+@router.get("")
+async def list_jobs(status: str = None, limit: int = 50):
+    return [job.to_dict() for job in job_manager.list_jobs(status, limit)]
+
+
+@router.get("/{job_id}")
+async def job_status(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return job.to_dict()
+
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    if job.status in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is already {job.status}.")
+    job_manager.cancel(job_id)
+    return job.to_dict()
@@ -1,12 +1,14 @@
-import json
+from itertools import islice
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, status
+import ijson
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Response, status
 
-from app import es_client, embedding_model
+from app import async_es_client, embedding_model
 from app.config.settings import settings
-from app.processor.fhir_processor import process_resources
+from app.processor.fhir_processor import iter_bundle_resources, iter_processed_resources
 from app.services.conversation import process_search_output, llm_response
-from app.services.search_documents import search_query
+from app.services.metrics import StageTimer, metrics_registry
+from app.services.search_documents import async_search_query
 from app.services.summarize import summarize_resources_parallel
 
 
@@ -15,17 +17,42 @@ router = APIRouter()
 
 @router.get("/generate")
 async def answer_query(
-    query: str, k: int = 5, params=None, stream: bool = False, text_boost: float = 0.25, embedding_boost: float = 4.0
+    response: Response,
+    query: str,
+    k: int = 5,
+    params=None,
+    stream: bool = False,
+    text_boost: float = 0.25,
+    embedding_boost: float = 4.0,
 ):
-    results = search_query(
-        query, embedding_model, es_client, k=k, text_boost=text_boost, embedding_boost=embedding_boost, rerank_top_k=0
+    # Per-stage latencies are returned as a Server-Timing header and recorded in the metrics registry
+    timer = StageTimer(registry=metrics_registry, prefix="generate")
+    results = await async_search_query(
+        query,
+        embedding_model,
+        async_es_client,
+        k=k,
+        text_boost=text_boost,
+        embedding_boost=embedding_boost,
+        rerank_top_k=0,
+        timer=timer,
     )
-    if not results:
-        concatenated_content = "There is no context"
-    else:
-        concatenated_content, resources_id = process_search_output(results)
+    with timer.stage("context"):
+        if not results:
+            concatenated_content, resources_id = "There is no context", []
+        else:
+            concatenated_content, resources_id = process_search_output(results)
+
+    result = llm_response(concatenated_content, query, resources_id, stream, params, timer=timer)
+    if not stream:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return result
+
 
-    return llm_response(concatenated_content, query, resources_id, stream, params)
+@router.get("/latency_metrics")
+async def latency_metrics():
+    """Latency percentiles of each recorded request stage, in milliseconds."""
+    return metrics_registry.stats()
 
 
 @router.post("/summarize_and_load_parallel")
@@ -34,31 +61,26 @@ async def summarize_and_load(
     remove_urls: bool = Form(True),
     batch_size: int = Form(4),
     limit: int = Form(None),
+    bulk_ingest: bool = Form(settings.elasticsearch.bulk_ingest_mode),
+    force_merge: bool = Form(False),
 ):
-    # Read file
-    try:
-        resources = await file.read()
-        resources = json.loads(resources)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON format.")
-    # Process file and summarize resources
-    try:
-        limit = 1 if limit <= 0 else limit
-        if limit:
-            resources_processed = process_resources(data=resources, remove_urls=remove_urls)[:limit]
-        else:
-            resources_processed = process_resources(data=resources, remove_urls=remove_urls)
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error during processing: {str(e)}")
+    # Resources are parsed and processed lazily from the spooled upload, one summary batch at a time
+    resources_processed = iter_processed_resources(iter_bundle_resources(file.file), remove_urls=remove_urls)
+    if limit is not None:
+        resources_processed = islice(resources_processed, max(limit, 1))
     # Generate summaries and save
     try:
         output_file = await summarize_resources_parallel(
             model_prompt=settings.model.summaries_model_prompt,
-            es_client=es_client,
+            async_es_client=async_es_client,
             embedding_model=embedding_model,
             resources=resources_processed,
             batch_size=batch_size,
+            bulk_ingest=bulk_ingest,
+            force_merge=force_merge,
         )
+    except ijson.JSONError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON format.")
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error during summaries generation: {str(e)}"
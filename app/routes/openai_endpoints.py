@@ -1,8 +1,7 @@
-import json
-
+import ijson
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, status
 
-from app.processor.fhir_processor import process_resources
+from app.processor.fhir_processor import iter_bundle_resources, iter_processed_resources
 from app.processor.openai_processor import calculate_costs, process_prompts_and_save_responses
 from app.config.settings import settings
 
@@ -22,18 +21,8 @@ async def execute_batch_chat_requests(
     openai_model: str = Form("gpt-4o-mini-2024-07-18"),
     file: UploadFile = File(...),
 ):
-    # Read file
-    try:
-        resources = await file.read()
-        resources = json.loads(resources)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON format.")
-
-    # Process resources
-    try:
-        resources_processed = process_resources(data=resources, remove_urls=remove_urls)
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error during processing: {str(e)}")
+    # Resources are parsed and processed lazily from the spooled upload while costs or responses are computed
+    resources_processed = iter_processed_resources(iter_bundle_resources(file.file), remove_urls=remove_urls)
 
     # Get model prompt for the task
     if task == "summarize":
@@ -53,6 +42,8 @@ async def execute_batch_chat_requests(
                 model=openai_model,
             )
             return costs
+        except ijson.JSONError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON format.")
         except Exception as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error calculating costs: {str(e)}")
     # Get answers from resources
@@ -67,5 +58,7 @@ async def execute_batch_chat_requests(
                 max_tokens=max_tokens_per_response,
             )
             return {"message": f"Responses saved to {output_file}"}
+        except ijson.JSONError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON format.")
         except Exception as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error generating responses: {str(e)}")
@@ -10,6 +10,7 @@ from app.services.llama_client import llm_client
 from app.config.settings import logger, settings
 from app.data_models.search_result import SearchResult
 from app.processor.files_processor import ensure_data_directory_exists, generate_output_filename
+from app.services.metrics import StageTimer
 from app.services.search_documents import search_query
 
 
@@ -30,11 +31,19 @@ def process_search_output(search_results: list[SearchResult]):
     return concatenated_content, resources_id
 
 
-def llm_response(concatenated_context: str, query: str, resources_id: list, stream: bool, params: dict):
+def llm_response(concatenated_context: str, query: str, resources_id: list, stream: bool, params: dict, timer: StageTimer = None):
+    """
+    Answers the query with the LLM. When a timer is given, the total LLM time (llm_total) is recorded in it,
+    with the time to first token (llm_ttft) when streaming, or llama.cpp's prompt processing time (llm_prompt)
+    otherwise; with stream=True they are only known once the response has been sent, so they reach the
+    metrics registry but not the Server-Timing header.
+    """
+    timer = timer or StageTimer()
     if stream:
 
         def generate():
-            start_time = time.time()
+            start_time = time.perf_counter()
+            first_chunk = True
             for chunk in llm_client.chat(
                 context=concatenated_context,
                 query=query,
@@ -42,20 +51,29 @@ def llm_response(concatenated_context: str, query: str, resources_id: list, stre
                 params=params,
                 model_prompt=settings.model.conversation_model_prompt,
             ):
+                if first_chunk:
+                    timer.record("llm_ttft", (time.perf_counter() - start_time) * 1000)
+                    first_chunk = False
                 yield chunk
-            elapsed_time = (time.time() - start_time) * 1000
+            elapsed_time = (time.perf_counter() - start_time) * 1000
+            timer.record("llm_total", elapsed_time)
             logger.info(f"stream_llm_response took {elapsed_time:.2f} milliseconds.")
 
-        return StreamingResponse(generate(), media_type="text/plain")
+        return StreamingResponse(generate(), media_type="text/plain", headers={"Server-Timing": timer.server_timing()})
     else:
         logger.info(stream)
-        response = llm_client.chat(
-            context=concatenated_context,
-            query=query,
-            stream=stream,
-            params=params,
-            model_prompt=settings.model.conversation_model_prompt,
-        )
+        with timer.stage("llm_total"):
+            response = llm_client.chat(
+                context=concatenated_context,
+                query=query,
+                stream=stream,
+                params=params,
+                model_prompt=settings.model.conversation_model_prompt,
+            )
+        # Without streaming the first token is not observable: the prompt processing time is recorded as its own stage
+        timings = response.get("timings") or {}
+        if timings.get("prompt_ms") is not None:
+            timer.record("llm_prompt", timings["prompt_ms"])
         logger.info(f"Response received: {response}")
         result = {
             "query": query,
@@ -64,14 +82,14 @@ def llm_response(concatenated_context: str, query: str, resources_id: list, stre
             "response": response["content"],
             "tokens_predicted": response["tokens_predicted"],
             "tokens_evaluated": response["tokens_evaluated"],
-            "prompt_n": response["timings"]["prompt_n"],
-            "prompt_ms": response["timings"]["prompt_ms"],
-            "prompt_per_token_ms": response["timings"]["prompt_per_token_ms"],
-            "prompt_per_second": response["timings"]["prompt_per_second"],
-            "predicted_n": response["timings"]["predicted_n"],
-            "predicted_ms": response["timings"]["predicted_ms"],
-            "predicted_per_token_ms": response["timings"]["predicted_per_token_ms"],
-            "predicted_per_second": response["timings"]["predicted_per_second"],
+            "prompt_n": timings.get("prompt_n"),
+            "prompt_ms": timings.get("prompt_ms"),
+            "prompt_per_token_ms": timings.get("prompt_per_token_ms"),
+            "prompt_per_second": timings.get("prompt_per_second"),
+            "predicted_n": timings.get("predicted_n"),
+            "predicted_ms": timings.get("predicted_ms"),
+            "predicted_per_token_ms": timings.get("predicted_per_token_ms"),
+            "predicted_per_second": timings.get("predicted_per_second"),
         }
         return result
 
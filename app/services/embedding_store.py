@@ -0,0 +1,163 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from app.config.settings import logger
+
+
+def text_digest(text) -> str:
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Persistent, content-addressed embedding cache: vectors are stored in SQLite as float16 blobs keyed
+    by (model key, sha256(text)), so texts embedded once are not embedded again across reindexing,
+    index recreation or evaluation runs. When the stored vectors exceed max_bytes the least recently
+    used ones are evicted, down to 90% of the limit. Hits update last_used in memory only: the updates are
+    written with the next put, or at most every touch_flush_seconds, so reads are not a disk write each.
+    """
+
+    def __init__(self, path: str, max_bytes: int, touch_flush_seconds: float = 60.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_flush_seconds = touch_flush_seconds
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # last_used of the vectors read since the last flush, by (model, digest)
+        self._touched = {}
+        self._flushed_at = time.monotonic()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode a crash can only lose the last commits, not corrupt the database, and lost vectors are recomputed
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(model TEXT NOT NULL, digest TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (model, digest))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+        self.size_bytes = self._stored_bytes()
+
+    def _stored_bytes(self) -> int:
+        return self._connection.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def _decode(blob: bytes) -> np.ndarray:
+        vector = np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+        # float16 rounding moves unit vectors slightly off the unit sphere, which dot_product similarity rejects
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get_many(self, model: str, digests: list[str]) -> dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(digests), 500):
+                chunk = digests[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({placeholders})", (model, *chunk)
+                ).fetchall()
+                found.update((digest, self._decode(blob)) for digest, blob in rows)
+            now = time.time()
+            self._touched.update(((model, digest), now) for digest in found)
+            if self._touched and time.monotonic() - self._flushed_at >= self.touch_flush_seconds:
+                self._write_touched()
+                self._connection.commit()
+            self.hits += len(found)
+            self.misses += len(digests) - len(found)
+        return found
+
+    def put_many(self, model: str, items: list[tuple[str, np.ndarray]]):
+        rows = [(model, digest, np.asarray(vector, dtype=np.float16).tobytes(), time.time()) for digest, vector in items]
+        with self._lock:
+            self._write_touched()
+            before = self._connection.total_changes
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, digest, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            inserted = self._connection.total_changes - before
+            self._connection.commit()
+            if inserted > 0 and rows:
+                self.size_bytes += inserted * len(rows[0][2])
+            if self.size_bytes > self.max_bytes:
+                self._evict()
+
+    def _write_touched(self):
+        """Writes the pending last_used updates, in the caller's transaction."""
+        if self._touched:
+            self._connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND digest = ?",
+                [(last_used, model, digest) for (model, digest), last_used in self._touched.items()],
+            )
+            self._touched = {}
+        self._flushed_at = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._write_touched()
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._write_touched()
+            self._connection.commit()
+            self._connection.close()
+
+    def _evict(self):
+        rows, size = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        target = int(self.max_bytes * 0.9)
+        if rows == 0 or size <= target:
+            self.size_bytes = size
+            return
+        to_delete = int(np.ceil((size - target) / (size / rows)))
+        self._connection.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (to_delete,)
+        )
+        self._connection.commit()
+        self.size_bytes = self._stored_bytes()
+        logger.info(f"Embedding store: evicted {to_delete} least recently used vectors, {self.size_bytes} bytes stored")
+
+    def encode(self, texts: list[str], model: str, encode) -> list[np.ndarray]:
+        """
+        Embeddings of texts in input order: stored vectors are read back, the others are computed with
+        encode(list of texts) -> list of vectors, in one call, and stored.
+        """
+        digests = [text_digest(text) for text in texts]
+        # First position of each distinct text, so duplicated texts are looked up and encoded once
+        positions = {}
+        for i, digest in enumerate(digests):
+            positions.setdefault(digest, i)
+        found = self.get_many(model, list(positions))
+        missing = [digest for digest in positions if digest not in found]
+        if missing:
+            encoded = encode([texts[positions[digest]] for digest in missing])
+            new_vectors = {digest: np.asarray(vector, dtype=np.float32) for digest, vector in zip(missing, encoded)}
+            self.put_many(model, list(new_vectors.items()))
+            found.update(new_vectors)
+        return [found[digest] for digest in digests]
+
+    def clear(self):
+        with self._lock:
+            self._touched = {}
+            self._connection.execute("DELETE FROM embeddings")
+            self._connection.commit()
+            self.size_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "path": self.path,
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total > 0 else 0,
+            }
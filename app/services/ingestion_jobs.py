@@ -0,0 +1,363 @@
+import asyncio
+from dataclasses import asdict, dataclass, field
+from itertools import islice
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from app import async_es_client, embedding_model
+from app.config.settings import logger, settings
+from app.db.index_documents import async_index_fhir_data
+from app.processor.fhir_processor import (
+    count_bundle_items,
+    iter_bundle_entries,
+    iter_bundle_resources,
+    iter_processed_resources,
+)
+from app.processor.files_processor import csv_to_dict
+from app.services.summarize import summarize_resources_parallel
+
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+# Errors kept per job (the most recent ones)
+MAX_JOB_ERRORS = 100
+# Progress is persisted at most once per interval (seconds), state changes are persisted immediately
+PROGRESS_SAVE_INTERVAL = 1.0
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class IngestionJob:
+    kind: str
+    filename: str
+    upload_path: str
+    params: dict
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    # Start of the current attempt: a job interrupted by a restart is attempted again
+    started_at: float = None
+    finished_at: float = None
+    attempts: int = 0
+    total: int = None
+    processed: int = 0
+    # Resources whose summaries are indexed, a resumed summarization restarts after them
+    checkpoint: int = 0
+    indexed: int = 0
+    failed: int = 0
+    skipped: int = 0
+    deleted: int = 0
+    tokens_predicted: int = 0
+    errors: list[str] = field(default_factory=list)
+    result: dict = field(default_factory=dict)
+    # Progress when the current attempt started, rates are measured from there
+    attempt_processed: int = 0
+    attempt_tokens: int = 0
+
+    def add_error(self, error: str):
+        self.errors.append(error)
+        del self.errors[:-MAX_JOB_ERRORS]
+
+    @property
+    def elapsed_seconds(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def docs_per_second(self) -> float:
+        elapsed = self.elapsed_seconds
+        return round((self.processed - self.attempt_processed) / elapsed, 2) if elapsed > 0 else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        elapsed = self.elapsed_seconds
+        return round((self.tokens_predicted - self.attempt_tokens) / elapsed, 2) if elapsed > 0 else 0.0
+
+    @property
+    def eta_seconds(self) -> float:
+        if self.status != "running" or self.total is None or self.docs_per_second == 0:
+            return None
+        return round(max(self.total - self.processed, 0) / self.docs_per_second, 1)
+
+    def to_dict(self) -> dict:
+        state = {
+            key: value for key, value in asdict(self).items() if key not in ("upload_path", "attempt_processed", "attempt_tokens")
+        }
+        return {
+            **state,
+            "progress": round(self.processed / self.total, 4) if self.total else None,
+            "elapsed_seconds": round(self.elapsed_seconds, 1),
+            "docs_per_second": self.docs_per_second,
+            "tokens_per_second": self.tokens_per_second,
+            "eta_seconds": self.eta_seconds,
+        }
+
+
+class JobStore:
+    """Ingestion jobs persisted in SQLite (one JSON state per job), so they survive restarts."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, created_at REAL NOT NULL, state TEXT NOT NULL)"
+        )
+        self._connection.commit()
+
+    def save(self, job: IngestionJob):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, created_at, state) VALUES (?, ?, ?, ?)",
+                (job.id, job.status, job.created_at, json.dumps(asdict(job))),
+            )
+            self._connection.commit()
+
+    def _select(self, where: str, args: tuple, limit: int = -1) -> list[IngestionJob]:
+        with self._lock:
+            rows = self._connection.execute(f"SELECT state FROM jobs {where} LIMIT ?", (*args, limit)).fetchall()
+        return [IngestionJob(**json.loads(state)) for (state,) in rows]
+
+    def get(self, job_id: str) -> IngestionJob:
+        jobs = self._select("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def list_jobs(self, status: str = None, limit: int = 50) -> list[IngestionJob]:
+        if status is None:
+            return self._select("ORDER BY created_at DESC", (), limit)
+        return self._select("WHERE status = ? ORDER BY created_at DESC", (status,), limit)
+
+    def unfinished(self) -> list[IngestionJob]:
+        return self._select("WHERE status IN ('queued', 'running') ORDER BY created_at", ())
+
+
+class _SummarizeProgress:
+    """Progress hook of summarize_resources_parallel, counting from the resources skipped on resume."""
+
+    def __init__(self, manager: "JobManager", job: IngestionJob):
+        self.manager = manager
+        self.job = job
+        self.start = job.checkpoint
+
+    def batch_done(self, resources: int, tokens_predicted: int, errors: list[str]):
+        self.job.processed += resources
+        self.job.tokens_predicted += tokens_predicted
+        for error in errors:
+            self.job.add_error(error)
+        self.manager.save_progress(self.job)
+
+    def indexed(self, resources: int, summary):
+        self.job.checkpoint = self.start + resources
+        self.job.indexed += summary.indexed
+        self.job.failed += len(summary.failed)
+        self.job.skipped += summary.skipped
+        self.job.deleted += summary.deleted
+        self.manager.save_progress(self.job, force=True)
+
+
+def _save_upload(file, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file, f, 1024 * 1024)
+
+
+def _count_items(path: str, prefix: str) -> int:
+    with open(path, "rb") as f:
+        return count_bundle_items(f, prefix)
+
+
+class JobManager:
+    """
+    Runs ingestion jobs in the background. Uploads are saved under upload_dir and jobs wait in a FIFO queue
+    processed by `workers` worker tasks. Job state is persisted in the store as it progresses, and jobs queued
+    or running when the app stopped are resumed on the next start: bulk loads are run again (idempotent
+    ingestion skips the documents already indexed), summarizations restart after their last indexed batch.
+    """
+
+    def __init__(self, store: JobStore, upload_dir: str, workers: int = 1):
+        self.store = store
+        self.upload_dir = upload_dir
+        self.workers = max(workers, 1)
+        # Unfinished jobs, whose in-memory state is more recent than the store
+        self.jobs = {}
+        self._queue = None
+        self._worker_tasks = []
+        self._running = {}
+        self._cancelled = set()
+        self._saved_at = {}
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        self._queue = asyncio.Queue()
+        for job in self.store.unfinished():
+            if job.status == "running":
+                job.status = "queued"
+                job.add_error(f"Interrupted after {job.processed} items, resumed on restart")
+                self.store.save(job)
+            self.jobs[job.id] = job
+            self._queue.put_nowait(job.id)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Ingestion jobs: {self.workers} workers started, {len(self.jobs)} jobs resumed")
+
+    async def stop(self):
+        # Running jobs are put back in the queue, to be resumed on the next start. Cancelled workers only return
+        # once the indexing threads of their job have stopped, so the clients can be closed afterwards
+        self._stopping = True
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def submit(self, kind: str, file, filename: str, params: dict) -> IngestionJob:
+        job = IngestionJob(kind=kind, filename=filename, upload_path="", params=params)
+        job.upload_path = os.path.join(self.upload_dir, job.id + os.path.splitext(filename)[1])
+        await asyncio.to_thread(_save_upload, file, job.upload_path)
+        self.store.save(job)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job.id)
+        logger.info(f"Ingestion job {job.id} ({kind}, {filename}) queued")
+        return job
+
+    def get(self, job_id: str) -> IngestionJob:
+        return self.jobs.get(job_id) or self.store.get(job_id)
+
+    def list_jobs(self, status: str = None, limit: int = 50) -> list[IngestionJob]:
+        return [self.jobs.get(job.id, job) for job in self.store.list_jobs(status, limit)]
+
+    def cancel(self, job_id: str) -> IngestionJob:
+        """Cancels a queued or running job; returns the job (None if unknown), unchanged if already finished."""
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return job
+        self._cancelled.add(job_id)
+        if job_id not in self._running:
+            self._finish(job, "cancelled")
+        else:
+            # The job is marked cancelled once its indexing threads have stopped (see index_in_thread)
+            self._running[job_id].cancel()
+        return job
+
+    def save_progress(self, job: IngestionJob, force: bool = False):
+        now = time.time()
+        if force or now - self._saved_at.get(job.id, 0) >= PROGRESS_SAVE_INTERVAL:
+            self._saved_at[job.id] = now
+            self.store.save(job)
+
+    def _finish(self, job: IngestionJob, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        self.store.save(job)
+        self.jobs.pop(job.id, None)
+        self._saved_at.pop(job.id, None)
+        if os.path.exists(job.upload_path):
+            os.remove(job.upload_path)
+        logger.info(f"Ingestion job {job.id} {status}: {job.processed} items in {job.elapsed_seconds:.1f}s")
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job.status != "queued":
+                continue
+            task = asyncio.create_task(self._run(job))
+            self._running[job_id] = task
+            try:
+                await task
+            finally:
+                self._running.pop(job_id, None)
+
+    async def _run(self, job: IngestionJob):
+        job.status = "running"
+        job.attempts += 1
+        job.started_at = time.time()
+        job.attempt_processed = job.processed = job.checkpoint
+        job.attempt_tokens = job.tokens_predicted
+        self.store.save(job)
+        try:
+            if job.kind == "bulk_load":
+                await self._bulk_load(job)
+            else:
+                await self._summarize_and_load(job)
+        except (asyncio.CancelledError, JobCancelled):
+            if job.id in self._cancelled:
+                self._finish(job, "cancelled")
+                return
+            # Shutdown: the job is resumed on the next start
+            job.status = "queued"
+            self.store.save(job)
+            raise
+        except Exception as e:
+            logger.error(f"Ingestion job {job.id} failed: {e}")
+            job.add_error(str(e))
+            self._finish(job, "failed")
+        else:
+            self._finish(job, "completed")
+
+    def _tracked(self, job: IngestionJob, items):
+        """Counts the items consumed by a load and stops it once cancelled (consumed in the indexing threads)."""
+        for item in items:
+            if job.id in self._cancelled or self._stopping:
+                raise JobCancelled(f"Job {job.id} cancelled")
+            job.processed += 1
+            self.save_progress(job)
+            yield item
+
+    async def _bulk_load(self, job: IngestionJob):
+        if job.upload_path.endswith(".json"):
+            job.total = await asyncio.to_thread(_count_items, job.upload_path, "entry.item")
+            file = open(job.upload_path, "rb")
+            data = iter_bundle_entries(file)
+        else:
+            file = open(job.upload_path, "rb")
+            data = csv_to_dict(file.read())
+            job.total = len(data)
+        try:
+            summary = await async_index_fhir_data(
+                self._tracked(job, data),
+                embedding_model=embedding_model,
+                index_name=settings.elasticsearch.index_name,
+                async_es_client=async_es_client,
+                **job.params,
+            )
+        finally:
+            file.close()
+        job.indexed, job.failed, job.skipped, job.deleted = summary.indexed, len(summary.failed), summary.skipped, summary.deleted
+        for failure in summary.failed[:MAX_JOB_ERRORS]:
+            job.add_error(f"{failure['_id']}: {failure['reason']}")
+        job.result = {key: value for key, value in summary.to_dict().items() if key != "failed"}
+
+    async def _summarize_and_load(self, job: IngestionJob):
+        params = dict(job.params)
+        limit = params.pop("limit", None)
+        remove_urls = params.pop("remove_urls", True)
+        job.total = await asyncio.to_thread(_count_items, job.upload_path, "entry.item.resource")
+        if limit is not None:
+            job.total = min(job.total, max(limit, 1))
+        with open(job.upload_path, "rb") as file:
+            # Resources summarized and indexed by a previous attempt are skipped before processing
+            resources = islice(iter_bundle_resources(file), job.checkpoint, job.total)
+            output_file = await summarize_resources_parallel(
+                model_prompt=settings.model.summaries_model_prompt,
+                async_es_client=async_es_client,
+                embedding_model=embedding_model,
+                resources=iter_processed_resources(resources, remove_urls=remove_urls),
+                progress=_SummarizeProgress(self, job),
+                **params,
+            )
+        job.result.setdefault("output_files", []).append(output_file)
+
+
+job_manager = JobManager(
+    JobStore(os.path.join(settings.jobs.dir, "jobs.sqlite")), os.path.join(settings.jobs.dir, "uploads"), settings.jobs.workers
+)
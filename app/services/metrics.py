@@ -0,0 +1,80 @@
+from collections import deque
+from contextlib import contextmanager
+import threading
+import time
+
+import numpy as np
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of latency samples per stage, keeping the last `window` samples of each
+    stage to report count, mean and p50/p95/p99 in milliseconds.
+    """
+
+    def __init__(self, window: int = 10000):
+        self.window = window
+        self.counts = {}
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, duration_ms: float):
+        with self._lock:
+            if stage not in self._samples:
+                self._samples[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+            self._samples[stage].append(duration_ms)
+            self.counts[stage] += 1
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self.counts.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = {stage: np.asarray(values, dtype=np.float64) for stage, values in self._samples.items()}
+            counts = dict(self.counts)
+        return {
+            stage: {
+                "count": counts[stage],
+                "mean_ms": round(float(values.mean()), 2),
+                "p50_ms": round(float(np.percentile(values, 50)), 2),
+                "p95_ms": round(float(np.percentile(values, 95)), 2),
+                "p99_ms": round(float(np.percentile(values, 99)), 2),
+            }
+            for stage, values in samples.items()
+            if len(values)
+        }
+
+
+metrics_registry = MetricsRegistry()
+
+
+class StageTimer:
+    """
+    Durations of the stages of one request, rendered as a Server-Timing header. Every stage is
+    also observed in the registry (if any) under `<prefix>.<stage>`.
+    """
+
+    def __init__(self, registry: MetricsRegistry = None, prefix: str = ""):
+        self.registry = registry
+        self.prefix = prefix
+        self.durations = {}
+
+    def record(self, stage: str, duration_ms: float):
+        # A stage run several times in one request (e.g. one rerank per query) is summed
+        self.durations[stage] = self.durations.get(stage, 0.0) + duration_ms
+        if self.registry is not None:
+            self.registry.observe(f"{self.prefix}.{stage}" if self.prefix else stage, duration_ms)
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000)
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={duration:.2f}" for stage, duration in self.durations.items())
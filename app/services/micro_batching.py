@@ -0,0 +1,129 @@
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+import numpy as np
+
+from app.config.settings import logger
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into one batched call of process_batch, run in a dedicated worker thread.
+
+    The first pending request opens a window of max_wait_ms; every request submitted before the window
+    closes, or until max_batch_size items are collected, is processed in the same batch. The window is
+    only opened under concurrent load (the previous batch coalesced several requests, or more are already
+    queued), so sequential callers such as bulk ingestion do not pay the wait. process_batch receives the
+    concatenated items and must return one output per item, in order; each caller's future is resolved
+    with the outputs of its own items.
+    """
+
+    def __init__(self, process_batch, max_batch_size: int = 64, max_wait_ms: float = 3.0, name: str = "micro-batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._concurrent = False
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, items: list) -> Future:
+        future = Future()
+        if not items:
+            future.set_result([])
+        else:
+            self._queue.put((list(items), future))
+        return future
+
+    def run(self, items: list) -> list:
+        """Blocking submit: returns the outputs of items once their batch has been processed."""
+        return self.submit(items).result()
+
+    def _collect(self) -> list:
+        requests = [self._queue.get()]
+        size = len(requests[0][0])
+        wait = self.max_wait if self._concurrent or not self._queue.empty() else 0
+        deadline = time.perf_counter() + wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        # Requests queued while the window was closed are still picked up without waiting
+        while size < self.max_batch_size:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        self._concurrent = len(requests) > 1
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            items = [item for request_items, _ in requests for item in request_items]
+            try:
+                outputs = self.process_batch(items)
+            except Exception as e:
+                logger.error(f"{self.name} batch of {len(items)} items failed: {e}")
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(items)
+            start = 0
+            for request_items, future in requests:
+                future.set_result(list(outputs[start : start + len(request_items)]))
+                start += len(request_items)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class MicroBatchingEncoder:
+    """
+    Embedding model wrapper whose normalized encode calls go through a MicroBatcher, so concurrent
+    requests share one forward pass. Calls larger than a batch, or with other options, go straight to the model.
+    """
+
+    def __init__(self, model, max_batch_size: int = 64, max_wait_ms: float = 3.0):
+        self.model = model
+        self.batcher = MicroBatcher(self._encode_batch, max_batch_size, max_wait_ms, name="embedding-batcher")
+
+    def _encode_batch(self, texts: list[str]) -> list:
+        return list(self.model.encode(texts, batch_size=len(texts), show_progress_bar=False, normalize_embeddings=True))
+
+    def encode(self, sentences, normalize_embeddings: bool = False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if (
+            not normalize_embeddings
+            or not texts
+            or len(texts) > self.batcher.max_batch_size
+            or set(kwargs) - {"show_progress_bar"}
+        ):
+            return self.model.encode(sentences, normalize_embeddings=normalize_embeddings, **kwargs)
+        embeddings = self.batcher.run(texts)
+        return embeddings[0] if single else np.vstack(embeddings)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
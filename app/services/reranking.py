@@ -1,12 +1,92 @@
-from FlagEmbedding import FlagReranker
-from typing import List, Tuple
+from collections import Counter
+import hashlib
+import os
+import threading
+from typing import List, Tuple, Union
 
+import numpy as np
+
+from app.config.settings import logger, settings
 from app.data_models.search_result import SearchResult
+from app.models.onnx_runtime import create_session, export_to_onnx, onnx_model_dir, quantize_onnx
+from app.services.cache import LRUCache
+from app.services.micro_batching import MicroBatcher
 
 
 class RerankingService:
-    def __init__(self, model_name="BAAI/bge-reranker-v2-m3"):
-        self.reranker = FlagReranker(model_name, use_fp16=True)
+    """
+    Cross-encoder reranker. The model is loaded on first use, pairs are scored in length-sorted
+    batches to minimize padding, and (query, content) scores are cached.
+    """
+
+    def __init__(
+        self,
+        model_name=settings.model.reranker_model_name,
+        batch_size=settings.model.rerank_batch_size,
+        cache_size=settings.model.rerank_cache_size,
+        micro_batching=settings.model.micro_batching,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache = LRUCache(maxsize=cache_size)
+        self._reranker = None
+        self._lock = threading.Lock()
+        # Pairs of concurrent requests are scored together in one batched forward pass
+        self.batcher = None
+        if micro_batching:
+            self.batcher = MicroBatcher(
+                self._score_pairs,
+                max_batch_size=settings.model.micro_batch_max_size,
+                max_wait_ms=settings.model.micro_batch_wait_ms,
+                name="rerank-batcher",
+            )
+
+    @property
+    def reranker(self):
+        if self._reranker is None:
+            with self._lock:
+                if self._reranker is None:
+                    from FlagEmbedding import FlagReranker
+
+                    logger.info(f"Loading reranker model '{self.model_name}'")
+                    self._reranker = FlagReranker(self.model_name, use_fp16=True)
+        return self._reranker
+
+    def _cache_key(self, query: str, content: str) -> tuple:
+        return (self.model_name, query, hashlib.sha256(content.encode("utf-8")).hexdigest())
+
+    def _score_pairs(self, pairs: List[List[str]]) -> List[float]:
+        scores = [None] * len(pairs)
+        # Longest pairs first, so each batch holds pairs of similar length
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][1]), reverse=True)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            batch_scores = self.reranker.compute_score([pairs[i] for i in batch], batch_size=len(batch), normalize=True)
+            if not isinstance(batch_scores, list):
+                batch_scores = [batch_scores]
+            for i, score in zip(batch, batch_scores):
+                scores[i] = score
+        return scores
+
+    def compute_scores(self, query: str, contents: List[str]) -> List[float]:
+        """Normalized relevance score of each content for the query, skipping the model for cached pairs."""
+        keys = [self._cache_key(query, content) for content in contents]
+        scores = [self.cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            pairs = [[query, contents[i]] for i in missing]
+            missing_scores = self.batcher.run(pairs) if self.batcher is not None else self._score_pairs(pairs)
+            for i, score in zip(missing, missing_scores):
+                scores[i] = score
+                self.cache.put(keys[i], score)
+        return scores
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_name,
+            "cache": self.cache.stats(),
+            "batcher": self.batcher.stats() if self.batcher is not None else None,
+        }
 
     def rerank(self, query: str, documents: List[SearchResult]) -> List[Tuple[SearchResult, float]]:
         """Computes a score for each document in the list of documents and returns a ranked list of documents.
@@ -15,8 +95,189 @@ class RerankingService:
         :param List[str] documents: Documents to be ranked
         :return tuple(str, float): list of tuples containing the document and its score
         """
-        scores = self.reranker.compute_score([[query, doc.content] for doc in documents], normalize=True)
-        print(scores)
+        if not documents:
+            return []
+        scores = self.compute_scores(query, [doc.content for doc in documents])
+        logger.debug(f"Rerank scores: {scores}")
 
         ranked_docs = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
         return ranked_docs
+
+
+class OnnxCrossEncoder:
+    """
+    Cross-encoder run with onnxruntime on CPU, exposing the compute_score interface of FlagReranker.
+    The model is exported to ONNX (and optionally int8 quantized) the first time it is loaded.
+    """
+
+    def __init__(self, model_name: str, model_dir: str, quantize: bool = True, num_threads: int = 0, max_length: int = 512):
+        from transformers import AutoTokenizer
+
+        self.max_length = max_length
+        onnx_path = os.path.join(model_dir, "model.onnx")
+        quantized_path = os.path.join(model_dir, "model.int8.onnx")
+        if not os.path.exists(onnx_path):
+            self._export(model_name, model_dir, onnx_path)
+        if quantize and not os.path.exists(quantized_path):
+            quantize_onnx(onnx_path, quantized_path)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = create_session(quantized_path if quantize else onnx_path, num_threads=num_threads)
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def _export(self, model_name: str, model_dir: str, onnx_path: str):
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        dummy_inputs = dict(tokenizer([["query", "document"]], return_tensors="pt"))
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in dummy_inputs}
+        dynamic_axes["logits"] = {0: "batch"}
+        export_to_onnx(model, dummy_inputs, ["logits"], onnx_path, dynamic_axes)
+        tokenizer.save_pretrained(model_dir)
+
+    def compute_score(self, sentence_pairs: List[List[str]], batch_size: int = 16, normalize: bool = False) -> List[float]:
+        scores = []
+        for start in range(0, len(sentence_pairs), batch_size):
+            batch = sentence_pairs[start : start + batch_size]
+            inputs = self.tokenizer(batch, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+            feed = {name: inputs[name].astype(np.int64) for name in self.input_names}
+            logits = self.session.run(["logits"], feed)[0][:, 0]
+            if normalize:
+                logits = 1 / (1 + np.exp(-logits))
+            scores.extend(logits.tolist())
+        return scores
+
+
+class OnnxRerankingService(RerankingService):
+    """RerankingService backed by an ONNX (optionally int8 quantized) export of the cross-encoder."""
+
+    def __init__(
+        self,
+        model_name=settings.model.reranker_model_name,
+        batch_size=settings.model.rerank_batch_size,
+        cache_size=settings.model.rerank_cache_size,
+        quantize=settings.model.reranker_onnx_quantize,
+        num_threads=settings.model.onnx_num_threads,
+        micro_batching=settings.model.micro_batching,
+    ):
+        super().__init__(model_name=model_name, batch_size=batch_size, cache_size=cache_size, micro_batching=micro_batching)
+        self.quantize = quantize
+        self.num_threads = num_threads
+
+    @property
+    def reranker(self):
+        if self._reranker is None:
+            with self._lock:
+                if self._reranker is None:
+                    logger.info(f"Loading ONNX reranker model '{self.model_name}' (int8: {self.quantize})")
+                    self._reranker = OnnxCrossEncoder(
+                        self.model_name,
+                        onnx_model_dir(settings.model.onnx_dir, self.model_name),
+                        quantize=self.quantize,
+                        num_threads=self.num_threads,
+                    )
+        return self._reranker
+
+
+class CascadeRerankingService:
+    """
+    Adaptive rerank cascade with the rerank interface of RerankingService.
+
+    Tier 0 keeps the hybrid search order when the relative margin between the first two hits is at
+    least skip_margin. Otherwise tier 1 scores every candidate with a small cross-encoder, and tier 2
+    rescores only its top `survivors` candidates with the full cross-encoder (tier 1 is skipped when
+    there are no more candidates than survivors). Survivors are ranked by
+    the full model, followed by the remaining candidates in light model order.
+    The number of queries handled by each tier and of pairs scored by each model are counted for reporting.
+    """
+
+    def __init__(
+        self,
+        light: RerankingService,
+        heavy: RerankingService,
+        skip_margin: float = settings.model.rerank_skip_margin,
+        survivors: int = settings.model.rerank_cascade_survivors,
+    ):
+        self.light = light
+        self.heavy = heavy
+        self.skip_margin = skip_margin
+        self.survivors = survivors
+        self.tier_counts = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, **counts):
+        with self._lock:
+            self.tier_counts.update(counts)
+
+    def hybrid_margin(self, documents: List[SearchResult]) -> float:
+        """Relative score gap between the first and second hits of the hybrid search."""
+        if len(documents) < 2:
+            return float("inf")
+        top, second = documents[0].score, documents[1].score
+        if top <= 0:
+            return 0.0
+        return (top - second) / top
+
+    def rerank(self, query: str, documents: List[SearchResult]) -> List[Tuple[SearchResult, float]]:
+        if not documents:
+            return []
+        if self.skip_margin > 0 and self.hybrid_margin(documents) >= self.skip_margin:
+            self._count(queries=1, skipped=1)
+            return [(document, document.score) for document in documents]
+
+        if len(documents) <= self.survivors:
+            # Every candidate would survive, the light model would not save anything
+            self._count(queries=1, heavy=1, heavy_pairs=len(documents))
+            return self.heavy.rerank(query, documents)
+
+        light_ranked = self.light.rerank(query, documents)
+        survivors, rest = light_ranked[: self.survivors], light_ranked[self.survivors :]
+        heavy_ranked = self.heavy.rerank(query, [document for document, _ in survivors])
+        self._count(queries=1, light=1, heavy=1, light_pairs=len(documents), heavy_pairs=len(survivors))
+        logger.debug(f"Rerank cascade: {len(documents)} candidates, {len(survivors)} rescored by '{self.heavy.model_name}'")
+        return heavy_ranked + rest
+
+    @staticmethod
+    def tier_report(tier_counts: Counter) -> dict:
+        """Share of queries that skipped reranking and average pairs scored per query by each model."""
+        queries = tier_counts["queries"]
+        return {
+            "queries": queries,
+            "skipped": tier_counts["skipped"],
+            "light": tier_counts["light"],
+            "heavy": tier_counts["heavy"],
+            "skip_rate": round(tier_counts["skipped"] / queries, 3) if queries else 0,
+            "light_pairs_per_query": round(tier_counts["light_pairs"] / queries, 2) if queries else 0,
+            "heavy_pairs_per_query": round(tier_counts["heavy_pairs"] / queries, 2) if queries else 0,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            tier_counts = Counter(self.tier_counts)
+        return {
+            "strategy": "cascade",
+            "skip_margin": self.skip_margin,
+            "survivors": self.survivors,
+            "tiers": self.tier_report(tier_counts),
+            "light": self.light.stats(),
+            "heavy": self.heavy.stats(),
+        }
+
+
+def get_reranking_service(
+    backend: str = settings.model.reranker_backend, strategy: str = settings.model.rerank_strategy
+) -> Union[RerankingService, CascadeRerankingService]:
+    """Reranker for the configured backend ("torch" or "onnx") and strategy ("full" or "cascade")."""
+    if backend == "onnx":
+        service_class = OnnxRerankingService
+    elif backend == "torch":
+        service_class = RerankingService
+    else:
+        raise ValueError(f"Unsupported reranker backend: {backend}")
+
+    if strategy == "full":
+        return service_class()
+    elif strategy == "cascade":
+        return CascadeRerankingService(service_class(model_name=settings.model.light_reranker_model_name), service_class())
+    raise ValueError(f"Unsupported rerank strategy: {strategy}")
@@ -1,30 +1,132 @@
+import asyncio
 from typing import List
 
-from app import reranker_service
+import numpy as np
+
+from app import embedding_store, local_index, reranker_service
+from app.config.elasticsearch_config import to_index_vector
 from app.config.settings import settings
 from app.data_models.search_result import SearchResult
+from app.models.sentence_transformer import embedding_model_key
+from app.services.cache import GenerationCounter, LRUCache
+from app.services.metrics import StageTimer
 
 
-def search_query(
-    query_text,
-    embedding_model,
-    es_client,
-    index_name=settings.elasticsearch.index_name,
-    k=5,
-    text_boost=0.25,
-    embedding_boost=4.0,
-    rerank_top_k=0,
-) -> List[SearchResult]:
-    query_embedding = embedding_model.encode(query_text, show_progress_bar=False).tolist()
-    query_body = {
-        "size": max(k, rerank_top_k),
+query_embedding_cache = LRUCache(maxsize=settings.model.query_embedding_cache_size)
+search_results_cache = LRUCache(maxsize=settings.elasticsearch.search_cache_size)
+# Bumped by every write to the index, so cached search results of older generations are never served again
+index_generation = GenerationCounter()
+
+
+def _query_cache_key(query_text: str) -> tuple:
+    return (settings.model.embedding_model_name, " ".join(query_text.split()))
+
+
+def _search_cache_key(query_text: str, index_name: str, generation: int, search_params: tuple) -> tuple:
+    return (generation, index_name, _query_cache_key(query_text), search_params)
+
+
+def _search_params(
+    k,
+    text_boost,
+    embedding_boost,
+    rerank_top_k,
+    retrieval_mode,
+    num_candidates,
+    fusion,
+    resource_types,
+    resource_ids,
+    quantization=None,
+) -> tuple:
+    return (
+        k,
+        text_boost,
+        embedding_boost,
+        rerank_top_k,
+        retrieval_mode,
+        num_candidates,
+        fusion,
+        tuple(resource_types or ()),
+        tuple(resource_ids or ()),
+        quantization,
+    )
+
+
+def invalidate_search_cache():
+    """Called after writes to the index: results cached before it are no longer served."""
+    index_generation.bump()
+
+
+def _lookup_search_results(query_texts: list[str], index_name: str, search_params: tuple) -> tuple[list, list, list[int]]:
+    """Returns the cache keys of the queries, the cached results (None on miss) and the indices of the misses."""
+    generation = index_generation.value
+    keys = [_search_cache_key(query_text, index_name, generation, search_params) for query_text in query_texts]
+    results = [search_results_cache.get(key) for key in keys]
+    return keys, results, [i for i, result in enumerate(results) if result is None]
+
+
+def _store_search_results(keys: list, results: list, missing: list[int], fresh_results: list) -> List[List[SearchResult]]:
+    for i, search_results in zip(missing, fresh_results):
+        results[i] = search_results
+        search_results_cache.put(keys[i], search_results)
+    return [list(search_results) for search_results in results]
+
+
+def embed_queries(query_texts: list[str], embedding_model) -> list[list]:
+    """
+    Returns the normalized embeddings of the queries, skipping the model for queries seen before.
+    Queries are keyed on whitespace-collapsed text and the embedding model name; misses are looked up in the
+    persistent embedding store, and the remaining ones are encoded in one batch.
+    """
+    keys = [_query_cache_key(query_text) for query_text in query_texts]
+    embeddings = [query_embedding_cache.get(key) for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+
+        def encode(texts: list[str]) -> list:
+            return list(embedding_model.encode(texts, show_progress_bar=False, normalize_embeddings=True))
+
+        texts = [query_texts[i] for i in missing]
+        encoded = encode(texts) if embedding_store is None else embedding_store.encode(texts, embedding_model_key(), encode)
+        encoded = [np.asarray(embedding, dtype=np.float32).tolist() for embedding in encoded]
+        for i, embedding in zip(missing, encoded):
+            embeddings[i] = embedding
+            query_embedding_cache.put(keys[i], embedding)
+    return embeddings
+
+
+def embed_query(query_text: str, embedding_model) -> list:
+    return embed_queries([query_text], embedding_model)[0]
+
+
+def build_metadata_filters(resource_types: list[str] = None, resource_ids: list[str] = None) -> list[dict]:
+    """Terms filters on the keyword metadata fields, used to restrict a search to some resources."""
+    filters = []
+    if resource_types:
+        filters.append({"terms": {"metadata.resource_type": resource_types}})
+    if resource_ids:
+        filters.append({"terms": {"metadata.resource_id": resource_ids}})
+    return filters
+
+
+def _filtered_match_all(filters: list[dict] = None) -> dict:
+    return {"bool": {"filter": filters}} if filters else {"match_all": {}}
+
+
+def build_script_score_body(
+    query_text: str, query_embedding: list, size: int, text_boost: float, embedding_boost: float, filters: list[dict] = None
+) -> dict:
+    """Exact hybrid search: BM25 match plus a cosine script_score evaluated over every (filtered) document."""
+    return {
+        "size": size,
         "query": {
             "bool": {
+                "filter": filters or [],
                 "should": [
                     {"match": {"content": {"query": query_text, "boost": text_boost}}},
                     {
                         "script_score": {
-                            "query": {"match_all": {}},
+                            "query": _filtered_match_all(filters),
                             "script": {
                                 "source": """
                                 double score = cosineSimilarity(params.query_vector, 'embedding');
@@ -38,33 +140,625 @@ def search_query(
                             "boost": embedding_boost,
                         }
                     },
-                ]
+                ],
+            }
+        },
+        "_source": ["content", "metadata"],
+    }
+
+
+def build_knn_body(
+    query_text: str,
+    query_embedding: list,
+    size: int,
+    text_boost: float,
+    embedding_boost: float,
+    num_candidates: int,
+    filters: list[dict] = None,
+) -> dict:
+    """
+    Approximate hybrid search: BM25 match plus an HNSW knn clause. ES sums the scores of both legs.
+    Filters are applied to the match query and as a knn pre-filter, so the graph search only visits matching documents.
+    """
+    knn = {
+        "field": "embedding",
+        "query_vector": query_embedding,
+        "k": size,
+        "num_candidates": max(num_candidates, size),
+        "boost": embedding_boost,
+    }
+    if filters:
+        knn["filter"] = filters
+    return {
+        "size": size,
+        "query": {
+            "bool": {
+                "filter": filters or [],
+                "should": [{"match": {"content": {"query": query_text, "boost": text_boost}}}],
+                "minimum_should_match": 1,
             }
         },
+        "knn": knn,
         "_source": ["content", "metadata"],
     }
-    response = es_client.search(index=index_name, body=query_body)
-    results = response["hits"]["hits"]
-    search_results = [
+
+
+def build_lexical_body(query_text: str, size: int, filters: list[dict] = None) -> dict:
+    """BM25 leg of the RRF search."""
+    return {
+        "size": size,
+        "query": {"bool": {"must": [{"match": {"content": query_text}}], "filter": filters or []}},
+        "_source": ["content", "metadata"],
+    }
+
+
+def build_vector_body(
+    query_embedding: list, size: int, retrieval_mode: str, num_candidates: int, filters: list[dict] = None
+) -> dict:
+    """Vector leg of the RRF search, using the HNSW graph in knn mode and an exact cosine otherwise."""
+    if retrieval_mode == "knn":
+        knn = {
+            "field": "embedding",
+            "query_vector": query_embedding,
+            "k": size,
+            "num_candidates": max(num_candidates, size),
+        }
+        if filters:
+            knn["filter"] = filters
+        return {"size": size, "knn": knn, "_source": ["content", "metadata"]}
+    return {
+        "size": size,
+        "query": {
+            "script_score": {
+                "query": _filtered_match_all(filters),
+                "script": {
+                    "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
+                    "params": {"query_vector": query_embedding},
+                },
+            }
+        },
+        "_source": ["content", "metadata"],
+    }
+
+
+def reciprocal_rank_fusion(ranked_hits: list[list[dict]], rank_constant: int, size: int) -> list[dict]:
+    """
+    Fuses several ranked lists of ES hits: each document scores sum(1 / (rank_constant + rank)) over the lists it appears in.
+    The fused score replaces the hit's _score.
+    """
+    fused = {}
+    for hits in ranked_hits:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit["_id"], {**hit, "_score": 0.0})
+            entry["_score"] += 1.0 / (rank_constant + rank)
+    return sorted(fused.values(), key=lambda hit: hit["_score"], reverse=True)[:size]
+
+
+def build_search_bodies(
+    query_text: str,
+    query_embedding: list,
+    size: int,
+    text_boost: float,
+    embedding_boost: float,
+    retrieval_mode: str,
+    num_candidates: int,
+    fusion: str,
+    filters: list[dict] = None,
+    rrf_window_size: int = settings.elasticsearch.rrf_window_size,
+    quantization: str = None,
+) -> list[dict]:
+    """
+    Search bodies needed to answer one query: a single hybrid query for fusion="sum",
+    or the lexical and vector legs as separate sub-searches for fusion="rrf". The query vector is sent in
+    the format of an index with the given vector quantization (see to_index_vector).
+    """
+    if retrieval_mode not in ("script_score", "knn"):
+        raise ValueError(f"Unsupported retrieval mode: {retrieval_mode}")
+    query_embedding = to_index_vector(query_embedding, quantization)
+    if fusion == "sum":
+        if retrieval_mode == "knn":
+            return [
+                build_knn_body(query_text, query_embedding, size, text_boost, embedding_boost, num_candidates, filters=filters)
+            ]
+        return [build_script_score_body(query_text, query_embedding, size, text_boost, embedding_boost, filters=filters)]
+    elif fusion == "rrf":
+        window = max(size, rrf_window_size)
+        return [
+            build_lexical_body(query_text, window, filters=filters),
+            build_vector_body(query_embedding, window, retrieval_mode, num_candidates, filters=filters),
+        ]
+    raise ValueError(f"Unsupported fusion method: {fusion}")
+
+
+def merge_responses(
+    responses: list[dict], size: int, fusion: str, rrf_rank_constant: int = settings.elasticsearch.rrf_rank_constant
+) -> list[dict]:
+    """Turns the ES responses of one query's search bodies into its final ranked hits."""
+    for response in responses:
+        if "error" in response:
+            raise RuntimeError(f"Search failed: {response['error']}")
+    if fusion == "rrf":
+        return reciprocal_rank_fusion([response["hits"]["hits"] for response in responses], rrf_rank_constant, size)
+    return responses[0]["hits"]["hits"]
+
+
+def hits_to_search_results(hits: list[dict]) -> List[SearchResult]:
+    return [
         SearchResult(
-            score=result["_score"],
-            content=str(result["_source"]["content"]),
-            metadata=result["_source"].get("metadata", {}),
+            score=hit["_score"],
+            content=str(hit["_source"]["content"]),
+            metadata=hit["_source"].get("metadata", {}),
         )
-        for result in results
+        for hit in hits
     ]
+
+
+def local_search(
+    query_text: str,
+    query_embedding: list,
+    size: int,
+    text_boost: float,
+    embedding_boost: float,
+    fusion: str,
+    resource_types: list[str] = None,
+    resource_ids: list[str] = None,
+    rrf_rank_constant: int = settings.elasticsearch.rrf_rank_constant,
+    rrf_window_size: int = settings.elasticsearch.rrf_window_size,
+) -> list[dict]:
+    """Ranked hits for one query from the in-process index (RETRIEVAL_BACKEND=local)."""
+    if fusion == "sum":
+        return local_index.search(
+            query_text,
+            query_embedding,
+            size,
+            text_boost,
+            embedding_boost,
+            resource_types=resource_types,
+            resource_ids=resource_ids,
+        )
+    elif fusion == "rrf":
+        legs = local_index.search_legs(
+            query_text, query_embedding, max(size, rrf_window_size), resource_types=resource_types, resource_ids=resource_ids
+        )
+        return reciprocal_rank_fusion(legs, rrf_rank_constant, size)
+    raise ValueError(f"Unsupported fusion method: {fusion}")
+
+
+def search_query(
+    query_text,
+    embedding_model,
+    es_client,
+    index_name=settings.elasticsearch.index_name,
+    k=5,
+    text_boost=0.25,
+    embedding_boost=4.0,
+    rerank_top_k=0,
+    retrieval_mode=settings.elasticsearch.retrieval_mode,
+    num_candidates=settings.elasticsearch.knn_num_candidates,
+    fusion=settings.elasticsearch.fusion,
+    resource_types: list[str] = None,
+    resource_ids: list[str] = None,
+    quantization: str = None,
+) -> List[SearchResult]:
+    """
+    Hybrid BM25 + vector search. With fusion="sum" both legs are combined in one query as a boosted score sum;
+    with fusion="rrf" they run as separate sub-searches of one _msearch and are merged by rank, so the boosts are ignored.
+    The query vector is sent in the format of the index vector quantization (ES_VECTOR_QUANTIZATION by default).
+    Results are cached until the next write to the index.
+    """
+    search_params = _search_params(
+        k,
+        text_boost,
+        embedding_boost,
+        rerank_top_k,
+        retrieval_mode,
+        num_candidates,
+        fusion,
+        resource_types,
+        resource_ids,
+        quantization,
+    )
+    keys, results, missing = _lookup_search_results([query_text], index_name, search_params)
+    if not missing:
+        return list(results[0])
+
+    size = max(k, rerank_top_k)
+    filters = build_metadata_filters(resource_types, resource_ids)
+    query_embedding = embed_query(query_text, embedding_model)
+    if local_index is not None:
+        hits = local_search(query_text, query_embedding, size, text_boost, embedding_boost, fusion, resource_types, resource_ids)
+    else:
+        bodies = build_search_bodies(
+            query_text,
+            query_embedding,
+            size,
+            text_boost,
+            embedding_boost,
+            retrieval_mode,
+            num_candidates,
+            fusion,
+            filters,
+            quantization=quantization,
+        )
+        if len(bodies) == 1:
+            responses = [es_client.search(index=index_name, body=bodies[0])]
+        else:
+            searches = [part for body in bodies for part in ({"index": index_name}, body)]
+            responses = es_client.msearch(searches=searches)["responses"]
+        hits = merge_responses(responses, size, fusion)
+    search_results = hits_to_search_results(hits)
     if rerank_top_k > 0:
         search_results = [result for result, score in reranker_service.rerank(query_text, search_results)[:k]]
-    return search_results
+    return _store_search_results(keys, results, missing, [search_results])[0]
 
 
-def fetch_all_documents(es_client, index_name=settings.elasticsearch.index_name, size: int = 2000):
-    query_body = {"query": {"match_all": {}}, "_source": ["content", "metadata"], "size": size}
+def search_queries(
+    query_texts: list[str],
+    embedding_model,
+    es_client,
+    index_name=settings.elasticsearch.index_name,
+    k=5,
+    text_boost=0.25,
+    embedding_boost=4.0,
+    rerank_top_k=0,
+    retrieval_mode=settings.elasticsearch.retrieval_mode,
+    num_candidates=settings.elasticsearch.knn_num_candidates,
+    fusion=settings.elasticsearch.fusion,
+    resource_types: list[str] = None,
+    resource_ids: list[str] = None,
+    quantization: str = None,
+) -> List[List[SearchResult]]:
+    """
+    Batched search_query: all queries missing from the results cache are embedded in one encode call
+    and sent in one _msearch request. Returns one list of results per query, in input order.
+    """
+    search_params = _search_params(
+        k,
+        text_boost,
+        embedding_boost,
+        rerank_top_k,
+        retrieval_mode,
+        num_candidates,
+        fusion,
+        resource_types,
+        resource_ids,
+        quantization,
+    )
+    keys, results, missing = _lookup_search_results(query_texts, index_name, search_params)
+    fresh_results = []
+    if missing:
+        fresh_results = _search_queries(
+            [query_texts[i] for i in missing],
+            embedding_model,
+            es_client,
+            index_name=index_name,
+            k=k,
+            text_boost=text_boost,
+            embedding_boost=embedding_boost,
+            rerank_top_k=rerank_top_k,
+            retrieval_mode=retrieval_mode,
+            num_candidates=num_candidates,
+            fusion=fusion,
+            resource_types=resource_types,
+            resource_ids=resource_ids,
+            quantization=quantization,
+        )
+    return _store_search_results(keys, results, missing, fresh_results)
 
-    response = es_client.search(index=index_name, body=query_body)
-    results = response["hits"]["hits"]
 
-    return [
-        {"id": result["_id"], "content": result["_source"].get("content", ""), "metadata": result["_source"].get("metadata", {})}
-        for result in results
-    ]
+def _search_queries(
+    query_texts: list[str],
+    embedding_model,
+    es_client,
+    index_name=settings.elasticsearch.index_name,
+    k=5,
+    text_boost=0.25,
+    embedding_boost=4.0,
+    rerank_top_k=0,
+    retrieval_mode=settings.elasticsearch.retrieval_mode,
+    num_candidates=settings.elasticsearch.knn_num_candidates,
+    fusion=settings.elasticsearch.fusion,
+    resource_types: list[str] = None,
+    resource_ids: list[str] = None,
+    quantization: str = None,
+    timer: StageTimer = None,
+) -> List[List[SearchResult]]:
+    """Uncached search_queries. Embedding, search and rerank durations are recorded in timer, if given."""
+    if not query_texts:
+        return []
+    timer = timer or StageTimer()
+    size = max(k, rerank_top_k)
+    with timer.stage("embedding"):
+        query_embeddings = embed_queries(query_texts, embedding_model)
+
+    with timer.stage("search"):
+        if local_index is not None:
+            all_hits = [
+                local_search(query_text, query_embedding, size, text_boost, embedding_boost, fusion, resource_types, resource_ids)
+                for query_text, query_embedding in zip(query_texts, query_embeddings)
+            ]
+        else:
+            searches, bodies_per_query = build_msearch(
+                query_texts,
+                query_embeddings,
+                index_name,
+                size,
+                text_boost,
+                embedding_boost,
+                retrieval_mode,
+                num_candidates,
+                fusion,
+                build_metadata_filters(resource_types, resource_ids),
+                quantization=quantization,
+            )
+            responses = es_client.msearch(searches=searches)["responses"]
+            all_hits = split_msearch_responses(responses, bodies_per_query, size, fusion)
+
+    all_results = []
+    for query_text, hits in zip(query_texts, all_hits):
+        search_results = hits_to_search_results(hits)
+        if rerank_top_k > 0:
+            with timer.stage("rerank"):
+                search_results = [result for result, score in reranker_service.rerank(query_text, search_results)[:k]]
+        all_results.append(search_results)
+    return all_results
+
+
+def build_msearch(
+    query_texts: list[str],
+    query_embeddings: list[list],
+    index_name: str,
+    size: int,
+    text_boost: float,
+    embedding_boost: float,
+    retrieval_mode: str,
+    num_candidates: int,
+    fusion: str,
+    filters: list[dict] = None,
+    quantization: str = None,
+) -> tuple[list[dict], list[int]]:
+    """Builds the _msearch payload for several queries, plus the number of search bodies used by each query."""
+    searches = []
+    bodies_per_query = []
+    for query_text, query_embedding in zip(query_texts, query_embeddings):
+        bodies = build_search_bodies(
+            query_text,
+            query_embedding,
+            size,
+            text_boost,
+            embedding_boost,
+            retrieval_mode,
+            num_candidates,
+            fusion,
+            filters,
+            quantization=quantization,
+        )
+        bodies_per_query.append(len(bodies))
+        for body in bodies:
+            searches.extend([{"index": index_name}, body])
+    return searches, bodies_per_query
+
+
+def split_msearch_responses(responses: list[dict], bodies_per_query: list[int], size: int, fusion: str) -> list[list[dict]]:
+    """Groups the _msearch responses back by query and merges each group into the query's ranked hits."""
+    all_hits = []
+    offset = 0
+    for n_bodies in bodies_per_query:
+        all_hits.append(merge_responses(responses[offset : offset + n_bodies], size, fusion))
+        offset += n_bodies
+    return all_hits
+
+
+async def async_search_query(
+    query_text,
+    embedding_model,
+    async_es_client,
+    index_name=settings.elasticsearch.index_name,
+    k=5,
+    text_boost=0.25,
+    embedding_boost=4.0,
+    rerank_top_k=0,
+    retrieval_mode=settings.elasticsearch.retrieval_mode,
+    num_candidates=settings.elasticsearch.knn_num_candidates,
+    fusion=settings.elasticsearch.fusion,
+    resource_types: list[str] = None,
+    resource_ids: list[str] = None,
+    timer: StageTimer = None,
+) -> List[SearchResult]:
+    """
+    search_query for the event loop: ES is queried with the async client, while the embedding
+    model and the reranker run in a worker thread so they don't block other requests.
+    """
+    return (
+        await async_search_queries(
+            [query_text],
+            embedding_model,
+            async_es_client,
+            index_name=index_name,
+            k=k,
+            text_boost=text_boost,
+            embedding_boost=embedding_boost,
+            rerank_top_k=rerank_top_k,
+            retrieval_mode=retrieval_mode,
+            num_candidates=num_candidates,
+            fusion=fusion,
+            resource_types=resource_types,
+            resource_ids=resource_ids,
+            timer=timer,
+        )
+    )[0]
+
+
+async def async_search_queries(
+    query_texts: list[str],
+    embedding_model,
+    async_es_client,
+    index_name=settings.elasticsearch.index_name,
+    k=5,
+    text_boost=0.25,
+    embedding_boost=4.0,
+    rerank_top_k=0,
+    retrieval_mode=settings.elasticsearch.retrieval_mode,
+    num_candidates=settings.elasticsearch.knn_num_candidates,
+    fusion=settings.elasticsearch.fusion,
+    resource_types: list[str] = None,
+    resource_ids: list[str] = None,
+    timer: StageTimer = None,
+) -> List[List[SearchResult]]:
+    """Asynchronous search_queries."""
+    search_params = _search_params(
+        k, text_boost, embedding_boost, rerank_top_k, retrieval_mode, num_candidates, fusion, resource_types, resource_ids
+    )
+    keys, results, missing = _lookup_search_results(query_texts, index_name, search_params)
+    fresh_results = []
+    if missing:
+        fresh_results = await _async_search_queries(
+            [query_texts[i] for i in missing],
+            embedding_model,
+            async_es_client,
+            index_name=index_name,
+            k=k,
+            text_boost=text_boost,
+            embedding_boost=embedding_boost,
+            rerank_top_k=rerank_top_k,
+            retrieval_mode=retrieval_mode,
+            num_candidates=num_candidates,
+            fusion=fusion,
+            resource_types=resource_types,
+            resource_ids=resource_ids,
+            timer=timer,
+        )
+    return _store_search_results(keys, results, missing, fresh_results)
+
+
+async def _async_search_queries(
+    query_texts: list[str],
+    embedding_model,
+    async_es_client,
+    index_name=settings.elasticsearch.index_name,
+    k=5,
+    text_boost=0.25,
+    embedding_boost=4.0,
+    rerank_top_k=0,
+    retrieval_mode=settings.elasticsearch.retrieval_mode,
+    num_candidates=settings.elasticsearch.knn_num_candidates,
+    fusion=settings.elasticsearch.fusion,
+    resource_types: list[str] = None,
+    resource_ids: list[str] = None,
+    timer: StageTimer = None,
+) -> List[List[SearchResult]]:
+    """Uncached async_search_queries."""
+    if not query_texts:
+        return []
+    if local_index is not None:
+        # Nothing to await on the local backend, the whole search runs in a worker thread
+        return await asyncio.to_thread(
+            _search_queries,
+            query_texts,
+            embedding_model,
+            None,
+            index_name=index_name,
+            k=k,
+            text_boost=text_boost,
+            embedding_boost=embedding_boost,
+            rerank_top_k=rerank_top_k,
+            fusion=fusion,
+            resource_types=resource_types,
+            resource_ids=resource_ids,
+            timer=timer,
+        )
+    timer = timer or StageTimer()
+    size = max(k, rerank_top_k)
+    with timer.stage("embedding"):
+        query_embeddings = await asyncio.to_thread(embed_queries, query_texts, embedding_model)
+
+    with timer.stage("search"):
+        searches, bodies_per_query = build_msearch(
+            query_texts,
+            query_embeddings,
+            index_name,
+            size,
+            text_boost,
+            embedding_boost,
+            retrieval_mode,
+            num_candidates,
+            fusion,
+            build_metadata_filters(resource_types, resource_ids),
+        )
+        responses = (await async_es_client.msearch(searches=searches))["responses"]
+        all_hits = split_msearch_responses(responses, bodies_per_query, size, fusion)
+
+    all_results = []
+    for query_text, hits in zip(query_texts, all_hits):
+        search_results = hits_to_search_results(hits)
+        if rerank_top_k > 0:
+            with timer.stage("rerank"):
+                ranked = await asyncio.to_thread(reranker_service.rerank, query_text, search_results)
+            search_results = [result for result, score in ranked[:k]]
+        all_results.append(search_results)
+    return all_results
+
+
+def _document_from_hit(hit: dict) -> dict:
+    return {"id": hit["_id"], "content": hit["_source"].get("content", ""), "metadata": hit["_source"].get("metadata", {})}
+
+
+def _pit_page_body(pit_id: str, keep_alive: str, page_size: int, search_after: list = None) -> dict:
+    body = {
+        "query": {"match_all": {}},
+        "_source": ["content", "metadata"],
+        "size": page_size,
+        "pit": {"id": pit_id, "keep_alive": keep_alive},
+        "sort": [{"_shard_doc": "asc"}],
+    }
+    if search_after:
+        body["search_after"] = search_after
+    return body
+
+
+def fetch_all_documents(es_client, index_name=settings.elasticsearch.index_name, page_size: int = 1000, keep_alive: str = "1m"):
+    """
+    Yields every document of the index, paging through a point in time with search_after,
+    so memory stays bounded by page_size whatever the size of the index.
+    """
+    if local_index is not None:
+        yield from local_index.iter_documents()
+        return
+    pit_id = es_client.open_point_in_time(index=index_name, keep_alive=keep_alive)["id"]
+    try:
+        search_after = None
+        while True:
+            response = es_client.search(body=_pit_page_body(pit_id, keep_alive, page_size, search_after))
+            hits = response["hits"]["hits"]
+            if not hits:
+                break
+            for hit in hits:
+                yield _document_from_hit(hit)
+            pit_id = response.get("pit_id", pit_id)
+            search_after = hits[-1]["sort"]
+    finally:
+        es_client.close_point_in_time(id=pit_id)
+
+
+async def async_fetch_all_documents(
+    async_es_client, index_name=settings.elasticsearch.index_name, page_size: int = 1000, keep_alive: str = "1m"
+):
+    """Asynchronous fetch_all_documents."""
+    if local_index is not None:
+        for document in local_index.iter_documents():
+            yield document
+        return
+    pit_id = (await async_es_client.open_point_in_time(index=index_name, keep_alive=keep_alive))["id"]
+    try:
+        search_after = None
+        while True:
+            response = await async_es_client.search(body=_pit_page_body(pit_id, keep_alive, page_size, search_after))
+            hits = response["hits"]["hits"]
+            if not hits:
+                break
+            for hit in hits:
+                yield _document_from_hit(hit)
+            pit_id = response.get("pit_id", pit_id)
+            search_after = hits[-1]["sort"]
+    finally:
+        await async_es_client.close_point_in_time(id=pit_id)
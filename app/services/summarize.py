@@ -1,13 +1,15 @@
+import asyncio
 import csv
 import os
+from typing import Iterable
 
-from elasticsearch import helpers
 import traceback
 
 from app.config.settings import logger, settings
-from app.db.index_documents import bulk_load_fhir_data
+from app.db.index_documents import async_index_fhir_data, batched, ingest_mode
 from app.processor.files_processor import ensure_data_directory_exists, generate_output_filename
 from app.services.llama_client import llm_client
+from app.services.search_documents import invalidate_search_cache
 
 
 def summarize_resources(resources: list[dict], stream: bool = False):
@@ -36,10 +38,25 @@ def summarize_resources(resources: list[dict], stream: bool = False):
 
 
 async def summarize_resources_parallel(
-    model_prompt: str, es_client, embedding_model, resources: list[dict], batch_size: int = 4
+    model_prompt: str,
+    async_es_client,
+    embedding_model,
+    resources: Iterable[dict],
+    batch_size: int = 4,
+    index_batch_size: int = 256,
+    bulk_ingest: bool = False,
+    force_merge: bool = False,
+    progress=None,
 ) -> str:
     """
     Summarizes resources in parallel, saves results to a CSV file, and loads summaries into Elasticsearch.
+    resources can be a lazy iterable (e.g. streamed from the uploaded bundle): it is consumed batch_size
+    resources at a time, and summaries are indexed every index_batch_size results, so memory stays bounded.
+    With bulk_ingest=True the index stays in bulk ingest mode for the whole run (see async_index_fhir_data).
+
+    progress, if given, is notified with progress.batch_done(resources, tokens_predicted, errors) after each
+    LLM batch and with progress.indexed(resources, summary) after each indexing, resources being the number
+    of resources consumed so far, whose summaries are then all indexed (or failed).
     """
     # Verify if data directory exists
     data_dir = ensure_data_directory_exists()
@@ -66,58 +83,84 @@ async def summarize_resources_parallel(
     ]
 
     final_results = []
+    consumed = 0
 
-    # Open CSV file to write results
-    with open(output_file, mode="w", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        writer.writeheader()
-
-        for i in range(0, len(resources), batch_size):
-            resource_batch = resources[i : i + batch_size]
-            try:
-                # Process the batch in parallel using the LLM client
-                result = await llm_client.process_parallel(resource_batch=resource_batch, model_prompt=model_prompt)
-
-                extracted_results = []
-                for resource, response in zip(resource_batch, result):
-                    if not response or not isinstance(response, dict):
-                        logger.error(f"Invalid response for resource {resource['resource_id']}")
-                        continue
-                    extracted_response = {
-                        "resource_id": resource["resource_id"],
-                        "resource": resource["resource"],
-                        "resource_type": resource["resource_type"],
-                        "summary": response["content"],
-                        "tokens_predicted": response["tokens_predicted"],
-                        "tokens_evaluated": response["tokens_evaluated"],
-                        "prompt_n": response["timings"]["prompt_n"],
-                        "prompt_ms": response["timings"]["prompt_ms"],
-                        "prompt_per_token_ms": response["timings"]["prompt_per_token_ms"],
-                        "prompt_per_second": response["timings"]["prompt_per_second"],
-                        "predicted_n": response["timings"]["predicted_n"],
-                        "predicted_ms": response["timings"]["predicted_ms"],
-                        "predicted_per_token_ms": response["timings"]["predicted_per_token_ms"],
-                        "predicted_per_second": response["timings"]["predicted_per_second"],
-                    }
-
-                    writer.writerow(extracted_response)
-                    extracted_results.append(extracted_response)
-                    final_results.append(extracted_response)
-
-                    # Flush the file after each batch
-                    file.flush()
-
-            except Exception as e:
-                logger.error(f"Error processing batch: {str(e)}")
-    # Load results into Elasticsearch
-    helpers.bulk(
-        es_client,
-        bulk_load_fhir_data(
+    async def index_results():
+        summary = await async_index_fhir_data(
             data=final_results,
             text_key="summary",
             embedding_model=embedding_model,
             index_name=settings.elasticsearch.index_name,
-        ),
-    )
+            async_es_client=async_es_client,
+        )
+        final_results.clear()
+        if progress is not None:
+            progress.indexed(consumed, summary)
+
+    # Refreshes stay disabled until the last summaries are indexed
+    async with ingest_mode(settings.elasticsearch.index_name, bulk_ingest, force_merge):
+        # Open CSV file to write results
+        with open(output_file, mode="w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+
+            resource_batches = batched(resources, batch_size)
+            while True:
+                # Parsing the next resources of a streamed upload is blocking, keep it off the event loop
+                resource_batch = await asyncio.to_thread(next, resource_batches, None)
+                if resource_batch is None:
+                    break
+                consumed += len(resource_batch)
+                tokens_predicted = 0
+                errors = []
+                try:
+                    # Process the batch in parallel using the LLM client
+                    result = await llm_client.process_parallel(resource_batch=resource_batch, model_prompt=model_prompt)
+
+                    extracted_results = []
+                    for resource, response in zip(resource_batch, result):
+                        if not response or not isinstance(response, dict):
+                            errors.append(f"Invalid response for resource {resource['resource_id']}")
+                            logger.error(errors[-1])
+                            continue
+                        extracted_response = {
+                            "resource_id": resource["resource_id"],
+                            "resource": resource["resource"],
+                            "resource_type": resource["resource_type"],
+                            "summary": response["content"],
+                            "tokens_predicted": response["tokens_predicted"],
+                            "tokens_evaluated": response["tokens_evaluated"],
+                            "prompt_n": response["timings"]["prompt_n"],
+                            "prompt_ms": response["timings"]["prompt_ms"],
+                            "prompt_per_token_ms": response["timings"]["prompt_per_token_ms"],
+                            "prompt_per_second": response["timings"]["prompt_per_second"],
+                            "predicted_n": response["timings"]["predicted_n"],
+                            "predicted_ms": response["timings"]["predicted_ms"],
+                            "predicted_per_token_ms": response["timings"]["predicted_per_token_ms"],
+                            "predicted_per_second": response["timings"]["predicted_per_second"],
+                        }
+
+                        tokens_predicted += response["tokens_predicted"] or 0
+                        writer.writerow(extracted_response)
+                        extracted_results.append(extracted_response)
+                        final_results.append(extracted_response)
+
+                        # Flush the file after each batch
+                        file.flush()
+
+                except Exception as e:
+                    errors.append(f"Error processing batch: {str(e)}")
+                    logger.error(errors[-1])
+                if progress is not None:
+                    progress.batch_done(len(resource_batch), tokens_predicted, errors)
+
+                # Load results into the retrieval backend
+                if len(final_results) >= index_batch_size:
+                    await index_results()
+        if final_results:
+            await index_results()
+    if bulk_ingest:
+        # Summaries indexed during the run only became searchable when the index was refreshed on exit
+        invalidate_search_cache()
 
     return output_file
@@ -95,7 +95,14 @@ def methodlogy_1_retrieval_metrics(
 
 
 def methodlogy_2_retrieval_metrics(
-    resource_chunk_counts, openai_responses, num_sampled_questions, endpoint_url, search_text_boost, search_embedding_boost, k=5
+    resource_chunk_counts,
+    openai_responses,
+    num_sampled_questions,
+    endpoint_url,
+    search_text_boost,
+    search_embedding_boost,
+    k=5,
+    fusion="sum",
 ):
     # Initialize counters and sums for metrics
     total_questions = 0
@@ -137,6 +144,7 @@ def methodlogy_2_retrieval_metrics(
                         "k": k,
                         "text_boost": search_text_boost,
                         "embedding_boost": search_embedding_boost,
+                        "fusion": fusion,
                     }
                     response = requests.get(endpoint_url, params=params)
                     search_results = response.json()
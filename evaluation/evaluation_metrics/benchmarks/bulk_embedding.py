@@ -0,0 +1,87 @@
+"""
+Ingestion embedding throughput (docs/sec): one encode call per document, as bulk_load_fhir_data
+used to do, against batched and length-sorted encoding for each configured batch size.
+
+Only the action generator is consumed, nothing is indexed. The embedding store is bypassed, so every
+run encodes all the documents instead of reading cached vectors. Run it with RETRIEVAL_BACKEND=local
+to avoid connecting to Elasticsearch.
+
+Usage:
+    RETRIEVAL_BACKEND=local python -m evaluation.evaluation_metrics.benchmarks.bulk_embedding
+"""
+
+from datetime import datetime
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from app import embedding_model
+from app.db.index_documents import bulk_load_fhir_data
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+FHIR_DATA_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "fhir"))
+OUTPUT_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "benchmarks"))
+
+
+def load_documents(params: dict) -> list[dict]:
+    with open(os.path.join(FHIR_DATA_DIR, params["chunks_file"]), "r") as f:
+        chunks = [str(entry["resource"]) for entry in json.load(f)["entry"]]
+    random.seed(params["seed"])
+    chunks = random.sample(chunks, min(params["num_documents"], len(chunks)))
+    return [{"resource_id": str(i), "resource_type": "Benchmark", "resource": chunk} for i, chunk in enumerate(chunks)]
+
+
+def per_document(documents: list[dict]) -> list:
+    return [embedding_model.encode(document["resource"], normalize_embeddings=True) for document in documents]
+
+
+def batched(documents: list[dict], batch_size: int) -> list:
+    # Without the embedding store, which would serve every run after the first from its cache
+    actions = bulk_load_fhir_data(
+        documents, "resource", embedding_model, "benchmark", batch_size=batch_size, use_embedding_store=False
+    )
+    return [action["_source"]["embedding"] for action in actions]
+
+
+def main():
+    with open(os.path.join(CURRENT_DIR, "data", "bulk_embedding.json"), "r") as f:
+        params = json.load(f)
+    documents = load_documents(params)
+    per_document(documents[:8])
+
+    start = time.perf_counter()
+    reference = np.asarray(per_document(documents), dtype=np.float32)
+    rows = [("per document", len(documents) / (time.perf_counter() - start), 1.0)]
+    for batch_size in params["batch_sizes"]:
+        start = time.perf_counter()
+        embeddings = np.asarray(batched(documents, batch_size), dtype=np.float32)
+        elapsed = time.perf_counter() - start
+        # Actions must come back in input order, with the same vectors as the per document encoding
+        min_cosine = float((reference * embeddings).sum(axis=1).min())
+        rows.append((f"batch {batch_size}", len(documents) / elapsed, min_cosine))
+
+    lines = [
+        f"Bulk embedding benchmark - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Documents: {len(documents)}, mean length: {np.mean([len(d['resource']) for d in documents]):.0f} characters",
+        "Embedding store: bypassed, every mode encodes all the documents (cold cache)",
+        "",
+        f"{'Mode':<14}{'Docs/sec':>10}{'Speedup':>9}{'Min cos':>10}",
+    ]
+    for mode, docs_per_second, min_cosine in rows:
+        lines.append(f"{mode:<14}{docs_per_second:>10.1f}{docs_per_second / rows[0][1]:>9.2f}{min_cosine:>10.4f}")
+    report = "\n".join(lines)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_file = os.path.join(OUTPUT_DIR, f"bulk_embedding_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(output_file, "w") as f:
+        f.write(report + "\n")
+    print(report)
+    print(f"Report saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
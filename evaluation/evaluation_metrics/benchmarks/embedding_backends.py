@@ -0,0 +1,125 @@
+"""
+Latency, throughput and cosine agreement of the embedding backends on CPU.
+
+Embeds the same queries (one at a time, as in /search) and document chunks (in batches, as in
+/bulk_load) with the PyTorch fp32 sentence-transformers model, which is the reference, and with each
+configured (backend, precision) pair. Agreement is the cosine similarity of each vector with its
+reference, and the top-10 overlap of the documents retrieved for each query; a backend passes the
+check when its minimum cosine is above min_cosine, i.e. its vectors can be mixed with the indexed ones.
+
+Usage:
+    python -m evaluation.evaluation_metrics.benchmarks.embedding_backends
+"""
+
+from datetime import datetime
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from app.evaluation.retrieval.sampling import sample_questions
+from app.models.sentence_transformer import get_sentence_transformer
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+APP_DATA_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "..", "app", "data"))
+FHIR_DATA_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "fhir"))
+OUTPUT_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "benchmarks"))
+
+
+def load_texts(params: dict) -> tuple[list[str], list[str]]:
+    with open(os.path.join(APP_DATA_DIR, params["qa_references_file"]), "r") as f:
+        qa_references = [json.loads(line) for line in f]
+    with open(os.path.join(FHIR_DATA_DIR, params["chunks_file"]), "r") as f:
+        chunks = [str(entry["resource"]) for entry in json.load(f)["entry"]]
+
+    random.seed(params["seed"])
+    questions = [question for _, question in sample_questions(qa_references)][: params["num_queries"]]
+    return questions, random.sample(chunks, min(params["num_documents"], len(chunks)))
+
+
+def run(model, queries: list[str], documents: list[str], batch_size: int, repeats: int) -> dict:
+    # Warm up so model loading and the first allocation are not measured
+    model.encode(queries[:1], normalize_embeddings=True)
+
+    query_latencies = []
+    document_seconds = []
+    for _ in range(repeats):
+        query_embeddings = []
+        for query in queries:
+            start = time.perf_counter()
+            query_embeddings.append(model.encode([query], show_progress_bar=False, normalize_embeddings=True)[0])
+            query_latencies.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        document_embeddings = model.encode(documents, batch_size=batch_size, show_progress_bar=False, normalize_embeddings=True)
+        document_seconds.append(time.perf_counter() - start)
+
+    return {
+        "query_embeddings": np.asarray(query_embeddings, dtype=np.float32),
+        "document_embeddings": np.asarray(document_embeddings, dtype=np.float32),
+        "query_p50": round(float(np.percentile(query_latencies, 50)), 2),
+        "query_p95": round(float(np.percentile(query_latencies, 95)), 2),
+        "docs_per_second": round(len(documents) / float(np.median(document_seconds)), 1),
+    }
+
+
+def agreement(reference: dict, result: dict, k: int = 10) -> dict:
+    cosines = np.concatenate(
+        [
+            (reference["query_embeddings"] * result["query_embeddings"]).sum(axis=1),
+            (reference["document_embeddings"] * result["document_embeddings"]).sum(axis=1),
+        ]
+    )
+    reference_scores = reference["query_embeddings"] @ reference["document_embeddings"].T
+    scores = result["query_embeddings"] @ result["document_embeddings"].T
+    reference_top = np.argsort(-reference_scores, axis=1)[:, :k]
+    top = np.argsort(-scores, axis=1)[:, :k]
+    overlaps = [len(set(a) & set(b)) / k for a, b in zip(reference_top, top)]
+    return {
+        "mean_cosine": round(float(cosines.mean()), 5),
+        "min_cosine": round(float(cosines.min()), 5),
+        "top10_overlap": round(float(np.mean(overlaps)), 3),
+    }
+
+
+def main():
+    with open(os.path.join(CURRENT_DIR, "data", "embedding_backends.json"), "r") as f:
+        params = json.load(f)
+    queries, documents = load_texts(params)
+
+    reference = run(get_sentence_transformer("torch", "fp32"), queries, documents, params["batch_size"], params["repeats"])
+    rows = [{"backend": "torch", "precision": "fp32", **reference, **agreement(reference, reference)}]
+    for backend, precision in params["backends"]:
+        model = get_sentence_transformer(backend, precision, num_threads=params["num_threads"])
+        result = run(model, queries, documents, params["batch_size"], params["repeats"])
+        rows.append({"backend": backend, "precision": precision, **result, **agreement(reference, result)})
+        del model
+
+    lines = [
+        f"Embedding backends benchmark - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Queries: {len(queries)}, documents: {len(documents)}, batch size: {params['batch_size']}, "
+        f"repeats: {params['repeats']}, min cosine: {params['min_cosine']}",
+        "",
+        f"{'Backend':<14}{'Query p50 (ms)':>15}{'Query p95 (ms)':>15}{'Docs/sec':>10}"
+        f"{'Mean cos':>10}{'Min cos':>10}{'Top-10':>8}{'Check':>7}",
+    ]
+    for row in rows:
+        check = "ok" if row["min_cosine"] >= params["min_cosine"] else "FAIL"
+        lines.append(
+            f"{row['backend'] + ' ' + row['precision']:<14}{row['query_p50']:>15}{row['query_p95']:>15}"
+            f"{row['docs_per_second']:>10}{row['mean_cosine']:>10}{row['min_cosine']:>10}{row['top10_overlap']:>8}{check:>7}"
+        )
+    report = "\n".join(lines)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_file = os.path.join(OUTPUT_DIR, f"embedding_backends_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(output_file, "w") as f:
+        f.write(report + "\n")
+    print(report)
+    print(f"Report saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
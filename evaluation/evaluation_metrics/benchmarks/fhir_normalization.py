@@ -0,0 +1,77 @@
+"""
+FHIR normalization micro-benchmark: normalize_resource against the previous per-resource pipeline
+(extract_text, remove_urls_from_fhir, json.dumps and backslash removal) on a Synthea patient bundle,
+checking that both produce byte-identical text for every resource.
+
+Usage:
+    RETRIEVAL_BACKEND=local python -m evaluation.evaluation_metrics.benchmarks.fhir_normalization
+"""
+
+import copy
+from datetime import datetime
+import json
+import os
+import time
+
+from app.processor.fhir_processor import extract_text, normalize_resource, remove_urls_from_fhir
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+FHIR_DATA_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "fhir"))
+OUTPUT_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "benchmarks"))
+
+
+def legacy_normalize(resource: dict, remove_urls: bool) -> str:
+    resource = extract_text(resource)
+    if remove_urls:
+        resource = remove_urls_from_fhir(resource)
+    return json.dumps(resource).replace("\\", "")
+
+
+def best_time(normalize, resources: list[dict], remove_urls: bool, repeats: int) -> tuple[float, list[str]]:
+    times = []
+    for _ in range(repeats):
+        # extract_text decodes attachments in place, so every run gets a fresh copy of the resources
+        data = copy.deepcopy(resources)
+        start = time.perf_counter()
+        output = [normalize(resource, remove_urls) for resource in data]
+        times.append(time.perf_counter() - start)
+    return min(times), output
+
+
+def main():
+    with open(os.path.join(CURRENT_DIR, "data", "fhir_normalization.json"), "r") as f:
+        params = json.load(f)
+    with open(os.path.join(FHIR_DATA_DIR, params["bundle_file"]), "r") as f:
+        resources = [entry["resource"] for entry in json.load(f).get("entry", []) if "resource" in entry]
+
+    rows = []
+    for remove_urls in params["remove_urls"]:
+        legacy_time, reference = best_time(legacy_normalize, resources, remove_urls, params["repeats"])
+        new_time, output = best_time(normalize_resource, resources, remove_urls, params["repeats"])
+        identical = sum(text == expected for text, expected in zip(output, reference))
+        rows.append((remove_urls, legacy_time, new_time, identical))
+
+    lines = [
+        f"FHIR normalization benchmark - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Bundle: {params['bundle_file']}, {len(resources)} resources, best of {params['repeats']}",
+        "",
+        f"{'remove_urls':<13}{'Legacy ms':>11}{'New ms':>9}{'Speedup':>9}{'Identical':>12}",
+    ]
+    for remove_urls, legacy_time, new_time, identical in rows:
+        lines.append(
+            f"{str(remove_urls):<13}{legacy_time * 1000:>11.2f}{new_time * 1000:>9.2f}"
+            f"{legacy_time / new_time:>9.2f}{f'{identical}/{len(resources)}':>12}"
+        )
+    report = "\n".join(lines)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_file = os.path.join(OUTPUT_DIR, f"fhir_normalization_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(output_file, "w") as f:
+        f.write(report + "\n")
+    print(report)
+    print(f"Report saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+FHIR preprocessing throughput (resources/sec): process_resources in the calling thread against the
+process pool mode for each configured worker count and chunk size, on a Synthea patient bundle.
+Every parallel run must return exactly the serial output, in the same order. Worker processes only pay
+off once per-resource work outweighs pickling resources to them and results back (large bundles,
+attachments to decode); a single small bundle is usually faster serially.
+
+Usage:
+    RETRIEVAL_BACKEND=local python -m evaluation.evaluation_metrics.benchmarks.fhir_processing
+"""
+
+import copy
+from datetime import datetime
+import json
+import os
+import time
+
+from app.processor.fhir_processor import process_resources
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+FHIR_DATA_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "fhir"))
+OUTPUT_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "benchmarks"))
+
+
+def best_time(bundle: dict, params: dict, workers: int, chunk_size: int) -> tuple[float, list[dict]]:
+    times = []
+    for _ in range(params["repeats"]):
+        # extract_text decodes attachments in place, so every run gets a fresh copy of the bundle
+        data = copy.deepcopy(bundle)
+        start = time.perf_counter()
+        output = process_resources(data, params["remove_urls"], workers=workers, chunk_size=chunk_size)
+        times.append(time.perf_counter() - start)
+    return min(times), output
+
+
+def main():
+    with open(os.path.join(CURRENT_DIR, "data", "fhir_processing.json"), "r") as f:
+        params = json.load(f)
+    with open(os.path.join(FHIR_DATA_DIR, params["bundle_file"]), "r") as f:
+        bundle = json.load(f)
+    num_resources = sum(1 for entry in bundle.get("entry", []) if "resource" in entry)
+
+    serial_time, reference = best_time(bundle, params, 0, 1)
+    rows = [("serial", "-", serial_time, True)]
+    for workers in params["workers"]:
+        # The first call starts the pool; it is reused by the timed runs
+        process_resources(copy.deepcopy(bundle), params["remove_urls"], workers=workers)
+        for chunk_size in params["chunk_sizes"]:
+            elapsed, output = best_time(bundle, params, workers, chunk_size)
+            rows.append((f"{workers} workers", chunk_size, elapsed, output == reference))
+
+    lines = [
+        f"FHIR processing benchmark - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Bundle: {params['bundle_file']}, {num_resources} resources, remove_urls={params['remove_urls']}, "
+        f"{os.cpu_count()} CPUs, best of {params['repeats']}",
+        "",
+        f"{'Mode':<12}{'Chunk':>7}{'Res/sec':>10}{'Speedup':>9}{'Identical':>11}",
+    ]
+    for mode, chunk_size, elapsed, identical in rows:
+        lines.append(
+            f"{mode:<12}{chunk_size:>7}{num_resources / elapsed:>10.1f}{serial_time / elapsed:>9.2f}{str(identical):>11}"
+        )
+    report = "\n".join(lines)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_file = os.path.join(OUTPUT_DIR, f"fhir_processing_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(output_file, "w") as f:
+        f.write(report + "\n")
+    print(report)
+    print(f"Report saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Query embedding latency and throughput under concurrent load, with and without micro-batching.
+
+Each client thread embeds questions one at a time, as the /search endpoint does. The direct run calls
+the embedding model from every thread; the batched run goes through a MicroBatchingEncoder so that
+concurrent calls share one forward pass.
+
+Usage:
+    python -m evaluation.evaluation_metrics.benchmarks.micro_batching
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from app.evaluation.retrieval.sampling import sample_questions
+from app.models.sentence_transformer import get_sentence_transformer
+from app.services.micro_batching import MicroBatchingEncoder
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+APP_DATA_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "..", "app", "data"))
+OUTPUT_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "benchmarks"))
+
+
+def client(model, questions: list[str]) -> list[float]:
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        model.encode([question], show_progress_bar=False, normalize_embeddings=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def load_test(model, questions: list[str], concurrency: int, requests_per_client: int) -> dict:
+    workloads = [random.choices(questions, k=requests_per_client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = [latency for result in executor.map(lambda w: client(model, w), workloads) for latency in result]
+    elapsed = time.perf_counter() - start
+    return {
+        "p50": round(float(np.percentile(latencies, 50)), 1),
+        "p95": round(float(np.percentile(latencies, 95)), 1),
+        "p99": round(float(np.percentile(latencies, 99)), 1),
+        "qps": round(len(latencies) / elapsed, 1),
+    }
+
+
+def main():
+    with open(os.path.join(CURRENT_DIR, "data", "micro_batching.json"), "r") as f:
+        params = json.load(f)
+    with open(os.path.join(APP_DATA_DIR, params["qa_references_file"]), "r") as f:
+        qa_references = [json.loads(line) for line in f]
+    random.seed(params["seed"])
+    questions = [question for _, question in sample_questions(qa_references)]
+
+    model = get_sentence_transformer()
+    batched_model = MicroBatchingEncoder(model, max_batch_size=params["max_batch_size"], max_wait_ms=params["max_wait_ms"])
+    client(model, questions[:5])
+
+    lines = [
+        f"Micro-batching benchmark - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Requests per client: {params['requests_per_client']}, max batch size: {params['max_batch_size']}, "
+        f"max wait: {params['max_wait_ms']} ms",
+        "",
+        f"{'Clients':>8}{'Mode':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'QPS':>9}",
+    ]
+    for concurrency in params["concurrency"]:
+        for mode, encoder in (("direct", model), ("batched", batched_model)):
+            random.seed(params["seed"])
+            result = load_test(encoder, questions, concurrency, params["requests_per_client"])
+            lines.append(f"{concurrency:>8}{mode:>10}{result['p50']:>10}{result['p95']:>10}{result['p99']:>10}{result['qps']:>9}")
+    lines.append(f"Batcher stats: {batched_model.batcher.stats()}")
+    report = "\n".join(lines)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_file = os.path.join(OUTPUT_DIR, f"micro_batching_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(output_file, "w") as f:
+        f.write(report + "\n")
+    print(report)
+    print(f"Report saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
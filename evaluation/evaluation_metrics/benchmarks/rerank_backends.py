@@ -0,0 +1,131 @@
+"""
+Latency and ranking agreement of the reranker backends on CPU.
+
+Scores the same (question, candidate chunks) sets with the PyTorch FlagEmbedding reranker, which is
+the reference, and with its ONNX Runtime export in fp32 and int8, for each configured number of
+intra-op threads. Agreement is measured per query as top-1 agreement, Spearman correlation of the
+rankings and mean absolute difference of the normalized scores.
+
+Usage:
+    python -m evaluation.evaluation_metrics.benchmarks.rerank_backends
+"""
+
+from datetime import datetime
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from app.config.settings import settings
+from app.evaluation.retrieval.sampling import sample_questions
+from app.models.onnx_runtime import onnx_model_dir
+from app.services.reranking import OnnxCrossEncoder, RerankingService
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+APP_DATA_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "..", "app", "data"))
+FHIR_DATA_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "fhir"))
+OUTPUT_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "benchmarks"))
+
+
+def load_query_sets(params: dict) -> list[tuple[str, list[str]]]:
+    with open(os.path.join(APP_DATA_DIR, params["qa_references_file"]), "r") as f:
+        qa_references = [json.loads(line) for line in f]
+    with open(os.path.join(FHIR_DATA_DIR, params["chunks_file"]), "r") as f:
+        chunks = [str(entry["resource"]) for entry in json.load(f)["entry"]]
+
+    random.seed(params["seed"])
+    questions = [question for _, question in sample_questions(qa_references)][: params["num_queries"]]
+    return [(question, random.sample(chunks, params["candidates_per_query"])) for question in questions]
+
+
+def score_all(reranker, query_sets: list[tuple[str, list[str]]], batch_size: int, repeats: int) -> tuple[list, list]:
+    """Scores every query set `repeats` times; returns the scores of the last run and the per-query latencies in ms."""
+    latencies = []
+    for _ in range(repeats):
+        scores = []
+        for query, contents in query_sets:
+            start = time.perf_counter()
+            result = reranker.compute_score([[query, content] for content in contents], batch_size=batch_size, normalize=True)
+            latencies.append((time.perf_counter() - start) * 1000)
+            scores.append(np.asarray(result if isinstance(result, list) else [result], dtype=np.float32))
+    return scores, latencies
+
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    rank_a = np.argsort(np.argsort(a)).astype(np.float64)
+    rank_b = np.argsort(np.argsort(b)).astype(np.float64)
+    if rank_a.std() == 0 or rank_b.std() == 0:
+        return 1.0
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def agreement(reference: list[np.ndarray], scores: list[np.ndarray]) -> dict:
+    return {
+        "top1": round(float(np.mean([np.argmax(r) == np.argmax(s) for r, s in zip(reference, scores)])), 3),
+        "spearman": round(float(np.mean([spearman(r, s) for r, s in zip(reference, scores)])), 4),
+        "score_mae": round(float(np.mean([np.abs(r - s).mean() for r, s in zip(reference, scores)])), 4),
+    }
+
+
+def latency_stats(latencies: list[float]) -> dict:
+    return {"p50": round(float(np.percentile(latencies, 50)), 1), "p95": round(float(np.percentile(latencies, 95)), 1)}
+
+
+def main():
+    with open(os.path.join(CURRENT_DIR, "data", "rerank_backends.json"), "r") as f:
+        params = json.load(f)
+    query_sets = load_query_sets(params)
+    batch_size = settings.model.rerank_batch_size
+    model_name = settings.model.reranker_model_name
+
+    # Warm up with a single query set so model loading and export are not measured
+    reference_reranker = RerankingService(model_name=model_name).reranker
+    score_all(reference_reranker, query_sets[:1], batch_size, 1)
+    reference, latencies = score_all(reference_reranker, query_sets, batch_size, params["repeats"])
+    rows = [
+        {"backend": "torch", "threads": "-", "latency": latency_stats(latencies), "agreement": agreement(reference, reference)}
+    ]
+    del reference_reranker
+
+    model_dir = onnx_model_dir(settings.model.onnx_dir, model_name)
+    for quantize in (False, True):
+        for num_threads in params["num_threads"]:
+            reranker = OnnxCrossEncoder(model_name, model_dir, quantize=quantize, num_threads=num_threads)
+            score_all(reranker, query_sets[:1], batch_size, 1)
+            scores, latencies = score_all(reranker, query_sets, batch_size, params["repeats"])
+            rows.append(
+                {
+                    "backend": "onnx int8" if quantize else "onnx fp32",
+                    "threads": num_threads or "all",
+                    "latency": latency_stats(latencies),
+                    "agreement": agreement(reference, scores),
+                }
+            )
+
+    lines = [
+        f"Reranker backends benchmark - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Model: {model_name}, queries: {len(query_sets)}, candidates per query: {params['candidates_per_query']}, "
+        f"batch size: {batch_size}, repeats: {params['repeats']}",
+        "",
+        f"{'Backend':<12}{'Threads':>8}{'p50 (ms)':>10}{'p95 (ms)':>10}{'Top-1':>8}{'Spearman':>10}{'Score MAE':>11}",
+    ]
+    for row in rows:
+        lines.append(
+            f"{row['backend']:<12}{row['threads']:>8}{row['latency']['p50']:>10}{row['latency']['p95']:>10}"
+            f"{row['agreement']['top1']:>8}{row['agreement']['spearman']:>10}{row['agreement']['score_mae']:>11}"
+        )
+    report = "\n".join(lines)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_file = os.path.join(OUTPUT_DIR, f"rerank_backends_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(output_file, "w") as f:
+        f.write(report + "\n")
+    print(report)
+    print(f"Report saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
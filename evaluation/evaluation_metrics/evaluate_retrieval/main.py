@@ -35,7 +35,9 @@ if __name__ == "__main__":
     endpoint_url = params["endpoint_url"]
     experiment_name = params["experiment_name"]
     methodology = params["methodology"]
-    boosting_combinations = params.get("boosting_combinations", [])
+    fusion = params["search_strategy"].get("fusion", "sum")
+    # Reciprocal rank fusion ignores the boosts, so there is nothing to sweep
+    boosting_combinations = params.get("boosting_combinations", []) if fusion == "sum" else []
 
     # Create task if boosting_combinations is empty
     task = None
@@ -101,6 +103,7 @@ if __name__ == "__main__":
             endpoint_url,
             params["search_strategy"]["text_boost"],
             params["search_strategy"]["embedding_boost"],
+            fusion=fusion,
         )
 
         # Upload metrics to ClearML
@@ -0,0 +1,151 @@
+"""
+Recall vs memory report for the vector quantization options of the knn index.
+
+Copies the source index (float vectors) into one knn index per quantization option, runs the
+retrieval evaluation on each of them and compares it with the exact script_score search on the
+source index. Queries are sent in the vector format read from the mapping of each index. Vector memory
+is estimated with the Elasticsearch sizing formulas for HNSW.
+
+Usage:
+    python -m evaluation.evaluation_metrics.evaluate_retrieval.quantization_report
+"""
+
+from collections import Counter
+from datetime import datetime
+import json
+import os
+import random
+
+from app import embedding_model, es_client
+from app.config.elasticsearch_config import get_index_quantization
+from app.config.settings import logger, settings
+from app.db.migrate_index import migrate_to_knn_index
+from app.evaluation.retrieval.retrieval_metrics import evaluate_resources_summaries_retrieval
+from app.evaluation.retrieval.sampling import sample_questions
+from app.services.search_documents import fetch_all_documents, search_queries
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+APP_DATA_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "..", "app", "data"))
+OUTPUT_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "data", "rag_retrieval"))
+
+
+def estimate_vector_memory(num_vectors: int, dims: int, quantization: str) -> int:
+    """Off-heap memory needed to keep the HNSW graph and its vectors in the page cache, in bytes."""
+    if quantization == "byte":
+        return num_vectors * (dims + 12)
+    if quantization == "int8_hnsw":
+        return num_vectors * (dims + 4 + 12)
+    return num_vectors * 4 * (dims + 12)
+
+
+def store_size(index_name: str) -> int:
+    return es_client.indices.stats(index=index_name, metric="store")["_all"]["primaries"]["store"]["size_in_bytes"]
+
+
+def top_k_ids(questions: list[str], index_name: str, retrieval_mode: str, quantization: str, params: dict) -> list[set]:
+    results = search_queries(
+        questions,
+        embedding_model,
+        es_client,
+        index_name=index_name,
+        k=params["k"],
+        text_boost=params["text_boost"],
+        embedding_boost=params["embedding_boost"],
+        retrieval_mode=retrieval_mode,
+        num_candidates=params["num_candidates"],
+        quantization=quantization,
+    )
+    return [{(result.metadata.get("resource_id"), result.content) for result in query_results} for query_results in results]
+
+
+def evaluate(
+    index_name: str, retrieval_mode: str, quantization: str, qa_references: list[dict], resources_counts: dict, params: dict
+) -> dict:
+    random.seed(params["seed"])
+    return evaluate_resources_summaries_retrieval(
+        es_client=es_client,
+        embedding_model=embedding_model,
+        resource_chunk_counts=resources_counts,
+        qa_references=qa_references,
+        search_text_boost=params["text_boost"],
+        search_embedding_boost=params["embedding_boost"],
+        k=params["k"],
+        index_name=index_name,
+        retrieval_mode=retrieval_mode,
+        quantization=quantization,
+    )
+
+
+def main():
+    with open(os.path.join(CURRENT_DIR, "data", "quantization_report.json"), "r") as f:
+        params = json.load(f)
+    with open(os.path.join(APP_DATA_DIR, params["qa_references_file"]), "r") as f:
+        qa_references = [json.loads(line) for line in f]
+
+    source_index = params["source_index"]
+    resources_counts = Counter(document["metadata"]["resource_id"] for document in fetch_all_documents(es_client, source_index))
+    num_vectors = sum(resources_counts.values())
+    dims = settings.elasticsearch.embedding_dims
+
+    random.seed(params["seed"])
+    questions = [question for _, question in sample_questions(qa_references)]
+
+    # Exact search on the source index is the reference for the approximate recall
+    source_quantization = get_index_quantization(es_client, source_index)
+    exact_ids = top_k_ids(questions, source_index, "script_score", source_quantization, params)
+    rows = [
+        {
+            "index": source_index,
+            "mode": f"script_score (exact, {source_quantization})",
+            "metrics": evaluate(source_index, "script_score", source_quantization, qa_references, resources_counts, params),
+            "recall_vs_exact": 1.0,
+            "vector_memory": estimate_vector_memory(num_vectors, dims, source_quantization),
+            "store_size": store_size(source_index),
+        }
+    ]
+
+    for quantization in params["quantizations"]:
+        dest_index = f"{source_index}-knn-{quantization}"
+        if not es_client.indices.exists(index=dest_index):
+            migrate_to_knn_index(es_client, source_index, dest_index, knn=True, quantization=quantization)
+        # Queries must be sent in the vector format of the index, which may predate this run
+        index_quantization = get_index_quantization(es_client, dest_index)
+        if index_quantization != quantization:
+            logger.warning(f"{dest_index} already exists with {index_quantization} vectors, reporting it as such")
+        knn_ids = top_k_ids(questions, dest_index, "knn", index_quantization, params)
+        overlaps = [len(exact & approx) / len(exact) for exact, approx in zip(exact_ids, knn_ids) if exact]
+        rows.append(
+            {
+                "index": dest_index,
+                "mode": f"knn ({index_quantization})",
+                "metrics": evaluate(dest_index, "knn", index_quantization, qa_references, resources_counts, params),
+                "recall_vs_exact": round(sum(overlaps) / len(overlaps), 3) if overlaps else 0,
+                "vector_memory": estimate_vector_memory(num_vectors, dims, index_quantization),
+                "store_size": store_size(dest_index),
+            }
+        )
+
+    lines = [
+        f"Vector quantization report - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Documents: {num_vectors}, dims: {dims}, questions: {len(questions)}, k: {params['k']}, "
+        f"num_candidates: {params['num_candidates']}",
+        "",
+        f"{'Mode':<28}{'Recall vs exact':>16}{'Accuracy':>10}{'MRR':>8}{'Vector RAM (MB)':>17}{'Disk (MB)':>11}",
+    ]
+    for row in rows:
+        lines.append(
+            f"{row['mode']:<28}{row['recall_vs_exact']:>16}{row['metrics']['Retrieval Accuracy']:>10}"
+            f"{row['metrics']['MRR']:>8}{row['vector_memory'] / 1e6:>17.2f}{row['store_size'] / 1e6:>11.2f}"
+        )
+    report = "\n".join(lines)
+
+    output_file = os.path.join(OUTPUT_DIR, f"quantization_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(output_file, "w") as f:
+        f.write(report + "\n")
+    print(report)
+    print(f"Report saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import asyncio
+from functools import partial
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("elasticsearch")
+
+from elasticsearch import JsonSerializer  # noqa: E402
+
+from app.db.bulk_indexer import (  # noqa: E402
+    BULK_INGEST_SETTINGS,
+    bulk_ingest_mode,
+    in_bulk_ingest_mode,
+    index_actions,
+    index_in_thread,
+)
+
+
+INDEX_NAME = "test-index"
+
+
+class FakeIndicesClient:
+    def __init__(self, settings: dict):
+        self.settings = dict(settings)
+        self.refreshes = 0
+        self.merges = []
+
+    def get_settings(self, index: str, name: list[str], flat_settings: bool):
+        settings = {key: value for key, value in self.settings.items() if key in name}
+        return SimpleNamespace(body={index: {"settings": settings}})
+
+    def put_settings(self, index: str, settings: dict):
+        for name, value in settings.items():
+            if value is None:
+                self.settings.pop(name, None)
+            else:
+                self.settings[name] = value
+
+    def refresh(self, index: str):
+        self.refreshes += 1
+
+    def forcemerge(self, index: str, max_num_segments: int):
+        self.merges.append(max_num_segments)
+
+
+def fake_client(settings: dict):
+    return SimpleNamespace(indices=FakeIndicesClient(settings))
+
+
+def test_bulk_ingest_mode_restores_settings():
+    es_client = fake_client({"index.refresh_interval": "5s", "index.number_of_replicas": "1"})
+    with bulk_ingest_mode(es_client, INDEX_NAME, max_num_segments=1):
+        assert es_client.indices.settings == BULK_INGEST_SETTINGS
+        assert in_bulk_ingest_mode(INDEX_NAME)
+    assert es_client.indices.settings == {"index.refresh_interval": "5s", "index.number_of_replicas": "1"}
+    assert not in_bulk_ingest_mode(INDEX_NAME)
+    assert es_client.indices.refreshes == 1
+    assert es_client.indices.merges == [1]
+
+
+def test_bulk_ingest_mode_resets_settings_left_by_an_interrupted_load():
+    es_client = fake_client(BULK_INGEST_SETTINGS)
+    with bulk_ingest_mode(es_client, INDEX_NAME):
+        assert es_client.indices.settings == BULK_INGEST_SETTINGS
+    assert es_client.indices.settings == {}
+
+
+def test_bulk_ingest_mode_restores_settings_when_the_load_fails():
+    es_client = fake_client({})
+    with pytest.raises(RuntimeError):
+        with bulk_ingest_mode(es_client, INDEX_NAME, max_num_segments=1):
+            raise RuntimeError("load failed")
+    assert es_client.indices.settings == {}
+    assert es_client.indices.merges == []
+
+
+class FakeBulkClient:
+    """Client accepted by streaming_bulk, taking a little time per bulk request and counting the documents indexed."""
+
+    def __init__(self, request_seconds: float = 0.01):
+        self.request_seconds = request_seconds
+        self.indexed = 0
+        self._lock = threading.Lock()
+        self.transport = SimpleNamespace(serializers=SimpleNamespace(get_serializer=lambda mimetype: JsonSerializer()))
+
+    def options(self, **kwargs):
+        return self
+
+    def bulk(self, operations: list, **kwargs):
+        time.sleep(self.request_seconds)
+        headers = [json.loads(operation) for operation in operations[::2]]
+        with self._lock:
+            self.indexed += len(headers)
+        return SimpleNamespace(body={"items": [{"index": {"_id": header["index"]["_id"], "status": 201}} for header in headers]})
+
+
+def endless_actions():
+    doc_id = 0
+    while True:
+        doc_id += 1
+        yield {"_index": INDEX_NAME, "_id": str(doc_id), "_source": {"content": "text"}}
+
+
+def test_index_in_thread_returns_the_summary():
+    es_client = FakeBulkClient(request_seconds=0)
+    actions = ({"_index": INDEX_NAME, "_id": str(doc_id), "_source": {}} for doc_id in range(250))
+    summary = asyncio.run(index_in_thread(partial(index_actions, es_client, thread_count=2, chunk_size=50), actions))
+    assert summary.indexed == es_client.indexed == 250
+
+
+def test_cancelled_index_actions_stops_writing_before_the_cancellation_propagates():
+    es_client = FakeBulkClient()
+    threads_before = threading.active_count()
+
+    async def cancel_running_load():
+        task = asyncio.create_task(
+            index_in_thread(partial(index_actions, es_client, thread_count=4, chunk_size=10), endless_actions())
+        )
+        while es_client.indexed < 100:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_running_load())
+    indexed = es_client.indexed
+    time.sleep(0.1)
+    assert es_client.indexed == indexed
+    assert threading.active_count() == threads_before
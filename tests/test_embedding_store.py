@@ -0,0 +1,71 @@
+import sqlite3
+
+import numpy as np
+
+from app.services.embedding_store import EmbeddingStore, text_digest
+
+
+MODEL = "test-model"
+
+
+def vector(value: float) -> np.ndarray:
+    return np.array([value, 1.0, 0.0, 0.0], dtype=np.float32)
+
+
+def stored_last_used(path: str) -> dict:
+    with sqlite3.connect(path) as connection:
+        return dict(connection.execute("SELECT digest, last_used FROM embeddings").fetchall())
+
+
+def test_hits_are_written_with_the_next_put(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    store = EmbeddingStore(path, max_bytes=1 << 20)
+    store.put_many(MODEL, [("a", vector(1)), ("b", vector(2))])
+    before = stored_last_used(path)
+
+    assert set(store.get_many(MODEL, ["a", "b", "c"])) == {"a", "b"}
+    assert (store.hits, store.misses) == (2, 1)
+    assert stored_last_used(path) == before
+
+    store.put_many(MODEL, [("c", vector(3))])
+    after = stored_last_used(path)
+    assert after["a"] > before["a"] and after["b"] > before["b"]
+    store.close()
+
+
+def test_hits_are_flushed_after_touch_flush_seconds(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    store = EmbeddingStore(path, max_bytes=1 << 20, touch_flush_seconds=0)
+    store.put_many(MODEL, [("a", vector(1))])
+    before = stored_last_used(path)
+    store.get_many(MODEL, ["a"])
+    assert stored_last_used(path)["a"] > before["a"]
+    store.close()
+
+
+def test_eviction_keeps_the_recently_read_vectors(tmp_path):
+    vector_bytes = len(vector(0).astype(np.float16).tobytes())
+    store = EmbeddingStore(str(tmp_path / "store.sqlite"), max_bytes=4 * vector_bytes)
+    store.put_many(MODEL, [("a", vector(1)), ("b", vector(2)), ("c", vector(3)), ("d", vector(4))])
+    store.get_many(MODEL, ["a"])
+    # Over the limit: evicted down to 90% of it, the two least recently used vectors
+    store.put_many(MODEL, [("e", vector(5))])
+    assert set(store.get_many(MODEL, ["a", "b", "c", "d", "e"])) == {"a", "d", "e"}
+    store.close()
+
+
+def test_encode_reads_back_stored_vectors(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "store.sqlite"), max_bytes=1 << 20)
+    encoded = []
+
+    def encode(texts):
+        encoded.extend(texts)
+        return [vector(len(text)) for text in texts]
+
+    first = store.encode(["x", "yy", "x"], MODEL, encode)
+    second = store.encode(["yy", "zzz"], MODEL, encode)
+    assert encoded == ["x", "yy", "zzz"]
+    # Stored vectors are read back normalized
+    np.testing.assert_allclose(first[1] / np.linalg.norm(first[1]), second[0], atol=1e-3)
+    assert set(store.get_many(MODEL, [text_digest("x")])) == {text_digest("x")}
+    store.close()
@@ -0,0 +1,153 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("elasticsearch")
+pytest.importorskip("sentence_transformers")
+
+import app  # noqa: E402
+
+# index_documents binds the app services when imported: leave them unset rather than loading the models and
+# creating the clients, the tests patch in the ones they use
+if app._services is None:
+    app._services = dict.fromkeys(app.SERVICES)
+
+from app.db import index_documents  # noqa: E402
+from app.db.index_documents import (  # noqa: E402
+    async_delete_stale_documents,
+    async_index_fhir_data,
+    check_resource_id_mapping,
+    stale_documents_queries,
+)
+from app.db.local_index import LocalVectorIndex  # noqa: E402
+
+
+INDEX_NAME = "test-index"
+
+
+class FakeAsyncIndicesClient:
+    def __init__(self, resource_id_type: str):
+        self.resource_id_type = resource_id_type
+
+    async def get_field_mapping(self, index: str, fields: str):
+        mappings = {}
+        if self.resource_id_type is not None:
+            mappings[fields] = {"full_name": fields, "mapping": {"resource_id": {"type": self.resource_id_type}}}
+        return SimpleNamespace(body={index: {"mappings": mappings}})
+
+
+class FakeAsyncClient:
+    """Answers the composite aggregation over metadata.resource_id from indexed_resource_ids and records the deletes."""
+
+    def __init__(self, indexed_resource_ids: list, resource_id_type: str = "keyword"):
+        self.indexed_resource_ids = indexed_resource_ids
+        self.indices = FakeAsyncIndicesClient(resource_id_type)
+        self.deletes = []
+
+    async def search(self, index: str, size: int, aggs: dict):
+        composite = aggs["resource_ids"]["composite"]
+        start = 0
+        if "after" in composite:
+            start = self.indexed_resource_ids.index(composite["after"]["resource_id"]) + 1
+        page = self.indexed_resource_ids[start : start + composite["size"]]
+        aggregation = {"buckets": [{"key": {"resource_id": resource_id}, "doc_count": 1} for resource_id in page]}
+        if page:
+            aggregation["after_key"] = {"resource_id": page[-1]}
+        return {"aggregations": {"resource_ids": aggregation}}
+
+    async def delete_by_query(self, index: str, query: dict, conflicts: str):
+        self.deletes.append(query)
+        return {"deleted": 1}
+
+
+class FakeEncoder:
+    def encode(self, texts: list[str], **kwargs) -> np.ndarray:
+        return np.array([[1.0, float(len(text))] for text in texts], dtype=np.float32)
+
+
+def test_stale_documents_queries_chunk_the_resource_ids():
+    seen_ids = {"a": {"a:0:1"}, "b": {"b:0:1", "b:1:1"}, "c": {"c:0:1"}}
+    queries = stale_documents_queries(seen_ids, ["a", "b", "c", "d", "e", "f"], terms_per_query=2)
+    assert queries == [
+        {
+            "bool": {
+                "filter": [{"terms": {"metadata.resource_id": ["a", "b"]}}],
+                "must_not": [{"ids": {"values": ["a:0:1", "b:0:1", "b:1:1"]}}],
+            }
+        },
+        {"bool": {"filter": [{"terms": {"metadata.resource_id": ["c"]}}], "must_not": [{"ids": {"values": ["c:0:1"]}}]}},
+        {"bool": {"filter": [{"terms": {"metadata.resource_id": ["d", "e"]}}]}},
+        {"bool": {"filter": [{"terms": {"metadata.resource_id": ["f"]}}]}},
+    ]
+
+
+def test_stale_documents_queries_keep_ingested_documents_without_resource_id():
+    seen_ids = {"a": {"a:0:1"}, None: {"content:2", "content:1"}}
+    queries = stale_documents_queries(seen_ids, [None, "a"])
+    assert queries[1:] == [
+        {"bool": {"must_not": [{"exists": {"field": "metadata.resource_id"}}, {"ids": {"values": ["content:1", "content:2"]}}]}}
+    ]
+    queries = stale_documents_queries({"a": {"a:0:1"}}, [None, "a"])
+    assert queries[1:] == [{"bool": {"must_not": [{"exists": {"field": "metadata.resource_id"}}]}}]
+
+
+@pytest.mark.parametrize("resource_id_type", ["text", None])
+def test_stale_documents_are_not_deleted_without_keyword_resource_ids(resource_id_type):
+    es_client = FakeAsyncClient(["a", "b"], resource_id_type)
+    with pytest.raises(ValueError):
+        asyncio.run(check_resource_id_mapping(INDEX_NAME, es_client))
+    with pytest.raises(ValueError):
+        asyncio.run(async_delete_stale_documents({"a": {"a:0:1"}}, INDEX_NAME, es_client, delete_missing=True))
+    assert es_client.deletes == []
+
+
+def test_delete_missing_pages_the_indexed_resource_ids(monkeypatch):
+    monkeypatch.setattr(index_documents, "local_index", None)
+    indexed_resource_ids = [f"r{i:04d}" for i in range(2500)]
+    es_client = FakeAsyncClient(indexed_resource_ids)
+    deleted = asyncio.run(async_delete_stale_documents({"r0000": {"r0000:0:1"}}, INDEX_NAME, es_client, delete_missing=True))
+    assert deleted == len(es_client.deletes) == 4
+    assert es_client.deletes[0]["bool"]["must_not"] == [{"ids": {"values": ["r0000:0:1"]}}]
+    assert [query["bool"]["filter"][0]["terms"]["metadata.resource_id"] for query in es_client.deletes[1:]] == [
+        indexed_resource_ids[1:1001],
+        indexed_resource_ids[1001:2001],
+        indexed_resource_ids[2001:],
+    ]
+
+
+def test_delete_missing_keeps_ingested_documents_without_resource_id(monkeypatch, tmp_path):
+    monkeypatch.setattr(index_documents, "local_index", LocalVectorIndex(str(tmp_path)))
+
+    def ingest(data: list[dict]):
+        return asyncio.run(
+            async_index_fhir_data(data, "text", FakeEncoder(), INDEX_NAME, async_es_client=None, delete_missing=True)
+        )
+
+    ingest([{"resource_id": "a", "text": "first"}, {"text": "no id"}, {"text": "other"}])
+    assert sorted(document["content"] for document in index_documents.local_index.iter_documents()) == [
+        "first",
+        "no id",
+        "other",
+    ]
+
+    summary = ingest([{"resource_id": "b", "text": "second"}, {"text": "no id"}])
+    assert summary.deleted == 2
+    assert sorted(document["content"] for document in index_documents.local_index.iter_documents()) == ["no id", "second"]
+
+
+def test_documents_without_resource_id_keep_their_ids_when_the_upload_is_reordered(monkeypatch, tmp_path):
+    monkeypatch.setattr(index_documents, "local_index", LocalVectorIndex(str(tmp_path)))
+
+    def ingest(data: list[dict]):
+        return asyncio.run(async_index_fhir_data(data, "text", FakeEncoder(), INDEX_NAME, async_es_client=None))
+
+    summary = ingest([{"text": "first"}, {"text": "second"}, {"text": "first"}])
+    assert (summary.indexed, summary.skipped) == (2, 0)
+    ids = {document["content"]: document["id"] for document in index_documents.local_index.iter_documents()}
+
+    summary = ingest([{"text": "new"}, {"text": "second"}, {"text": "first"}])
+    assert (summary.indexed, summary.skipped, summary.deleted) == (1, 2, 0)
+    documents = {document["content"]: document["id"] for document in index_documents.local_index.iter_documents()}
+    assert documents == {**ids, "new": documents["new"]}
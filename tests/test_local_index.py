@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from app.db.local_index import LocalVectorIndex
+
+
+def action(doc_id: str, content: str, embedding: list[float]) -> dict:
+    return {"_id": doc_id, "_source": {"content": content, "embedding": embedding, "metadata": {"resource_id": doc_id}}}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    index.bulk([action("a", "blood pressure", [1.0, 0.0]), action("b", "heart rate", [0.0, 1.0])])
+    return index
+
+
+def test_bulk_failing_midway_leaves_index_unchanged(index, tmp_path):
+    def actions():
+        yield action("a", "replaced", [0.0, 1.0])
+        yield action("c", "new document", [1.0, 1.0])
+        raise ValueError("malformed upload")
+
+    with pytest.raises(ValueError):
+        index.bulk(actions())
+
+    for current in (index, LocalVectorIndex(str(tmp_path))):
+        assert len(current) == 2
+        assert current.existing_ids(["a", "b", "c"]) == {"a", "b"}
+        assert [document["content"] for document in current.iter_documents()] == ["blood pressure", "heart rate"]
+        np.testing.assert_array_equal(current.snapshot().embeddings, [[1.0, 0.0], [0.0, 1.0]])
+        hits = current.search("blood pressure", [1.0, 0.0], size=3)
+        assert [hit["_id"] for hit in hits] == ["a", "b"]
+
+
+def test_snapshot_is_not_modified_by_later_writes(index):
+    snapshot = index.snapshot()
+    index.bulk([action("a", "replaced", [0.0, 1.0]), action("c", "new document", [1.0, 1.0])])
+    index.delete_documents(lambda document: document["id"] == "b")
+
+    assert [document["id"] for document in snapshot.documents] == ["a", "b"]
+    assert snapshot.documents[0]["content"] == "blood pressure"
+    assert [document["id"] for document in index.iter_documents()] == ["a", "c"]
+    assert index.existing_ids(["a", "b", "c"]) == {"a", "c"}